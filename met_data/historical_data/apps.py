@@ -1,5 +1,26 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class HistoricalDataConfig(AppConfig):
     name = 'historical_data'
+
+    def ready(self):
+        connection_created.connect(configure_sqlite_connection)
+        from historical_data.data.handlers import get_dataset_version
+        from historical_data.data.series_store import preload_series_store
+        preload_series_store(get_dataset_version)
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """Puts SQLite databases into write-ahead logging mode.
+
+    In WAL mode readers see the last committed data while a write is in
+    progress, rather than waiting for the write lock, so the web workers are
+    not held up by an ingest.
+    """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
@@ -1,7 +1,30 @@
-from historical_data.data.handlers import get_time_series, create_or_update_data_point
-from historical_data.data.met_data_getter import get_met_data
+# The fetching and parsing functions are not imported here, so that the web
+# workers, which never fetch anything, do not import requests. Import them
+# from historical_data.data.met_data_getter instead.
+from historical_data.data.handlers import (
+    get_time_series,
+    get_compact_time_series,
+    get_batch_time_series,
+    get_aggregate_series,
+    get_rolling_means_and_anomalies,
+    get_region_statistics,
+    get_climatology,
+    get_dataset_version,
+    iter_data_points,
+    bump_dataset_version,
+    create_or_update_data_point,
+    sync_aggregate_points,
+    merge_datasets,
+    refresh_climatology,
+    has_climatology,
+    ROLLING_MEAN_WINDOWS)
+from historical_data.data.series_store import write_snapshot
+from historical_data.data.cache import create_etag, get_or_compute
 from historical_data.data.data_types import (
+    AggregatePoint,
+    Dataset,
     DataPoint,
     Month,
+    Period,
     Region,
     ValueType)
@@ -0,0 +1,251 @@
+from numpy import abs as absolute
+from numpy import (
+    arange,
+    argmax,
+    concatenate,
+    cumsum,
+    errstate,
+    full,
+    inf,
+    interp,
+    isnan,
+    nan,
+    nanmax,
+    nanmean,
+    nanmin,
+    nanpercentile,
+    nanstd,
+    nansum,
+    newaxis,
+    sqrt,
+    where,
+    zeros)
+
+
+def largest_triangle_three_buckets(values, threshold):
+    """Chooses which columns to keep when downsampling aligned series.
+
+    Uses the Largest-Triangle-Three-Buckets algorithm, which keeps the first
+    and last columns and, from each of threshold - 2 equally sized buckets in
+    between, the column forming the largest triangle with the column kept
+    from the previous bucket and the average of the next bucket. So that the
+    series stay aligned, the columns are chosen using the mean of the series,
+    with missing values interpolated.
+
+    Args:
+      values: A 2D array with a row for each series and a column for each
+        point. Missing values are NaN.
+      threshold: The maximum number of columns to keep.
+
+    Returns:
+      A sorted 1D array of the indices of the columns to keep. If there are
+      no more than threshold columns, or threshold is less than 3, every
+      column is kept.
+    """
+    length = values.shape[1]
+    if threshold >= length or threshold < 3:
+        return arange(length)
+
+    signal = _mean_with_interpolation(values)
+    bucket_size = (length - 2) / (threshold - 2)
+    selected = [0]
+    previous = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        next_end = min(int((bucket + 2) * bucket_size) + 1, length)
+        next_x = (end + next_end - 1) / 2
+        next_y = signal[end:next_end].mean()
+        xs = arange(start, end)
+        areas = absolute(
+            (previous - next_x) * (signal[start:end] - signal[previous])
+            - (previous - xs) * (next_y - signal[previous]))
+        previous = start + int(argmax(areas))
+        selected.append(previous)
+    selected.append(length - 1)
+    return arange(length)[selected]
+
+
+def _mean_with_interpolation(values):
+    present = ~isnan(values)
+    counts = present.sum(axis=0)
+    sums = nansum(values, axis=0)
+    has_values = counts > 0
+    if not has_values.any():
+        return sums
+    columns = arange(values.shape[1])
+    return interp(
+        columns,
+        columns[has_values],
+        sums[has_values] / counts[has_values])
+
+
+def rolling_mean(values, window):
+    """Calculates trailing moving averages of aligned series.
+
+    Args:
+      values: A 2D array with a row for each series and a column for each
+        month. Missing values are NaN.
+      window: The number of months averaged.
+
+    Returns:
+      A 2D array of the same shape, in which each value is the mean of the
+      window months ending with that month. It is NaN unless all of those
+      months have values.
+    """
+    length = values.shape[1]
+    means = full(values.shape, nan)
+    if window < 1 or window > length:
+        return means
+    present = ~isnan(values)
+    sums = _cumulative_sum(where(present, values, 0.0))
+    counts = _cumulative_sum(present.astype(int))
+    window_sums = sums[:, window:] - sums[:, :-window]
+    window_counts = counts[:, window:] - counts[:, :-window]
+    means[:, window - 1:] = where(
+        window_counts == window, window_sums / window, nan)
+    return means
+
+
+def monthly_anomalies(values, first, baseline_start, baseline_end):
+    """Calculates the anomalies of aligned monthly series from a climatology.
+
+    The climatology is the mean value for each calendar month over the
+    baseline years, calculated separately for each series.
+
+    Args:
+      values: A 2D array with a row for each series and a column for each
+        month. Missing values are NaN.
+      first: The month offset (year * 12 + month - 1) of the first column.
+      baseline_start: The first year of the baseline.
+      baseline_end: The last year of the baseline.
+
+    Returns:
+      A 2D array of the same shape holding each value minus the baseline
+      mean for its calendar month. It is NaN where the value is missing, or
+      there are no baseline values for the calendar month.
+    """
+    offsets = first + arange(values.shape[1])
+    calendar_months = offsets % 12
+    years = offsets // 12
+    in_baseline = ~isnan(values) \
+        & ((years >= baseline_start) & (years <= baseline_end))[newaxis, :]
+    is_calendar_month = zeros((values.shape[1], 12))
+    is_calendar_month[arange(values.shape[1]), calendar_months] = 1.0
+    sums = where(in_baseline, values, 0.0) @ is_calendar_month
+    counts = in_baseline.astype(float) @ is_calendar_month
+    with errstate(invalid="ignore", divide="ignore"):
+        baseline_means = where(counts > 0, sums / counts, nan)
+    return values - baseline_means[:, calendar_months]
+
+
+def least_squares_slopes(values):
+    """Fits a straight line to each series by least squares.
+
+    Missing values are skipped, so each series is fitted using only the
+    columns it has values for.
+
+    Args:
+      values: A 2D array with a row for each series and a column for each
+        evenly spaced point. Missing values are NaN.
+
+    Returns:
+      A 1D array of the slope of each series, per column. It is NaN for
+      series with fewer than two values.
+    """
+    present = ~isnan(values)
+    counts = present.sum(axis=1)
+    columns = where(present, arange(values.shape[1]), 0.0)
+    filled = where(present, values, 0.0)
+    with errstate(invalid="ignore", divide="ignore"):
+        column_means = columns.sum(axis=1) / counts
+        value_means = filled.sum(axis=1) / counts
+        column_deviations = where(present, columns - column_means[:, newaxis], 0.0)
+        value_deviations = where(present, filled - value_means[:, newaxis], 0.0)
+        slopes = (column_deviations * value_deviations).sum(axis=1) \
+            / (column_deviations ** 2).sum(axis=1)
+    return where(counts >= 2, slopes, nan)
+
+
+def pairwise_correlations(values):
+    """Calculates the Pearson correlation between every pair of series.
+
+    Each pair is correlated over the columns for which both series have
+    values, and all pairs are calculated at once with matrix products.
+
+    Args:
+      values: A 2D array with a row for each series and a column for each
+        point. Missing values are NaN.
+
+    Returns:
+      A square 2D array with the correlation of series i and j at [i, j]. It
+      is NaN where the pair has fewer than two points in common, or either
+      series is constant over them.
+    """
+    present = (~isnan(values)).astype(float)
+    filled = where(isnan(values), 0.0, values)
+    counts = present @ present.T
+    # The sums of series i, and of its squares, over the columns where
+    # series j has values.
+    sums = filled @ present.T
+    sums_of_squares = (filled ** 2) @ present.T
+    products = filled @ filled.T
+    with errstate(invalid="ignore", divide="ignore"):
+        covariances = products - sums * sums.T / counts
+        variances = sums_of_squares - sums ** 2 / counts
+        correlations = covariances / sqrt(variances * variances.T)
+    valid = (counts >= 2) & (variances > 0) & (variances.T > 0)
+    return where(valid, correlations, nan)
+
+
+def column_statistics(values, percentiles):
+    """Calculates summary statistics of each column, skipping missing values.
+
+    Args:
+      values: A 2D array, such as one with a row for each year and a column
+        for each calendar month. Missing values are NaN.
+      percentiles: An iterable of the percentiles (from 0 to 100) to
+        calculate.
+
+    Returns:
+      A dictionary of 1D arrays with an element for each column: "count",
+      "mean", "std" (the population standard deviation), "minimum",
+      "maximum", "minimum_index" and "maximum_index" (the first row at which
+      the minimum and maximum occur), and "percentiles", a 2D array with a
+      row for each percentile, linearly interpolated between the values.
+      Every statistic but the count is NaN, and each index -1, for columns
+      with no values.
+    """
+    percentiles = list(percentiles)
+    present = ~isnan(values)
+    counts = present.sum(axis=0)
+    columns = counts > 0
+    statistics = {
+        "count": counts,
+        "mean": full(values.shape[1], nan),
+        "std": full(values.shape[1], nan),
+        "minimum": full(values.shape[1], nan),
+        "maximum": full(values.shape[1], nan),
+        "minimum_index": full(values.shape[1], -1),
+        "maximum_index": full(values.shape[1], -1),
+        "percentiles": full((len(percentiles), values.shape[1]), nan)}
+    # Only columns with values are passed on, as the NaN-skipping functions
+    # warn about empty columns.
+    with_values = values[:, columns]
+    statistics["mean"][columns] = nanmean(with_values, axis=0)
+    statistics["std"][columns] = nanstd(with_values, axis=0)
+    statistics["minimum"][columns] = nanmin(with_values, axis=0)
+    statistics["maximum"][columns] = nanmax(with_values, axis=0)
+    statistics["minimum_index"][columns] = \
+        where(isnan(with_values), inf, with_values).argmin(axis=0)
+    statistics["maximum_index"][columns] = \
+        where(isnan(with_values), -inf, with_values).argmax(axis=0)
+    if percentiles and columns.any():
+        statistics["percentiles"][:, columns] = \
+            nanpercentile(with_values, percentiles, axis=0)
+    return statistics
+
+
+def _cumulative_sum(values):
+    return concatenate(
+        [zeros((values.shape[0], 1)), cumsum(values, axis=1)], axis=1)
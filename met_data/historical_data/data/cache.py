@@ -0,0 +1,114 @@
+from contextlib import contextmanager
+from hashlib import sha1
+from os import makedirs, path
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+
+from historical_data.data.handlers import get_dataset_version
+
+try:
+    from fcntl import LOCK_EX, LOCK_UN, flock
+except ImportError:  # Not available on Windows.
+    flock = None
+
+CACHE_ALIAS = "time_series"
+
+# A lock and the number of threads holding or waiting for it, for each key
+# being computed in this process.
+_key_locks = {}
+_key_locks_lock = Lock()
+
+
+def get_or_compute(name, key_parts, compute, version=None):
+    """Gets a value from the cache, computing and caching it if missing.
+
+    Cached values are tagged with the dataset version, so they are
+    invalidated by the next change to the stored data rather than by a
+    timeout. Concurrent misses on the same key are coalesced: one caller
+    computes the value while the others wait, then read it from the cache.
+    This is done within the process and, if MET_DATA_CACHE_LOCK_DIR is set,
+    across processes sharing the cache through a lock file for each key.
+
+    Args:
+      name: A string naming the kind of value, such as "time-series".
+      key_parts: An iterable of values which, together with the name,
+        identify the value. Their string forms are used in the cache key, so
+        they should be given in a normalized order.
+      compute: A callable taking no arguments that computes the value. The
+        value must not be None.
+      version: The dataset version the value is for. If not given the
+        current version is used.
+
+    Returns:
+      The cached or newly computed value.
+    """
+    key = _create_key(name, key_parts, version)
+    cache = caches[CACHE_ALIAS]
+    value = cache.get(key)
+    if value is None:
+        with _single_flight(name, key_parts, key):
+            value = cache.get(key)
+            if value is None:
+                value = compute()
+                cache.set(key, value, timeout=None)
+    return value
+
+
+@contextmanager
+def _single_flight(name, key_parts, key):
+    """Holds the locks that allow only one caller to compute a key at once."""
+    with _key_locks_lock:
+        key_lock = _key_locks.setdefault(key, [Lock(), 0])
+        key_lock[1] += 1
+    try:
+        with key_lock[0], _lock_file(name, key_parts):
+            yield
+    finally:
+        with _key_locks_lock:
+            key_lock[1] -= 1
+            if not key_lock[1]:
+                del _key_locks[key]
+
+
+@contextmanager
+def _lock_file(name, key_parts):
+    """Holds an exclusive lock on the key's file in MET_DATA_CACHE_LOCK_DIR.
+
+    The file is named for the key without the dataset version, so that there
+    is one for each kind of value rather than one for each version, and it is
+    left in place, as removing it could let two processes lock different
+    files for the same key.
+    """
+    lock_directory = getattr(settings, "MET_DATA_CACHE_LOCK_DIR", None)
+    if not lock_directory or flock is None:
+        yield
+        return
+    makedirs(lock_directory, exist_ok=True)
+    file_name = sha1(_create_key(name, key_parts, "").encode()).hexdigest()
+    with open(path.join(lock_directory, file_name + ".lock"), "a") as lock_file:
+        flock(lock_file.fileno(), LOCK_EX)
+        try:
+            yield
+        finally:
+            flock(lock_file.fileno(), LOCK_UN)
+
+
+def create_etag(name, key_parts, version=None):
+    """Creates a strong ETag for a value that would be cached by get_or_compute.
+
+    Args:
+      name, key_parts, version: As for get_or_compute.
+
+    Returns:
+      A quoted ETag string, which changes with the dataset version.
+    """
+    key = _create_key(name, key_parts, version)
+    return "\"{}\"".format(sha1(key.encode()).hexdigest())
+
+
+def _create_key(name, key_parts, version):
+    if version is None:
+        version = get_dataset_version()
+    return ":".join([name, str(version)] + [str(part) for part in key_parts])
@@ -5,6 +5,13 @@ from enum import Enum
 DataPoint = namedtuple("DataPoint", "region year month value_type value")
 
 
+AggregatePoint = namedtuple(
+    "AggregatePoint", "region year period value_type value")
+
+
+Dataset = namedtuple("Dataset", "data_points aggregate_points")
+
+
 class Month(Enum):
     JAN = 1
     FEB = 2
@@ -20,6 +27,14 @@ class Month(Enum):
     DEC = 12
 
 
+class Period(Enum):
+    WIN = 1
+    SPR = 2
+    SUM = 3
+    AUT = 4
+    ANN = 5
+
+
 class Region(Enum):
     UK = 1
     ENGLAND = 2
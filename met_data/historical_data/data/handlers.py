@@ -1,18 +1,101 @@
-from collections import defaultdict
+from base64 import b64encode
+from collections import Counter, defaultdict
+from functools import reduce
+from itertools import groupby
+from math import isnan
+from operator import or_
 
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from numpy import arange, around, array, empty, full, isfinite, nan
+
+from historical_data.data.analytics import (
+    column_statistics,
+    largest_triangle_three_buckets,
+    least_squares_slopes,
+    monthly_anomalies,
+    pairwise_correlations,
+    rolling_mean)
 from historical_data.data.models import (
+    DatasetVersion,
+    HistoricalAggregate,
+    HistoricalClimatology,
     HistoricalData,
     region_mapper,
     month_mapper,
+    period_mapper,
     value_type_mapper)
-from historical_data.data.met_data_getter import Region, Month, ValueType
+from historical_data.data.series_store import get_series_store
+from historical_data.data.data_types import Region, Month, Period, ValueType
+
+value_type_to_title_mapper = {
+    ValueType.MAX_TEMP: "Maximum Temperature",
+    ValueType.MIN_TEMP: "Minimum Temperature",
+    ValueType.MEAN_TEMP: "Mean Temperature",
+    ValueType.SUNSHINE: "Sunshine",
+    ValueType.RAINFALL: "Rainfall"}
+
+month_to_lable_string_mapper = {
+    1: "JAN",
+    2: "FEB",
+    3: "MAR",
+    4: "APR",
+    5: "MAY",
+    6: "JUN",
+    7: "JUL",
+    8: "AUG",
+    9: "SEP",
+    10: "OCT",
+    11: "NOV",
+    12: "DEC"}
+
+period_to_title_mapper = {
+    Period.WIN: "Winter",
+    Period.SPR: "Spring",
+    Period.SUM: "Summer",
+    Period.AUT: "Autumn",
+    Period.ANN: "Annual"}
+
+region_to_name_mapper = {
+    Region.UK: "UK",
+    Region.ENGLAND: "England",
+    Region.SCOTLAND: "Scotland",
+    Region.WALES: "Wales"}
+
+ROLLING_MEAN_WINDOWS = (12, 60, 360)
+
+ANOMALY_BASELINE = (1961, 1990)
+
+DERIVED_DECIMALS = 3
 
-def get_time_series(value_type, regions):
+MONTHS_PER_DECADE = 120
+
+# A merge which would leave a dataset with fewer than this fraction of its
+# stored datapoints or aggregates is refused, as the download was probably
+# truncated rather than the history revised.
+MERGE_MIN_RETAINED_FRACTION = 0.9
+
+climatology_percentile_field_mapper = {
+    10: "percentile_10",
+    25: "percentile_25",
+    50: "median",
+    75: "percentile_75",
+    90: "percentile_90"}
+
+
+def get_time_series(value_type, regions, max_points=None, start=None, end=None):
     """Gets time series data.
 
     Args:
       value_type: A valid ValueType enum.
       regions: An iterable of Region enums.
+      max_points: An optional maximum number of points per series. Longer
+        series are downsampled with largest_triangle_three_buckets, keeping
+        the same months for every region.
+      start: An optional (year, Month enum) tuple. If given, only data from
+        this month onwards is returned.
+      end: An optional (year, Month enum) tuple. If given, only data up to
+        and including this month is returned.
 
     Returns:
       A dictionary representing the time-series for the given value type
@@ -32,72 +115,522 @@ def get_time_series(value_type, regions):
             "name": "<region_name_m>",
             "data": [<value_1>, <value_2>,...,<value_n>]
           }]}
+      The labels run from the earliest to the latest month for which any of
+      the regions has data; missing values are None. If there is no data the
+      labels and each region's data are empty.
+    """
+    regions = list(regions)
+    first, values = _get_aligned_values(value_type, regions, start, end)
+    columns = _select_columns(values, max_points)
+    values = values[:, columns]
+
+    return {
+        "value_type": value_type_to_title_mapper[value_type],
+        "labels": _create_labels(first + columns),
+        "series": [
+            {
+                "name": region_to_name_mapper[region],
+                "data": _to_list_with_nones(region_values)}
+            for region, region_values in zip(regions, values)]}
+
+
+def get_batch_time_series(
+        value_types,
+        regions,
+        max_points=None,
+        start=None,
+        end=None):
+    """Gets the time series for several value types with a shared label axis.
+
+    All of the value types are read with a single query.
+
+    Args:
+      value_types: An iterable of ValueType enums.
+      regions: An iterable of Region enums.
+      max_points, start, end: As for get_time_series. When downsampling, the
+        same months are kept for every value type and region.
+
+    Returns:
+      A dictionary of the following form:
+        {
+          "labels": ["<date_1>", "<date_2>",...,"<date_n>"],
+          "time_series": [{
+            "value_type": "<value_type_1>",
+            "series": [{
+              "name": "<region_name_1>",
+              "data": [<value_1>, <value_2>,...,<value_n>]
+            },{
+              ...
+            }]
+          },{
+            ...
+          }]}
+      The labels run from the earliest to the latest month for which any
+      value type and region has data; missing values are None.
     """
-    value_type_to_title_mapper = {
-        ValueType.MAX_TEMP: "Maximum Temperature",
-        ValueType.MIN_TEMP: "Minimum Temperature",
-        ValueType.MEAN_TEMP: "Mean Temperature",
-        ValueType.SUNSHINE: "Sunshine",
-        ValueType.RAINFALL: "Rainfall"}
-
-    month_to_lable_string_mapper = {
-        1: "JAN",
-        2: "FEB",
-        3: "MAR",
-        4: "APR",
-        5: "MAY",
-        6: "JUN",
-        7: "JUL",
-        8: "AUG",
-        9: "SEP",
-        10: "OCT",
-        11: "NOV",
-        12: "DEC"}
-
-    region_to_name_mapper = {
-        Region.UK: "UK",
-        Region.ENGLAND: "England",
-        Region.SCOTLAND: "Scotland",
-        Region.WALES: "Wales"}
+    value_types = list(value_types)
+    regions = list(regions)
+    first, values = _get_aligned_values_for_value_types(
+        value_types, regions, start, end)
+    columns = _select_columns(values, max_points)
+    values = values[:, columns].reshape(
+        len(value_types), len(regions), len(columns))
+
+    return {
+        "labels": _create_labels(first + columns),
+        "time_series": [
+            {
+                "value_type": value_type_to_title_mapper[value_type],
+                "series": [
+                    {
+                        "name": region_to_name_mapper[region],
+                        "data": _to_list_with_nones(region_values)}
+                    for region, region_values in zip(regions, value_type_values)]}
+            for value_type, value_type_values in zip(value_types, values)]}
+
 
+def get_compact_time_series(
+        value_type,
+        regions,
+        max_points=None,
+        start=None,
+        end=None):
+    """Gets time series data in a compact columnar form.
+
+    Rather than a label for every month, the start month and the number of
+    months are given, and each region's values are packed as little-endian
+    32 bit floats, with NaN for missing values, and base64 encoded.
+
+    Args:
+      value_type: A valid ValueType enum.
+      regions: An iterable of Region enums.
+      max_points, start, end: As for get_time_series.
+
+    Returns:
+      A dictionary of the following form:
+        {
+          "format": 2,
+          "value_type": "<value_type>",
+          "start": {"year": <year>, "month": <month>},
+          "count": <number_of_months>,
+          "series": [{
+            "name": "<region_name_1>",
+            "data": "<base64_encoded_float32_values>"
+          },{
+            ...
+          }]}
+      If there is no data, start is None and count is 0. If the series were
+      downsampled, the count is the number of months spanned and there is
+      also an "offsets" list giving, for each value, its month relative to
+      the start.
+    """
+    regions = list(regions)
+    first, values = _get_aligned_values(value_type, regions, start, end)
+    count = values.shape[1]
+    columns = _select_columns(values, max_points)
+
+    compact_time_series = {
+        "format": 2,
+        "value_type": value_type_to_title_mapper[value_type],
+        "start": {"year": first // 12, "month": first % 12 + 1} if count else None,
+        "count": count,
+        "series": [
+            {
+                "name": region_to_name_mapper[region],
+                "data": _encode_as_float32(region_values)}
+            for region, region_values in zip(regions, values[:, columns])]}
+    if len(columns) < count:
+        compact_time_series["offsets"] = columns.tolist()
+    return compact_time_series
+
+
+def get_rolling_means_and_anomalies(
+        value_type,
+        regions,
+        windows=ROLLING_MEAN_WINDOWS,
+        baseline=ANOMALY_BASELINE):
+    """Gets moving averages and anomalies of the monthly time series.
+
+    Both are calculated from the full series, so that each moving average
+    and the baseline are the same whatever is shown.
+
+    Args:
+      value_type: A valid ValueType enum.
+      regions: An iterable of Region enums.
+      windows: An iterable of the numbers of months to average over.
+      baseline: A (first_year, last_year) tuple giving the years from which
+        the mean for each calendar month is calculated.
+
+    Returns:
+      A dictionary of the following form:
+        {
+          "value_type": "<value_type>",
+          "labels": ["<date_1>", "<date_2>",...,"<date_n>"],
+          "baseline": {"start": <first_year>, "end": <last_year>},
+          "series": [{
+            "name": "<region_name_1>",
+            "data": [<value_1>, <value_2>,...,<value_n>],
+            "anomalies": [<anomaly_1>, <anomaly_2>,...,<anomaly_n>],
+            "rolling_means": {
+              "<window_1>": [<mean_1>, <mean_2>,...,<mean_n>],
+              ...
+            }
+          },{
+            ...
+          }]}
+      Moving averages and anomalies are rounded to DERIVED_DECIMALS places.
+      A moving average is None unless every month in its window has a
+      value, and an anomaly is None if the value is missing or there is no
+      baseline data for its calendar month.
+    """
+    regions = list(regions)
+    windows = sorted(set(windows))
+    first, values = _get_aligned_values(value_type, regions)
+    means = {
+        window: around(rolling_mean(values, window), DERIVED_DECIMALS)
+        for window in windows}
+    anomalies = around(
+        monthly_anomalies(values, first, *baseline), DERIVED_DECIMALS)
+
+    return {
+        "value_type": value_type_to_title_mapper[value_type],
+        "labels": _create_labels(first + arange(values.shape[1])),
+        "baseline": {"start": baseline[0], "end": baseline[1]},
+        "series": [
+            {
+                "name": region_to_name_mapper[region],
+                "data": _to_list_with_nones(values[index]),
+                "anomalies": _to_list_with_nones(anomalies[index]),
+                "rolling_means": {
+                    str(window): _to_list_with_nones(means[window][index])
+                    for window in windows}}
+            for index, region in enumerate(regions)]}
+
+
+def get_region_statistics(
+        value_type,
+        regions,
+        start=None,
+        end=None,
+        baseline=ANOMALY_BASELINE):
+    """Gets the linear trend of each region and the correlations between them.
+
+    Both are calculated from the monthly anomalies rather than the values,
+    so that the seasonal cycle neither biases the trends nor dominates the
+    correlations. The anomalies are calculated from the full series, so the
+    baseline is the same whatever range is requested. Missing months are
+    skipped: each trend uses every month its region has a value for, and
+    each correlation the months both regions have values for.
+
+    Args:
+      value_type: A valid ValueType enum.
+      regions: An iterable of Region enums.
+      start: An optional (year, Month) tuple of the first month to include.
+      end: An optional (year, Month) tuple of the last month to include.
+      baseline: A (first_year, last_year) tuple giving the years from which
+        the mean for each calendar month is calculated.
+
+    Returns:
+      A dictionary of the following form:
+        {
+          "value_type": "<value_type>",
+          "baseline": {"start": <first_year>, "end": <last_year>},
+          "regions": ["<region_name_1>",...,"<region_name_n>"],
+          "trends": [{
+            "name": "<region_name_1>",
+            "per_decade": <trend_1>,
+            "months": <number_of_months_1>
+          },{
+            ...
+          }],
+          "correlations": [
+            [<correlation_1_1>,...,<correlation_1_n>],
+            ...
+            [<correlation_n_1>,...,<correlation_n_n>]]}
+      Trends and correlations are rounded to DERIVED_DECIMALS places, and
+      are None where there are fewer than two months to calculate them from.
+    """
+    regions = list(regions)
+    first, values = _get_aligned_values(value_type, regions)
+    anomalies = monthly_anomalies(values, first, *baseline)
+    low = 0 if start is None else max(_to_offset(start) - first, 0)
+    high = anomalies.shape[1] if end is None else max(_to_offset(end) - first + 1, 0)
+    anomalies = anomalies[:, low:high]
+    trends = around(
+        least_squares_slopes(anomalies) * MONTHS_PER_DECADE, DERIVED_DECIMALS)
+    correlations = around(pairwise_correlations(anomalies), DERIVED_DECIMALS)
+    months = isfinite(anomalies).sum(axis=1).tolist()
+
+    return {
+        "value_type": value_type_to_title_mapper[value_type],
+        "baseline": {"start": baseline[0], "end": baseline[1]},
+        "regions": [region_to_name_mapper[region] for region in regions],
+        "trends": [
+            {
+                "name": region_to_name_mapper[region],
+                "per_decade": per_decade,
+                "months": region_months}
+            for region, per_decade, region_months
+            in zip(regions, _to_list_with_nones(trends), months)],
+        "correlations": [_to_list_with_nones(row) for row in correlations]}
+
+
+def _get_aligned_values(value_type, regions, start=None, end=None):
+    """Gets the values for each region aligned on a common monthly axis.
+
+    The start and end, if given, are pushed down into the query so that only
+    the requested range is read.
+
+    Returns:
+      A tuple of the month offset (year * 12 + month - 1) of the first
+      column, and a 2D array with a row of values for each region and a
+      column for each month. Missing values are NaN.
+    """
+    return _get_aligned_values_for_value_types(
+        [value_type], regions, start, end)
+
+
+def _get_aligned_values_for_value_types(
+        value_types,
+        regions,
+        start=None,
+        end=None):
+    """Gets the values for several value types with a single query.
+
+    If the in-memory series store is enabled the values are read from it
+    instead.
+
+    Returns:
+      As for _get_aligned_values, except that there is a row for each value
+      type and region, ordered by value type and then region.
+    """
+    value_type_keys = [value_type_mapper[value_type] for value_type in value_types]
+    region_keys = [region_mapper[region] for region in regions]
+    store = get_series_store(get_dataset_version)
+    if store is not None:
+        return store.get_aligned_values(
+            [
+                (value_type_key, region_key)
+                for value_type_key in value_type_keys
+                for region_key in region_keys],
+            _to_offset(start),
+            _to_offset(end))
     entries = HistoricalData.objects\
-        .filter(region__in=[region_mapper[region] for region in regions])\
-        .filter(value_type=value_type_mapper[value_type])
+        .filter(region__in=region_keys)\
+        .filter(value_type__in=value_type_keys)
+    rows = _filter_by_date_range(entries, start, end)\
+        .order_by("value_type", "region", "year", "month")\
+        .values_list("value_type", "region", "year", "month", "value")
+    row_keys = [
+        (value_type_key, region_key)
+        for value_type_key in value_type_keys
+        for region_key in region_keys]
+    if not rows:
+        return 0, empty((len(row_keys), 0))
+
+    value_type_keys, region_keys, years, months, row_values = zip(*rows)
+    offsets = array(years) * 12 + array(months) - 1
+    return _align(
+        row_keys, list(zip(value_type_keys, region_keys)), offsets, row_values)
+
+
+def _filter_by_date_range(entries, start, end):
+    if start is not None:
+        year, month = start
+        entries = entries\
+            .filter(year__gte=year)\
+            .filter(Q(year__gt=year) | Q(month__gte=month_mapper[month]))
+    if end is not None:
+        year, month = end
+        entries = entries\
+            .filter(year__lte=year)\
+            .filter(Q(year__lt=year) | Q(month__lte=month_mapper[month]))
+    return entries
 
-    potential_max = potential_min = (entries[0].year, entries[0].month)
-    dd = defaultdict(lambda: defaultdict(lambda: None))
-    for entry in entries:
-        potential_min = min((entry.year, entry.month), potential_min)
-        potential_max = max((entry.year, entry.month), potential_max)
-        dd[(entry.year, entry.month)][entry.region] = entry.value
 
-    year_month_tuples = _create_list_of_tuples(potential_min, potential_max)
+def _to_offset(year_month):
+    if year_month is None:
+        return None
+    year, month = year_month
+    return year * 12 + month_mapper[month] - 1
 
-    labels = [str(year)+"-"+month_to_lable_string_mapper[month] for year, month in year_month_tuples]
 
-    series = []
-    for region in regions:
-        d = {
-            "name": region_to_name_mapper[region],
-            "data": [dd[t][region_mapper[region]] for t in year_month_tuples]}
-        series.append(d)
+def _align(keys, row_keys, offsets, row_values):
+    row_indices = {key: index for index, key in enumerate(keys)}
+    first = offsets.min()
+    values = full(
+        (len(keys), offsets.max() - first + 1), nan)
+    values[[row_indices[key] for key in row_keys], offsets - first] = row_values
+    return int(first), values
+
+
+def iter_data_points(
+        value_types=None,
+        regions=None,
+        start=None,
+        end=None,
+        chunk_size=2000):
+    """Iterates over stored datapoints without loading them all at once.
+
+    The rows are fetched from the database chunk_size at a time, so memory
+    use does not grow with the number of rows.
+
+    Args:
+      value_types: An optional iterable of ValueType enums. If given, only
+        datapoints of these value types are included.
+      regions: An optional iterable of Region enums. If given, only
+        datapoints for these regions are included.
+      start, end: As for get_time_series.
+      chunk_size: The number of rows fetched from the database at a time.
+
+    Returns:
+      An iterator of a (value_type, region, year, month, value) tuple for
+      each datapoint, where the value type and region are the keys they are
+      stored with, ordered by value type, region, year and month.
+    """
+    entries = HistoricalData.objects.all()
+    if value_types is not None:
+        entries = entries.filter(value_type__in=[
+            value_type_mapper[value_type] for value_type in value_types])
+    if regions is not None:
+        entries = entries.filter(region__in=[
+            region_mapper[region] for region in regions])
+    return _filter_by_date_range(entries, start, end)\
+        .order_by("value_type", "region", "year", "month")\
+        .values_list("value_type", "region", "year", "month", "value")\
+        .iterator(chunk_size=chunk_size)
+
+
+def get_aggregate_series(value_type, period, regions):
+    """Gets the published seasonal or annual aggregates as yearly series.
+
+    Args:
+      value_type: A valid ValueType enum.
+      period: A valid Period enum.
+      regions: An iterable of Region enums.
+
+    Returns:
+      A dictionary of the following form:
+        {
+          "value_type": "<value_type>",
+          "period": "<period>",
+          "labels": [<year_1>, <year_2>,...,<year_n>],
+          "series": [{
+            "name": "<region_name_1>",
+            "data": [<value_1>, <value_2>,...,<value_n>]
+          },{
+            ...
+          }]}
+      The labels run from the earliest to the latest year for which any of
+      the regions has data; missing values are None.
+    """
+    regions = list(regions)
+    region_keys = [region_mapper[region] for region in regions]
+    rows = HistoricalAggregate.objects\
+        .filter(region__in=region_keys)\
+        .filter(value_type=value_type_mapper[value_type])\
+        .filter(period=period_mapper[period])\
+        .order_by("region", "year")\
+        .values_list("region", "year", "value")
+    if rows:
+        row_keys, years, row_values = zip(*rows)
+        first, values = _align(region_keys, row_keys, array(years), row_values)
+    else:
+        first, values = 0, empty((len(region_keys), 0))
 
     return {
         "value_type": value_type_to_title_mapper[value_type],
-        "labels": labels,
-        "series": series}
-    
-
-def _create_list_of_tuples(smallest, largest):
-    l = []
-    curr = smallest
-    while curr <= largest:
-        l.append(curr)
-        if curr[1] >= 12:
-            curr = (curr[0]+1, 1)
-        else:
-            curr = (curr[0], curr[1]+1)
-    return l
+        "period": period_to_title_mapper[period],
+        "labels": list(range(first, first + values.shape[1])),
+        "series": [
+            {
+                "name": region_to_name_mapper[region],
+                "data": _to_list_with_nones(region_values)}
+            for region, region_values in zip(regions, values)]}
+
+
+def get_climatology(value_type, regions, month=None):
+    """Gets the statistics of each calendar month over every stored year.
+
+    The statistics are read from the climatology table, which is refreshed
+    by refresh_climatology, so at most twelve rows are read per region.
+
+    Args:
+      value_type: A valid ValueType enum.
+      regions: An iterable of Region enums.
+      month: An optional Month enum, to get the statistics of only that
+        calendar month.
+
+    Returns:
+      A dictionary of the following form:
+        {
+          "value_type": "<value_type>",
+          "series": [{
+            "name": "<region_name_1>",
+            "months": [{
+              "month": "<month_1>",
+              "count": <number_of_years>,
+              "mean": <mean>,
+              "std": <standard_deviation>,
+              "minimum": {"value": <minimum>, "year": <year>},
+              "maximum": {"value": <maximum>, "year": <year>},
+              "percentiles": {"10": <percentile_10>,...,"90": <percentile_90>}
+            },{
+              ...
+            }]
+          },{
+            ...
+          }]}
+      Months without any values are left out. The mean, standard deviation
+      and percentiles are rounded to DERIVED_DECIMALS places.
+    """
+    regions = list(regions)
+    entries = HistoricalClimatology.objects\
+        .filter(region__in=[region_mapper[region] for region in regions])\
+        .filter(value_type=value_type_mapper[value_type])
+    if month is not None:
+        entries = entries.filter(month=month_mapper[month])
+    months = defaultdict(list)
+    for entry in entries.order_by("region", "month"):
+        months[entry.region].append({
+            "month": month_to_lable_string_mapper[entry.month],
+            "count": entry.count,
+            "mean": round(entry.mean, DERIVED_DECIMALS),
+            "std": round(entry.std, DERIVED_DECIMALS),
+            "minimum": {"value": entry.minimum, "year": entry.minimum_year},
+            "maximum": {"value": entry.maximum, "year": entry.maximum_year},
+            "percentiles": {
+                str(percentile): round(getattr(entry, field), DERIVED_DECIMALS)
+                for percentile, field
+                in climatology_percentile_field_mapper.items()}})
+
+    return {
+        "value_type": value_type_to_title_mapper[value_type],
+        "series": [
+            {
+                "name": region_to_name_mapper[region],
+                "months": months[region_mapper[region]]}
+            for region in regions]}
+
+
+def _select_columns(values, max_points):
+    if max_points is None:
+        return arange(values.shape[1])
+    return largest_triangle_three_buckets(values, max_points)
+
+
+def _create_labels(offsets):
+    return [
+        str(offset // 12) + "-" + month_to_lable_string_mapper[offset % 12 + 1]
+        for offset in offsets.tolist()]
+
+
+def _encode_as_float32(values):
+    return b64encode(values.astype("<f4").tobytes()).decode("ascii")
+
+
+def _to_list_with_nones(values):
+    return [None if isnan(value) else value for value in values.tolist()]
 
 
 def create_or_update_data_point(
@@ -118,21 +651,8 @@ def create_or_update_data_point(
     Raises:
       ValueError if invalid arguments given.
     """
-    try:
-        region_key = region_mapper[region]
-    except KeyError:
-        raise ValueError(
-                "Argument: {} is not a valid region enum".format(region))
-    try:
-        month_key = month_mapper[month]
-    except KeyError:
-        raise ValueError(
-                "Argument: {} is not a valid month enum".format(month))
-    try:
-        value_type_key = value_type_mapper[value_type]
-    except KeyError:
-        raise ValueError(
-                "Argument: {} is not a valid value_type enum".format(value_type))
+    region_key, month_key, value_type_key = _get_keys(
+        region, month, value_type)
 
     try:
         entry = HistoricalData.objects.get(
@@ -152,3 +672,402 @@ def create_or_update_data_point(
     entry.save()
 
 
+def sync_aggregate_points(region, value_type, aggregate_points, batch_size=500):
+    """Makes the stored aggregates for a region and value type match those given.
+
+    The stored aggregates are loaded with a single query and compared with
+    the given aggregate points, so that only entries which are new, have a
+    different value, or are no longer present are written. Any writes happen
+    within a single transaction, and nothing is written if nothing changed.
+
+    Args:
+      region: A valid region as specified by a Region Enum.
+      value_type: A valid value_type as specified by a ValueType Enum.
+      aggregate_points: An iterable of AggregatePoints for the region and
+        value type.
+      batch_size: The maximum number of entries written by a single query.
+
+    Returns:
+      A tuple of the number of entries inserted, updated and deleted.
+
+    Raises:
+      ValueError if invalid arguments given, or if any aggregate point is for
+        a different region or value type.
+      ValidationError if any aggregate point fails model validation.
+    """
+    region_key = _get_key(region_mapper, region, "region")
+    value_type_key = _get_key(value_type_mapper, value_type, "value_type")
+    new_entries = {}
+    for aggregate_point in aggregate_points:
+        if aggregate_point.region != region or aggregate_point.value_type != value_type:
+            raise ValueError(
+                "Aggregate point: {} is not for region {} and value_type {}".format(
+                    aggregate_point, region, value_type))
+        entry = _create_aggregate_entry(aggregate_point)
+        new_entries[(entry.year, entry.period)] = entry
+
+    return _sync_entries(
+        HistoricalAggregate,
+        "period",
+        region_key,
+        value_type_key,
+        new_entries,
+        batch_size)
+
+
+def _sync_entries(
+        model,
+        sub_year_field,
+        region_key,
+        value_type_key,
+        new_entries,
+        batch_size):
+    existing_values = {
+        (year, sub_year): (pk, value)
+        for pk, year, sub_year, value in model.objects\
+            .filter(region=region_key, value_type=value_type_key)\
+            .values_list("pk", "year", sub_year_field, "value")}
+
+    to_insert = []
+    to_update = []
+    for key, new_entry in new_entries.items():
+        try:
+            pk, value = existing_values.pop(key)
+        except KeyError:
+            to_insert.append(new_entry)
+        else:
+            if value != new_entry.value:
+                new_entry.pk = pk
+                to_update.append(new_entry)
+    to_delete = [pk for pk, value in existing_values.values()]
+
+    if to_insert or to_update or to_delete:
+        with transaction.atomic():
+            model.objects.bulk_create(to_insert, batch_size=batch_size)
+            model.objects.bulk_update(
+                to_update, ["value"], batch_size=batch_size)
+            for start in range(0, len(to_delete), batch_size):
+                model.objects\
+                    .filter(pk__in=to_delete[start:start + batch_size])\
+                    .delete()
+
+    return len(to_insert), len(to_update), len(to_delete)
+
+
+def merge_datasets(datasets):
+    """Makes the stored data for many datasets match them in one transaction.
+
+    Every datapoint and aggregate point is validated and loaded into a
+    temporary staging table. Each dataset is then merged into the stored data
+    with three set-based statements, which delete entries that are no longer
+    present, update entries whose value has changed and insert new entries.
+    The dataset version is bumped if anything changed. All of this happens in
+    a single transaction, so readers see either the old data or the new data,
+    and the database is only locked for writing while the merge runs.
+
+    So that a truncated download cannot delete the stored history, nothing is
+    merged if any dataset has no datapoints, or has fewer than
+    MERGE_MIN_RETAINED_FRACTION of the datapoints or aggregates stored for
+    it.
+
+    Args:
+      datasets: An iterable of (Region enum, ValueType enum, Dataset) tuples.
+
+    Returns:
+      A list of (Region enum, ValueType enum, data_point_counts,
+      aggregate_point_counts) tuples, in the order given, where each of the
+      counts is a tuple of the number of entries inserted, updated and
+      deleted.
+
+    Raises:
+      ValueError if invalid arguments given, if any point is for a
+        different region or value type than its dataset, or if any dataset
+        is empty or much smaller than what is stored for it.
+      ValidationError if any point fails model validation.
+    """
+    data_rows = {}
+    aggregate_rows = {}
+    keys = []
+    for region, value_type, dataset in datasets:
+        region_key = _get_key(region_mapper, region, "region")
+        value_type_key = _get_key(value_type_mapper, value_type, "value_type")
+        for data_point in dataset.data_points:
+            entry = _create_entry(data_point)
+            _check_entry(entry, region_key, value_type_key, data_point)
+            data_rows[(value_type_key, region_key, entry.year, entry.month)] = \
+                entry.value
+        for aggregate_point in dataset.aggregate_points:
+            entry = _create_aggregate_entry(aggregate_point)
+            _check_entry(entry, region_key, value_type_key, aggregate_point)
+            aggregate_rows[(value_type_key, region_key, entry.year, entry.period)] = \
+                entry.value
+        keys.append((region, value_type, value_type_key, region_key))
+
+    dataset_keys = [
+        (value_type_key, region_key) for _, _, value_type_key, region_key in keys]
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model, rows in [
+                (HistoricalData, data_rows), (HistoricalAggregate, aggregate_rows)]:
+            _check_not_shrinking(model, keys, rows)
+        data_point_counts = _merge_staged(
+            cursor, HistoricalData, "month", dataset_keys, data_rows)
+        aggregate_point_counts = _merge_staged(
+            cursor, HistoricalAggregate, "period", dataset_keys, aggregate_rows)
+        merged = [
+            (
+                region,
+                value_type,
+                data_point_counts[(value_type_key, region_key)],
+                aggregate_point_counts[(value_type_key, region_key)])
+            for region, value_type, value_type_key, region_key in keys]
+        if any(any(counts) for merge in merged for counts in merge[2:]):
+            bump_dataset_version()
+    return merged
+
+
+def _check_not_shrinking(model, keys, rows):
+    """Raises ValueError if a dataset would lose too many stored entries.
+
+    Args:
+      model: HistoricalData or HistoricalAggregate.
+      keys: A list of (Region enum, ValueType enum, value_type, region)
+        tuples of the datasets to merge.
+      rows: As for _merge_staged.
+    """
+    stored = {
+        (counted["value_type"], counted["region"]): counted["count"]
+        for counted in model.objects\
+            .filter(value_type__in={key[2] for key in keys})\
+            .filter(region__in={key[3] for key in keys})\
+            .values("value_type", "region")\
+            .annotate(count=Count("id"))}
+    staged = Counter(row_key[:2] for row_key in rows)
+    for region, value_type, value_type_key, region_key in keys:
+        staged_count = staged[(value_type_key, region_key)]
+        stored_count = stored.get((value_type_key, region_key), 0)
+        if (model is HistoricalData and not staged_count) \
+                or staged_count < stored_count * MERGE_MIN_RETAINED_FRACTION:
+            raise ValueError(
+                "Refusing to merge {} {}: {} {} entries given, {} stored.".format(
+                    region.name,
+                    value_type.name,
+                    staged_count,
+                    model.__name__,
+                    stored_count))
+
+
+def _check_entry(entry, region_key, value_type_key, point):
+    if entry.region != region_key or entry.value_type != value_type_key:
+        raise ValueError(
+            "Point: {} is not for region {} and value_type {}".format(
+                point, region_key, value_type_key))
+
+
+def _merge_staged(cursor, model, sub_year_field, dataset_keys, rows):
+    """Merges rows into a model's table through a temporary staging table.
+
+    Args:
+      cursor: A database cursor, within a transaction.
+      model: HistoricalData or HistoricalAggregate.
+      sub_year_field: The name of the model's month or period field.
+      dataset_keys: A list of the (value_type, region) keys of the datasets
+        to merge. Stored entries for these datasets which are not in rows are
+        deleted.
+      rows: A dictionary mapping (value_type, region, year, sub_year) keys to
+        values.
+
+    Returns:
+      A dictionary mapping each dataset key to a tuple of the number of
+      entries inserted, updated and deleted.
+    """
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    staging = quote_name("staging_" + model._meta.db_table)
+    sub_year = quote_name(sub_year_field)
+    match = (
+        "staged.value_type = {table}.value_type "
+        "AND staged.region = {table}.region "
+        "AND staged.year = {table}.year "
+        "AND staged.sub_year = {table}.{sub_year}").format(
+            table=table, sub_year=sub_year)
+
+    cursor.execute("DROP TABLE IF EXISTS {}".format(staging))
+    cursor.execute(
+        "CREATE TEMPORARY TABLE {} ("
+        "value_type VARCHAR(20), region VARCHAR(20), year INTEGER, "
+        "sub_year INTEGER, value REAL, "
+        "PRIMARY KEY (value_type, region, year, sub_year))".format(staging))
+    cursor.executemany(
+        "INSERT INTO {} VALUES (%s, %s, %s, %s, %s)".format(staging),
+        [key + (value,) for key, value in rows.items()])
+
+    counts = {}
+    for value_type_key, region_key in dataset_keys:
+        parameters = [value_type_key, region_key]
+        cursor.execute(
+            "DELETE FROM {table} "
+            "WHERE value_type = %s AND region = %s "
+            "AND NOT EXISTS (SELECT 1 FROM {staging} staged WHERE {match})".format(
+                table=table, staging=staging, match=match),
+            parameters)
+        deleted = cursor.rowcount
+        cursor.execute(
+            "UPDATE {table} "
+            "SET value = (SELECT staged.value FROM {staging} staged WHERE {match}) "
+            "WHERE value_type = %s AND region = %s "
+            "AND EXISTS (SELECT 1 FROM {staging} staged "
+            "WHERE {match} AND staged.value <> {table}.value)".format(
+                table=table, staging=staging, match=match),
+            parameters)
+        updated = cursor.rowcount
+        cursor.execute(
+            "INSERT INTO {table} (value_type, region, year, {sub_year}, value) "
+            "SELECT value_type, region, year, sub_year, value FROM {staging} staged "
+            "WHERE staged.value_type = %s AND staged.region = %s "
+            "AND NOT EXISTS (SELECT 1 FROM {table} WHERE {match})".format(
+                table=table, staging=staging, sub_year=sub_year, match=match),
+            parameters)
+        inserted = cursor.rowcount
+        counts[(value_type_key, region_key)] = (inserted, updated, deleted)
+    cursor.execute("DROP TABLE {}".format(staging))
+    return counts
+
+
+def refresh_climatology(series=None):
+    """Recalculates the climatology table from the stored datapoints.
+
+    The rows for each series are replaced within a single transaction, with
+    a row for each calendar month that has any values.
+
+    Args:
+      series: An optional iterable of (Region enum, ValueType enum) tuples
+        of the series to refresh, such as those that have just changed. By
+        default every series is refreshed.
+
+    Returns:
+      The number of climatology rows written.
+    """
+    entries = HistoricalData.objects.all()
+    climatology = HistoricalClimatology.objects.all()
+    if series is not None:
+        keys = {
+            (
+                _get_key(value_type_mapper, value_type, "value_type"),
+                _get_key(region_mapper, region, "region"))
+            for region, value_type in series}
+        if not keys:
+            return 0
+        selected = reduce(or_, (
+            Q(value_type=value_type_key, region=region_key)
+            for value_type_key, region_key in sorted(keys)))
+        entries = entries.filter(selected)
+        climatology = climatology.filter(selected)
+    rows = entries\
+        .order_by("value_type", "region", "year", "month")\
+        .values_list("value_type", "region", "year", "month", "value")
+
+    new_entries = []
+    percentiles = list(climatology_percentile_field_mapper)
+    for (value_type_key, region_key), series_rows in groupby(
+            rows.iterator(), key=lambda row: row[:2]):
+        _, _, years, months, values = zip(*series_rows)
+        first_year = years[0]
+        by_month = full((years[-1] - first_year + 1, 12), nan)
+        by_month[array(years) - first_year, array(months) - 1] = values
+        statistics = column_statistics(by_month, percentiles)
+        for index in range(12):
+            if not statistics["count"][index]:
+                continue
+            new_entries.append(HistoricalClimatology(
+                region=region_key,
+                value_type=value_type_key,
+                month=index + 1,
+                count=int(statistics["count"][index]),
+                mean=float(statistics["mean"][index]),
+                std=float(statistics["std"][index]),
+                minimum=float(statistics["minimum"][index]),
+                minimum_year=first_year + int(statistics["minimum_index"][index]),
+                maximum=float(statistics["maximum"][index]),
+                maximum_year=first_year + int(statistics["maximum_index"][index]),
+                **{
+                    field: float(statistics["percentiles"][row, index])
+                    for row, field
+                    in enumerate(climatology_percentile_field_mapper.values())}))
+    with transaction.atomic():
+        climatology.delete()
+        HistoricalClimatology.objects.bulk_create(new_entries)
+    return len(new_entries)
+
+
+def has_climatology():
+    """Whether the climatology table has been filled."""
+    return HistoricalClimatology.objects.exists()
+
+
+def get_dataset_version():
+    """Gets the version of the stored dataset.
+
+    Returns:
+      An int, which is 0 if the dataset has never been changed.
+    """
+    version = DatasetVersion.objects\
+        .filter(pk=1)\
+        .values_list("version", flat=True)\
+        .first()
+    return version or 0
+
+
+def bump_dataset_version():
+    """Increments the version of the stored dataset.
+
+    Should be called whenever the stored data has been changed.
+
+    Returns:
+      The new version, as an int.
+    """
+    with transaction.atomic():
+        updated = DatasetVersion.objects\
+            .filter(pk=1)\
+            .update(version=F("version") + 1)
+        if not updated:
+            DatasetVersion.objects.create(pk=1, version=1)
+        return get_dataset_version()
+
+
+def _create_entry(data_point):
+    region_key, month_key, value_type_key = _get_keys(
+        data_point.region, data_point.month, data_point.value_type)
+    entry = HistoricalData(
+        region=region_key,
+        year=data_point.year,
+        month=month_key,
+        value_type=value_type_key,
+        value=data_point.value)
+    entry.clean_fields()
+    return entry
+
+
+def _create_aggregate_entry(aggregate_point):
+    entry = HistoricalAggregate(
+        region=_get_key(region_mapper, aggregate_point.region, "region"),
+        year=aggregate_point.year,
+        period=_get_key(period_mapper, aggregate_point.period, "period"),
+        value_type=_get_key(value_type_mapper, aggregate_point.value_type, "value_type"),
+        value=aggregate_point.value)
+    entry.clean_fields()
+    return entry
+
+
+def _get_keys(region, month, value_type):
+    return (
+        _get_key(region_mapper, region, "region"),
+        _get_key(month_mapper, month, "month"),
+        _get_key(value_type_mapper, value_type, "value_type"))
+
+
+def _get_key(mapper, enum, enum_name):
+    try:
+        return mapper[enum]
+    except KeyError:
+        raise ValueError(
+                "Argument: {} is not a valid {} enum".format(enum, enum_name))
@@ -1,25 +1,62 @@
-from io import StringIO
-from os import linesep
+import gzip
+import re
+from codecs import getincrementaldecoder
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from hashlib import sha256
+from json import dump, load
+from os import listdir, makedirs, path, remove, replace
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import sleep
 
-from requests import get 
-from pandas import read_csv
+from requests import HTTPError, RequestException, Session, get
+from requests.adapters import HTTPAdapter
 
 from historical_data.data.data_types import (
+    AggregatePoint,
+    Dataset,
     DataPoint,
     Month,
+    Period,
     Region,
     ValueType)
 
 
-def get_met_data(region, value_type):
+_TIMEOUT = 30
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def get_met_data(region, value_type, session=None, cache=None, archive=None):
     """Gets data from the met office website.
     
     Args:
       region: A region enum.
       value_type: A value type enum.
+      session: An optional requests Session used to make the request.
+      cache: An optional FetchCache. If given the request is made
+        conditionally, and the data is only returned if it has changed since
+        the last time it was committed to the cache.
+      archive: An optional DownloadArchive, in which every downloaded file is
+        kept.
 
     Returns:
-      A set of datapoints.
+      A set of datapoints, or None if the cache shows the data is unchanged.
+    """
+    dataset = get_met_dataset(region, value_type, session, cache, archive)
+    return None if dataset is None else dataset.data_points
+
+
+def get_met_dataset(region, value_type, session=None, cache=None, archive=None):
+    """Gets data, including seasonal and annual aggregates, from the met office.
+
+    Args:
+      region, value_type, session, cache, archive: As for get_met_data.
+
+    Returns:
+      A Dataset of a set of datapoints and a set of aggregate points, or None
+      if the cache shows the data is unchanged.
     """
     region_string = {
         Region.UK: "UK",
@@ -37,75 +74,484 @@ def get_met_data(region, value_type):
         vty=value_type_string[value_type],
         reg=region_string[region])
 
-    raw_data = _get_raw_data(url)
-    pre_processed_data = _pre_process_data(raw_data)
-    return _get_data(pre_processed_data, region, value_type)
+    download = _get_raw_data(url, session, cache, archive, (region, value_type))
+    if download is None:
+        return None
+    with download:
+        dataset = _parse_dataset(download, region, value_type)
+        content_hash = download.finish()
+    if cache is not None:
+        changed = cache.stage(
+            url,
+            download.headers.get("ETag"),
+            download.headers.get("Last-Modified"),
+            content_hash)
+        if not changed:
+            return None
+    return dataset
 
 
-def _get_raw_data(url):
-    response = get(url)
-    response.raise_for_status()
-    return response.text
+def get_all_met_data(
+        datasets,
+        max_workers=4,
+        retries=3,
+        backoff=1.0,
+        cache=None,
+        archive=None):
+    """Gets data for many datasets concurrently from the met office website.
 
+    The datasets are downloaded and parsed by a pool of threads sharing a
+    single keep-alive session. Results are yielded as soon as each dataset is
+    ready, so the caller can store them while the rest are still in flight.
 
-def _pre_process_data(input_text):
-    return _replace_missing_entries_with_x(
-        _remove_blurb(
-            input_text))
+    Args:
+      datasets: An iterable of (region enum, value type enum) tuples.
+      max_workers: The maximum number of datasets fetched at once.
+      retries: The number of times a failed fetch is retried.
+      backoff: The number of seconds to wait before the first retry. The wait
+        doubles with each subsequent retry.
+      cache: An optional FetchCache, used as by get_met_data.
+      archive: An optional DownloadArchive, used as by get_met_data.
 
+    Yields:
+      A (region enum, value type enum, Dataset) tuple for each dataset, in
+      order of completion. The Dataset is None if the cache shows the dataset
+      is unchanged.
 
-def _remove_blurb(input_text):
-    string_list = input_text.splitlines()
+    Raises:
+      RequestException if a dataset could not be fetched after retrying.
+    """
+    with _create_session(max_workers) as session, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                _get_met_dataset_with_retries,
+                region,
+                value_type,
+                session,
+                cache,
+                archive,
+                retries,
+                backoff): (region, value_type)
+            for region, value_type in datasets}
+        for future in as_completed(futures):
+            region, value_type = futures[future]
+            yield region, value_type, future.result()
 
-    empty_line_found=False
-    while not empty_line_found:
-        if string_list[0].strip() == "":
-            empty_line_found = True
-        string_list.pop(0)
-    
-    return linesep.join(string_list)
 
+def _create_session(pool_size):
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
-def _replace_missing_entries_with_x(input_text):
-    string_list = input_text.splitlines()
 
-    penultimate_string = string_list[-2]
-    ultimate_string_as_list = list(string_list[-1])
-    for index, character in enumerate(ultimate_string_as_list):
-        if character == " " and penultimate_string[index] == ".":
-            ultimate_string_as_list[index] = "X"
-    string_list[-1] = "".join(ultimate_string_as_list)
-    
-    return linesep.join(string_list)
+def _get_met_dataset_with_retries(
+        region,
+        value_type,
+        session,
+        cache,
+        archive,
+        retries,
+        backoff):
+    for attempt in range(retries + 1):
+        try:
+            return get_met_dataset(region, value_type, session, cache, archive)
+        except RequestException as error:
+            if attempt == retries or not _is_retryable(error):
+                raise
+        sleep(backoff * 2**attempt)
 
 
-def _get_data(input_text, region=Region.UK, value_type=ValueType.MAX_TEMP):
-    
-    months = [
-        "JAN",
-        "FEB",
-        "MAR",
-        "APR",
-        "MAY",
-        "JUN",
-        "JUL",
-        "AUG",
-        "SEP",
-        "OCT",
-        "NOV",
-        "DEC"]
-
-    data_frame = read_csv(StringIO(input_text), delim_whitespace=True) 
+def _is_retryable(error):
+    if isinstance(error, HTTPError) and error.response is not None:
+        return error.response.status_code >= 500
+    return True
+
+
+class FetchCache:
+    """An on-disk cache of the metadata of previously fetched urls.
+
+    For each url the ETag, Last-Modified header and a hash of the content are
+    kept, so that later fetches can be made conditional and unchanged content
+    can be detected. New metadata is only staged in memory until commit is
+    called, so that it can be committed once the data has been safely stored.
+
+    Args:
+      directory: The directory in which the cache file is kept.
+      force: If True, fetches are made unconditionally and all content is
+        treated as changed. New metadata is still staged.
+    """
+
+    _FILE_NAME = "metadata.json"
+
+    def __init__(self, directory, force=False):
+        self._file_path = path.join(directory, self._FILE_NAME)
+        self._force = force
+        self._lock = Lock()
+        self._staged = {}
+        try:
+            with open(self._file_path) as cache_file:
+                self._entries = load(cache_file)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get_conditional_headers(self, url):
+        """Gets the headers needed to make a conditional request for url."""
+        entry = self._entries.get(url)
+        if self._force or entry is None:
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def stage(self, url, etag, last_modified, content_hash):
+        """Stages new metadata for url.
+
+        Returns:
+          True if the content has changed since the metadata was last
+          committed, False otherwise.
+        """
+        with self._lock:
+            self._staged[url] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "content_hash": content_hash}
+        entry = self._entries.get(url)
+        return (
+            self._force
+            or entry is None
+            or entry.get("content_hash") != content_hash)
+
+    def commit(self):
+        """Writes all staged metadata to disk."""
+        with self._lock:
+            self._entries.update(self._staged)
+            self._staged = {}
+            directory = path.dirname(self._file_path)
+            makedirs(directory, exist_ok=True)
+            with NamedTemporaryFile(
+                    "w", dir=directory, delete=False) as temporary_file:
+                dump(self._entries, temporary_file)
+            replace(temporary_file.name, self._file_path)
+
+
+def get_archived_met_dataset(region, value_type, archive):
+    """Gets a dataset from its most recent archived download.
+
+    No request is made, so this works offline.
+
+    Args:
+      region: A region enum.
+      value_type: A value type enum.
+      archive: A DownloadArchive.
+
+    Returns:
+      A Dataset, or None if the dataset has never been archived.
+    """
+    lines = archive.open_latest(region, value_type)
+    if lines is None:
+        return None
+    with lines:
+        return _parse_dataset(lines, region, value_type)
+
+
+class DownloadArchive:
+    """A local archive of the raw files downloaded from the met office.
+
+    Each file is gzipped and kept under a directory for the (UTC) date it was
+    downloaded, named by its dataset and the SHA-256 hash of its content,
+    so that downloading the same content again on the same day adds nothing.
+
+    Args:
+      directory: The directory in which the archive is kept.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+
+    def create_file(self, region, value_type):
+        """Starts archiving a download that is written as it is read.
+
+        Args:
+          region: A region enum.
+          value_type: A value type enum.
+
+        Returns:
+          An _ArchiveFile, to which the downloaded bytes are written before
+          it is committed or discarded.
+        """
+        date_directory = path.join(
+            self._directory, datetime.now(timezone.utc).date().isoformat())
+        return _ArchiveFile(date_directory, _get_archive_name(region, value_type))
+
+    def get_latest_path(self, region, value_type):
+        """Gets the path of the most recently archived download of a dataset.
+
+        Returns:
+          A path, or None if the dataset has never been archived.
+        """
+        try:
+            dates = sorted(listdir(self._directory), reverse=True)
+        except FileNotFoundError:
+            return None
+        prefix = _get_archive_name(region, value_type) + "-"
+        for date in dates:
+            date_directory = path.join(self._directory, date)
+            file_paths = [
+                path.join(date_directory, file_name)
+                for file_name in listdir(date_directory)
+                if file_name.startswith(prefix) and file_name.endswith(".txt.gz")]
+            if file_paths:
+                return max(file_paths, key=path.getmtime)
+        return None
+
+    def open_latest(self, region, value_type):
+        """Opens the most recently archived download of a dataset.
+
+        Returns:
+          A text file object, which reads the decompressed file one line at a
+          time, or None if the dataset has never been archived.
+        """
+        file_path = self.get_latest_path(region, value_type)
+        if file_path is None:
+            return None
+        return gzip.open(file_path, "rt", encoding="utf-8", errors="replace")
+
+
+class _ArchiveFile:
+    """A download being archived, compressed as each chunk is written.
+
+    The chunks go to a temporary file, which is only given its final name,
+    including the hash of the content, when committed.
+    """
+
+    def __init__(self, date_directory, name):
+        makedirs(date_directory, exist_ok=True)
+        self._date_directory = date_directory
+        self._name = name
+        self._temporary_file = NamedTemporaryFile(
+            "wb", dir=date_directory, delete=False)
+        self._gzip_file = gzip.GzipFile(fileobj=self._temporary_file, mode="wb")
+
+    def write(self, chunk):
+        self._gzip_file.write(chunk)
+
+    def commit(self, content_hash):
+        """Keeps the file, unless the same content was archived that day.
+
+        Returns:
+          The path of the archived file.
+        """
+        self._close()
+        file_path = path.join(
+            self._date_directory, "{}-{}.txt.gz".format(self._name, content_hash))
+        if path.exists(file_path):
+            remove(self._temporary_file.name)
+        else:
+            replace(self._temporary_file.name, file_path)
+        return file_path
+
+    def discard(self):
+        self._close()
+        remove(self._temporary_file.name)
+
+    def _close(self):
+        self._gzip_file.close()
+        self._temporary_file.close()
+
+
+def _get_archive_name(region, value_type):
+    return "{}-{}".format(region.name, value_type.name)
+
+
+def _get_raw_data(url, session=None, cache=None, archive=None, dataset=None):
+    """Starts downloading a file, without reading its content.
+
+    Returns:
+      None if the cache shows the file has not been modified, otherwise a
+      _StreamedDownload of the file, archived in archive if one is given.
+    """
+    headers = {} if cache is None else cache.get_conditional_headers(url)
+    if session is None:
+        response = get(url, headers=headers, timeout=_TIMEOUT, stream=True)
+    else:
+        response = session.get(url, headers=headers, timeout=_TIMEOUT, stream=True)
+    if response.status_code == 304:
+        response.close()
+        return None
+    try:
+        response.raise_for_status()
+    except HTTPError:
+        response.close()
+        raise
+    return _StreamedDownload(
+        response.iter_content(_CHUNK_SIZE),
+        response.encoding or "utf-8",
+        response.headers,
+        None if archive is None else archive.create_file(*dataset),
+        response.close)
+
+
+class _StreamedDownload:
+    """The lines of a download, which is hashed and archived as it is read.
+
+    Iterating over it reads the content a chunk at a time, so the memory used
+    does not grow with the size of the file. It should be used as a context
+    manager, so that the connection is released and an unfinished archive
+    file discarded.
+
+    Args:
+      chunks: An iterable of the downloaded bytes.
+      encoding: The encoding of the content.
+      headers: The response headers.
+      archive_file: An optional _ArchiveFile to write the content to.
+      close: An optional callable taking no arguments, called on exit.
+    """
+
+    def __init__(self, chunks, encoding, headers, archive_file=None, close=None):
+        self.headers = headers
+        self._archive_file = archive_file
+        self._close = close
+        self._hash = sha256()
+        self._lines = _iter_lines(self._read(chunks), encoding)
+
+    def __iter__(self):
+        return self._lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._archive_file is not None:
+            self._archive_file.discard()
+            self._archive_file = None
+        if self._close is not None:
+            self._close()
+
+    def finish(self):
+        """Reads any remaining content and commits the archive file.
+
+        Returns:
+          The SHA-256 hex digest of the content.
+        """
+        for _ in self._lines:
+            pass
+        content_hash = self._hash.hexdigest()
+        if self._archive_file is not None:
+            self._archive_file.commit(content_hash)
+            self._archive_file = None
+        return content_hash
+
+    def _read(self, chunks):
+        for chunk in chunks:
+            self._hash.update(chunk)
+            if self._archive_file is not None:
+                self._archive_file.write(chunk)
+            yield chunk
+
+
+def _iter_lines(chunks, encoding):
+    """Decodes chunks of bytes and splits them into lines, without line ends."""
+    decoder = getincrementaldecoder(encoding)(errors="replace")
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+def _parse_dataset(lines, region, value_type):
+    """Parses the lines of a Met Office text file into a Dataset.
+
+    Raises:
+      ValueError if the file has no header row with month columns, or no
+        rows of values, such as when an error page is served instead.
+    """
     data_points = set()
-    for index in range(len(data_frame)):
-        for month in months:
-            year = int(data_frame.at[index, "Year"])
+    aggregate_points = set()
+    try:
+        for year, column, value in _parse_values(lines):
+            if isinstance(column, Month):
+                data_points.add(DataPoint(region, year, column, value_type, value))
+            else:
+                aggregate_points.add(
+                    AggregatePoint(region, year, column, value_type, value))
+    except ValueError as error:
+        raise ValueError("Could not parse {} {}: {}".format(
+            region.name, value_type.name, error)) from error
+    return Dataset(data_points, aggregate_points)
+
+
+def _parse_values(lines):
+    """Parses the lines of a Met Office text file one at a time.
+
+    The lines before the header row, which starts with "Year", are skipped.
+    The values in each following row are right-aligned with the column names
+    in the header, so each value is found between the end of the previous
+    column name and the end of its own. Missing values are blank or "---".
+
+    Args:
+      lines: An iterable of strings.
+
+    Yields:
+      A (year, Month or Period enum, value) tuple for each value present.
+
+    Raises:
+      ValueError if there is no header row with month columns, or no row
+        after it starts with a year.
+    """
+    lines = iter(lines)
+    for line in lines:
+        header = _parse_header(line)
+        if header is not None:
+            break
+    else:
+        raise ValueError("No header row found.")
+
+    year_end, columns = header
+    if not any(isinstance(column, Month) for column, _, _ in columns):
+        raise ValueError("No month columns in the header row.")
+    found_rows = False
+    for line in lines:
+        try:
+            year = int(line[:year_end])
+        except ValueError:
+            continue
+        found_rows = True
+        for column, start, end in columns:
             try:
-                value = float(data_frame.at[index, month])
+                value = float(line[start:end])
             except ValueError:
-                pass
-            else:
-                data_points.add(
-                    DataPoint(region, year, Month[month], value_type, value))
+                continue
+            yield year, column, value
+    if not found_rows:
+        raise ValueError("No rows of values after the header row.")
+
 
-    return data_points
+def _parse_header(line):
+    """Gets the column positions from a header row.
+
+    Returns:
+      None if the line is not a header row. Otherwise a tuple of the end of
+      the year column and a list of (Month or Period enum, start, end) tuples
+      for the other known columns.
+    """
+    names = list(re.finditer(r"\S+", line))
+    if not names or names[0].group() != "Year":
+        return None
+    columns = []
+    for previous, name in zip(names, names[1:]):
+        column = Month.__members__.get(name.group()) \
+            or Period.__members__.get(name.group())
+        if column is not None:
+            columns.append((column, previous.end(), name.end()))
+    return names[0].end(), columns
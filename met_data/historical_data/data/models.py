@@ -1,7 +1,7 @@
 from django.db import models
 from django.core.validators import MinLengthValidator
 
-from historical_data.data.met_data_getter import Region, Month, ValueType
+from historical_data.data.data_types import Region, Month, Period, ValueType
 
 region_mapper = {
     Region.UK: "uk",
@@ -23,6 +23,13 @@ month_mapper = {
     Month.NOV: 11,
     Month.DEC: 12}
 
+period_mapper = {
+    Period.WIN: 1,
+    Period.SPR: 2,
+    Period.SUM: 3,
+    Period.AUT: 4,
+    Period.ANN: 5}
+
 value_type_mapper = {
     ValueType.MAX_TEMP: "max_temp",
     ValueType.MIN_TEMP: "min_temp",
@@ -43,6 +50,10 @@ class HistoricalData(models.Model):
       value_type: Integer representing a value_type - as returned by the
         value-type-mapper 
       value: Float.
+
+    There is at most one data point for each value type, region, year and
+    month. The index covers the time series read path, which filters on value
+    type and region and reads the year, month and value.
     """
     _non_empty_string = MinLengthValidator(1)
     year = models.PositiveSmallIntegerField()
@@ -51,6 +62,112 @@ class HistoricalData(models.Model):
     value_type = models.CharField(max_length=20, validators=[_non_empty_string])
     value = models.FloatField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["value_type", "region", "year", "month"],
+                name="unique_historical_data_point")]
+        indexes = [
+            models.Index(
+                fields=["value_type", "region", "year", "month", "value"],
+                name="historical_time_series_idx")]
+
+    def save(self, *args, **kwargs):
+        self.clean_fields()
+        super().save(*args, **kwargs)
+
+
+class HistoricalAggregate(models.Model):
+    """Models a single seasonal or annual aggregate, as published.
+
+    Fields:
+      year: Integer representing a year. (For winter, the year of the
+        January and February.)
+      period: Integer representing a season or the whole year - as returned
+        by the period-mapper.
+      region: String representing a region - as returned by the
+        region-mapper.
+      value_type: String representing a value_type - as returned by the
+        value-type-mapper
+      value: Float.
+    """
+    _non_empty_string = MinLengthValidator(1)
+    year = models.PositiveSmallIntegerField()
+    period = models.PositiveSmallIntegerField()
+    region = models.CharField(max_length=20, validators=[_non_empty_string])
+    value_type = models.CharField(max_length=20, validators=[_non_empty_string])
+    value = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["value_type", "period", "region", "year"],
+                name="unique_historical_aggregate")]
+        indexes = [
+            models.Index(
+                fields=["value_type", "period", "region", "year", "value"],
+                name="historical_aggregate_idx")]
+
     def save(self, *args, **kwargs):
         self.clean_fields()
         super().save(*args, **kwargs)
+
+
+class HistoricalClimatology(models.Model):
+    """Models the statistics of one calendar month over every stored year.
+
+    The rows are derived from HistoricalData, and are refreshed whenever the
+    series for their region and value type changes.
+
+    Fields:
+      region: String representing a region - as returned by the
+        region-mapper.
+      value_type: String representing a value_type - as returned by the
+        value-type-mapper
+      month: Integer representing the calendar month. (January is 1,
+        Febuary is 2, etc.)
+      count: Integer, the number of years with a value for the month.
+      mean: Float.
+      std: Float, the population standard deviation.
+      minimum: Float.
+      minimum_year: Integer, the earliest year in which the minimum occurred.
+      maximum: Float.
+      maximum_year: Integer, the earliest year in which the maximum occurred.
+      percentile_10, percentile_25, median, percentile_75, percentile_90:
+        Floats, linearly interpolated between the values.
+    """
+    _non_empty_string = MinLengthValidator(1)
+    region = models.CharField(max_length=20, validators=[_non_empty_string])
+    value_type = models.CharField(max_length=20, validators=[_non_empty_string])
+    month = models.PositiveSmallIntegerField()
+    count = models.PositiveSmallIntegerField()
+    mean = models.FloatField()
+    std = models.FloatField()
+    minimum = models.FloatField()
+    minimum_year = models.PositiveSmallIntegerField()
+    maximum = models.FloatField()
+    maximum_year = models.PositiveSmallIntegerField()
+    percentile_10 = models.FloatField()
+    percentile_25 = models.FloatField()
+    median = models.FloatField()
+    percentile_75 = models.FloatField()
+    percentile_90 = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["value_type", "region", "month"],
+                name="unique_historical_climatology")]
+
+
+class DatasetVersion(models.Model):
+    """Models the version of the stored dataset.
+
+    There is a single row, whose version is incremented each time the stored
+    data changes, so that anything derived from the data can be tagged with
+    the version it was derived from.
+
+    Fields:
+      version: Integer, incremented on every change to the data.
+    """
+    version = models.PositiveIntegerField(default=0)
@@ -0,0 +1,346 @@
+import logging
+from json import dumps, loads
+from mmap import ACCESS_READ, mmap
+from os import fsync, makedirs, path, replace
+from struct import Struct, error as StructError
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import monotonic, perf_counter
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from numpy import (
+    around,
+    array,
+    empty,
+    flatnonzero,
+    float32,
+    frombuffer,
+    full,
+    isnan,
+    nan)
+
+from historical_data.data.models import HistoricalData
+
+try:
+    from resource import RUSAGE_SELF, getrusage
+except ImportError:  # Not available on Windows.
+    getrusage = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DECIMALS = 2
+
+# How long to wait before trying again to open a snapshot that was missing or
+# out of date, while the dataset version stays the same.
+RETRY_SECONDS = 5.0
+
+_SNAPSHOT_MAGIC = b"METDATA1"
+# Magic, dataset version, first month offset, number of months and the length
+# of the JSON list of column keys that follows.
+_SNAPSHOT_HEADER = Struct("<8sQqqI")
+
+_store = None
+# The dataset version and time of the last load that gave no up to date
+# store, so that it is not retried on every request.
+_failed_load = None
+_lock = Lock()
+
+
+class SeriesStore(object):
+    """Every stored time series, held in memory.
+
+    Each series is kept as a NumPy array with a value for every month from
+    its first to its last, and NaN for missing values, so that a range of
+    months is a slice. When loaded before gunicorn forks its workers (with
+    preload_app), the arrays are shared between them copy-on-write.
+
+    Attributes:
+      version: The dataset version that was loaded.
+      load_seconds: How long loading took.
+      nbytes: The total size of the arrays.
+    """
+
+    def __init__(self, version, series, load_seconds=0.0):
+        self.version = version
+        self.load_seconds = load_seconds
+        self.nbytes = sum(values.nbytes for _, values in series.values())
+        self._series = series
+
+    @classmethod
+    def load(cls, version):
+        """Loads every series from the database with a single query.
+
+        Args:
+          version: The current dataset version, which is recorded so that the
+            store can be reloaded when it changes.
+
+        Returns:
+          A SeriesStore.
+        """
+        started = perf_counter()
+        series = _read_series()
+        return cls(version, series, perf_counter() - started)
+
+    def get_aligned_values(self, keys, start=None, end=None):
+        """Gets series aligned on a common monthly axis.
+
+        Args:
+          keys: A list of (value_type, region) tuples of the keys stored in
+            the database.
+          start: An optional month offset (year * 12 + month - 1) of the
+            first month to include.
+          end: An optional month offset of the last month to include.
+
+        Returns:
+          As for handlers._get_aligned_values_for_value_types.
+        """
+        pieces = [self._get_range(key, start, end) for key in keys]
+        present = [(first, values) for first, values in pieces if len(values)]
+        if not present:
+            return 0, empty((len(keys), 0))
+
+        first = min(piece_first for piece_first, _ in present)
+        last = max(piece_first + len(values) - 1 for piece_first, values in present)
+        aligned = full((len(keys), last - first + 1), nan)
+        for row, (piece_first, values) in enumerate(pieces):
+            aligned[row, piece_first - first:piece_first - first + len(values)] = values
+        return int(first), aligned
+
+    def _get_range(self, key, start, end):
+        first, values = self._series.get(key, (0, empty(0)))
+        low = 0 if start is None else max(start - first, 0)
+        high = len(values) if end is None else min(end - first + 1, len(values))
+        values = values[low:max(low, high)]
+        indices = flatnonzero(~isnan(values))
+        if not len(indices):
+            return 0, values[:0]
+        return first + low + indices[0], values[indices[0]:indices[-1] + 1]
+
+
+class SnapshotStore(object):
+    """Every stored time series, read from a memory-mapped snapshot file.
+
+    The file, written by write_snapshot, has a float32 column for each value
+    type and region, all on the same monthly axis. It is mapped read-only, so
+    opening it is cheap and every process shares the same pages. Only the
+    requested slice of each column is copied, and its values are rounded to
+    SNAPSHOT_DECIMALS places to remove float32 noise.
+
+    Attributes:
+      version: The dataset version the snapshot was written for.
+      load_seconds: How long opening took.
+      nbytes: The size of the file.
+    """
+
+    def __init__(self, file_path):
+        started = perf_counter()
+        with open(file_path, "rb") as snapshot_file:
+            mapped = mmap(snapshot_file.fileno(), 0, access=ACCESS_READ)
+        magic, self.version, self._first, self._count, directory_length = \
+            _SNAPSHOT_HEADER.unpack_from(mapped)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError("{} is not a snapshot file.".format(file_path))
+        directory_end = _SNAPSHOT_HEADER.size + directory_length
+        keys = loads(mapped[_SNAPSHOT_HEADER.size:directory_end].decode())
+        self._indices = {tuple(key): index for index, key in enumerate(keys)}
+        self._values = frombuffer(
+            mapped,
+            dtype="<f4",
+            count=len(keys) * self._count,
+            offset=directory_end + _get_padding(directory_end))\
+            .reshape(len(keys), self._count)
+        self.nbytes = len(mapped)
+        self.load_seconds = perf_counter() - started
+
+    def get_aligned_values(self, keys, start=None, end=None):
+        """Gets series aligned on a common monthly axis.
+
+        Args:
+          keys, start, end: As for SeriesStore.get_aligned_values.
+
+        Returns:
+          As for handlers._get_aligned_values_for_value_types.
+        """
+        low = 0 if start is None else min(max(start - self._first, 0), self._count)
+        high = self._count if end is None else min(end - self._first + 1, self._count)
+        high = max(low, high)
+        aligned = full((len(keys), high - low), nan)
+        for row, key in enumerate(keys):
+            index = self._indices.get(key)
+            if index is not None:
+                aligned[row] = self._values[index, low:high]
+        present = flatnonzero(~isnan(aligned).all(axis=0))
+        if not len(present):
+            return 0, empty((len(keys), 0))
+        return (
+            int(self._first + low + present[0]),
+            around(aligned[:, present[0]:present[-1] + 1], SNAPSHOT_DECIMALS))
+
+
+def write_snapshot(file_path, version):
+    """Writes every stored time series to a snapshot file for SnapshotStore.
+
+    The file is written alongside and then renamed over any existing
+    snapshot, so readers never see a partially written file.
+
+    Args:
+      file_path: The path of the snapshot file.
+      version: The current dataset version, recorded in the file.
+    """
+    series = _read_series()
+    keys = sorted(series)
+    if series:
+        first = min(series_first for series_first, _ in series.values())
+        count = max(
+            series_first + len(values)
+            for series_first, values in series.values()) - first
+    else:
+        first, count = 0, 0
+    columns = full((len(keys), count), nan, dtype=float32)
+    for row, key in enumerate(keys):
+        series_first, values = series[key]
+        columns[row, series_first - first:series_first - first + len(values)] = values
+    directory = dumps([list(key) for key in keys]).encode()
+    directory_end = _SNAPSHOT_HEADER.size + len(directory)
+
+    directory_path = path.dirname(file_path)
+    makedirs(directory_path, exist_ok=True)
+    with NamedTemporaryFile("wb", dir=directory_path, delete=False) as temporary_file:
+        temporary_file.write(_SNAPSHOT_HEADER.pack(
+            _SNAPSHOT_MAGIC, version, first, count, len(directory)))
+        temporary_file.write(directory)
+        temporary_file.write(b"\0" * _get_padding(directory_end))
+        temporary_file.write(columns.astype("<f4").tobytes())
+        temporary_file.flush()
+        fsync(temporary_file.fileno())
+    replace(temporary_file.name, file_path)
+
+
+def _get_padding(length):
+    """The padding after the header that aligns the columns to 8 bytes."""
+    return -length % 8
+
+
+def _read_series():
+    """Reads every series from the database with a single query.
+
+    Returns:
+      A dictionary mapping (value_type, region) tuples of database keys to
+      tuples of the month offset of the first value and an array of values
+      for each month from then on, with NaN for missing values.
+    """
+    rows = HistoricalData.objects\
+        .order_by("value_type", "region", "year", "month")\
+        .values_list("value_type", "region", "year", "month", "value")
+    grouped = {}
+    for value_type_key, region_key, year, month, value in rows:
+        offsets, values = grouped.setdefault(
+            (value_type_key, region_key), ([], []))
+        offsets.append(year * 12 + month - 1)
+        values.append(value)
+    series = {}
+    for key, (offsets, values) in grouped.items():
+        first = offsets[0]
+        series_values = full(offsets[-1] - first + 1, nan)
+        series_values[array(offsets) - first] = values
+        series[key] = (first, series_values)
+    return series
+
+
+def get_series_store(version_getter):
+    """Gets the series store, if one is enabled.
+
+    The store is enabled by setting MET_DATA_SERIES_STORE to "memory", for a
+    SeriesStore, or "snapshot", for a SnapshotStore of the file at
+    MET_DATA_SNAPSHOT_PATH. It is loaded on first use, and reloaded whenever
+    the dataset version changes. If the snapshot file is missing, corrupt or
+    out of date, it is not opened again until the dataset version changes or
+    RETRY_SECONDS have passed, as the new snapshot is written after the data
+    is stored.
+
+    Args:
+      version_getter: A callable taking no arguments that returns the
+        current dataset version. It is only called if a store is enabled.
+
+    Returns:
+      A SeriesStore or SnapshotStore, or None if no store is enabled or the
+      snapshot file is missing, corrupt or out of date.
+    """
+    global _store, _failed_load
+    mode = getattr(settings, "MET_DATA_SERIES_STORE", None)
+    if mode not in ("memory", "snapshot"):
+        return None
+    version = version_getter()
+    store = _store
+    if store is not None and store.version == version:
+        return store
+    with _lock:
+        if _store is not None and _store.version == version:
+            return _store
+        if _failed_load is not None:
+            failed_version, failed_at = _failed_load
+            if failed_version == version and monotonic() - failed_at < RETRY_SECONDS:
+                return None
+        store = _load_store(mode, version)
+        if store is None or store.version != version:
+            _failed_load = (version, monotonic())
+            return None
+        _store = store
+        _failed_load = None
+        _log_load(store)
+        return store
+
+
+def preload_series_store(version_getter):
+    """Loads the series store, if it is enabled, when the app starts.
+
+    Under gunicorn with preload_app this runs before the workers are forked.
+    The database connection is then closed, so that the workers do not share
+    it. If the database is not ready, for example before the first migrate,
+    the store is loaded on first use instead.
+
+    Args:
+      version_getter: A callable taking no arguments that returns the
+        current dataset version.
+    """
+    if getattr(settings, "MET_DATA_SERIES_STORE", None) not in ("memory", "snapshot"):
+        return
+    try:
+        get_series_store(version_getter)
+    except DatabaseError:
+        logger.warning("Could not preload the series store.", exc_info=True)
+    finally:
+        connection.close()
+
+
+def _load_store(mode, version):
+    if mode == "memory":
+        return SeriesStore.load(version)
+    try:
+        return SnapshotStore(settings.MET_DATA_SNAPSHOT_PATH)
+    except FileNotFoundError:
+        logger.warning(
+            "No snapshot at %s, reading from the database.",
+            settings.MET_DATA_SNAPSHOT_PATH)
+        return None
+    except (OSError, ValueError, StructError):
+        logger.warning(
+            "Could not open the snapshot at %s, reading from the database.",
+            settings.MET_DATA_SNAPSHOT_PATH,
+            exc_info=True)
+        return None
+
+
+def _log_load(store):
+    if getrusage is None:
+        max_resident = "unknown"
+    else:
+        max_resident = "{} KiB".format(getrusage(RUSAGE_SELF).ru_maxrss)
+    logger.info(
+        "Loaded series store for dataset version %d in %.3f s: "
+        "%d bytes of series, process max resident size %s.",
+        store.version,
+        store.load_seconds,
+        store.nbytes,
+        max_resident)
@@ -0,0 +1,182 @@
+from unittest import TestCase
+
+from numpy import arange, array, isnan, nan, sin
+
+from historical_data.data.analytics import (
+    column_statistics,
+    largest_triangle_three_buckets,
+    least_squares_slopes,
+    monthly_anomalies,
+    pairwise_correlations,
+    rolling_mean)
+
+
+class LargestTriangleThreeBucketsTests(TestCase):
+
+    def test_keeps_every_column_if_not_more_than_threshold(self):
+        values = array([[1.0, 2.0, 3.0, 4.0]])
+
+        returned = largest_triangle_three_buckets(values, 4)
+
+        self.assertEqual(returned.tolist(), [0, 1, 2, 3])
+
+    def test_keeps_first_and_last_and_threshold_columns(self):
+        values = array([sin(arange(1000) / 10.0)])
+
+        returned = largest_triangle_three_buckets(values, 50)
+
+        self.assertEqual(len(returned), 50)
+        self.assertEqual(returned[0], 0)
+        self.assertEqual(returned[-1], 999)
+        self.assertTrue((returned[1:] > returned[:-1]).all())
+
+    def test_keeps_spike(self):
+        values = array([[0.0] * 50 + [100.0] + [0.0] * 49])
+
+        returned = largest_triangle_three_buckets(values, 10)
+
+        self.assertIn(50, returned.tolist())
+
+    def test_keeps_spike_in_any_series_with_missing_values(self):
+        values = array([
+            [0.0] * 30 + [nan] * 70,
+            [nan] * 30 + [0.0] * 40 + [100.0] + [0.0] * 29])
+
+        returned = largest_triangle_three_buckets(values, 10)
+
+        self.assertIn(70, returned.tolist())
+
+
+class RollingMeanTests(TestCase):
+
+    def test_averages_trailing_window(self):
+        values = array([[1.0, 2.0, 3.0, 4.0, 5.0]])
+
+        returned = rolling_mean(values, 3)
+
+        self.assertTrue(isnan(returned[0, :2]).all())
+        self.assertEqual(returned[0, 2:].tolist(), [2.0, 3.0, 4.0])
+
+    def test_returns_nan_for_windows_with_missing_values(self):
+        values = array([
+            [1.0, nan, 3.0, 4.0, 5.0],
+            [1.0, 1.0, 1.0, 1.0, 1.0]])
+
+        returned = rolling_mean(values, 2)
+
+        self.assertTrue(isnan(returned[0, :3]).all())
+        self.assertEqual(returned[0, 3:].tolist(), [3.5, 4.5])
+        self.assertEqual(returned[1, 1:].tolist(), [1.0, 1.0, 1.0, 1.0])
+
+    def test_returns_all_nan_if_window_longer_than_series(self):
+        values = array([[1.0, 2.0]])
+
+        returned = rolling_mean(values, 3)
+
+        self.assertTrue(isnan(returned).all())
+
+
+class MonthlyAnomaliesTests(TestCase):
+
+    def test_subtracts_baseline_mean_for_each_calendar_month(self):
+        # Three years from January 2000, with a baseline of 2000-2001.
+        values = array([
+            [1.0] * 12 + [3.0] * 12 + [10.0] * 12,
+            list(range(12)) * 2 + [20.0] * 12])
+
+        returned = monthly_anomalies(values, 2000 * 12, 2000, 2001)
+
+        self.assertEqual(returned[0].tolist(), [-1.0] * 12 + [1.0] * 12 + [8.0] * 12)
+        self.assertEqual(returned[1].tolist(), [0.0] * 24 + [20.0 - m for m in range(12)])
+
+    def test_ignores_missing_values_in_baseline(self):
+        # From December 1999, so column 1 is January 2000.
+        values = array([[5.0, nan, 2.0] + [0.0] * 10 + [4.0, 7.0]])
+
+        returned = monthly_anomalies(values, 1999 * 12 + 11, 2000, 2001)
+
+        self.assertEqual(returned[0, 0], 5.0)
+        self.assertTrue(isnan(returned[0, 1]))
+        self.assertEqual(returned[0, 13], 0.0)
+        self.assertEqual(returned[0, 14], 2.5)
+
+
+class LeastSquaresSlopesTests(TestCase):
+
+    def test_fits_each_series_skipping_missing_values(self):
+        values = array([
+            [1.0, 3.0, 5.0, 7.0],
+            [nan, 10.0, nan, 8.0],
+            [2.0, 4.0, 2.0, 4.0]])
+
+        returned = least_squares_slopes(values)
+
+        self.assertEqual(returned.tolist(), [2.0, -1.0, 0.4])
+
+    def test_returns_nan_for_fewer_than_two_values(self):
+        values = array([[nan, 1.0, nan], [nan, nan, nan]])
+
+        self.assertTrue(isnan(least_squares_slopes(values)).all())
+
+
+class PairwiseCorrelationsTests(TestCase):
+
+    def test_correlates_each_pair_over_months_both_have(self):
+        values = array([
+            [1.0, 2.0, 3.0, 4.0],
+            [2.0, 4.0, 6.0, nan],
+            [nan, 3.0, 2.0, 1.0]])
+
+        returned = pairwise_correlations(values)
+
+        self.assertEqual(returned.shape, (3, 3))
+        self.assertAlmostEqual(returned[0, 1], 1.0)
+        self.assertAlmostEqual(returned[1, 0], 1.0)
+        self.assertAlmostEqual(returned[0, 2], -1.0)
+        self.assertAlmostEqual(returned[1, 2], -1.0)
+        self.assertAlmostEqual(returned[2, 2], 1.0)
+
+    def test_returns_nan_if_too_few_common_months_or_constant(self):
+        values = array([
+            [1.0, 2.0, nan, nan],
+            [nan, 5.0, 6.0, nan],
+            [3.0, 3.0, 3.0, 3.0]])
+
+        returned = pairwise_correlations(values)
+
+        self.assertTrue(isnan(returned[0, 1]))
+        self.assertTrue(isnan(returned[0, 2]))
+        self.assertTrue(isnan(returned[2, 2]))
+        self.assertAlmostEqual(returned[0, 0], 1.0)
+
+
+class ColumnStatisticsTests(TestCase):
+
+    def test_calculates_statistics_of_each_column_skipping_missing_values(self):
+        values = array([
+            [4.0, nan],
+            [1.0, nan],
+            [3.0, 2.0],
+            [4.0, nan]])
+
+        returned = column_statistics(values, [50, 100])
+
+        self.assertEqual(returned["count"].tolist(), [4, 1])
+        self.assertEqual(returned["mean"].tolist(), [3.0, 2.0])
+        self.assertAlmostEqual(returned["std"][0], 1.224744871)
+        self.assertEqual(returned["std"][1], 0.0)
+        self.assertEqual(returned["minimum"].tolist(), [1.0, 2.0])
+        self.assertEqual(returned["minimum_index"].tolist(), [1, 2])
+        self.assertEqual(returned["maximum"].tolist(), [4.0, 2.0])
+        self.assertEqual(returned["maximum_index"].tolist(), [0, 2])
+        self.assertEqual(returned["percentiles"].tolist(), [[3.5, 2.0], [4.0, 2.0]])
+
+    def test_returns_nan_for_columns_without_values(self):
+        values = array([[nan, 1.0], [nan, nan]])
+
+        returned = column_statistics(values, [50])
+
+        self.assertEqual(returned["count"].tolist(), [0, 1])
+        self.assertTrue(isnan(returned["mean"][0]))
+        self.assertTrue(isnan(returned["percentiles"][0, 0]))
+        self.assertEqual(returned["maximum_index"].tolist(), [-1, 0])
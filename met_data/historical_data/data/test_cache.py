@@ -0,0 +1,137 @@
+from os import listdir, path
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import sleep
+from unittest import skipIf
+from unittest.mock import Mock
+
+from django.core.cache import caches
+from django.test import TestCase
+
+from historical_data.data import cache
+from historical_data.data.cache import CACHE_ALIAS, get_or_compute
+from historical_data.data.handlers import bump_dataset_version
+
+
+class GetOrComputeTests(TestCase):
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+
+    def test_computes_value_on_miss(self):
+        compute = Mock(return_value="value")
+
+        returned = get_or_compute("name", ["a", "b"], compute)
+
+        self.assertEqual(returned, "value")
+        compute.assert_called_once_with()
+
+    def test_returns_cached_value_on_hit(self):
+        get_or_compute("name", ["a", "b"], Mock(return_value="value"))
+        compute = Mock(return_value="other value")
+
+        returned = get_or_compute("name", ["a", "b"], compute)
+
+        self.assertEqual(returned, "value")
+        compute.assert_not_called()
+
+    def test_computes_value_for_different_key(self):
+        get_or_compute("name", ["a", "b"], Mock(return_value="value"))
+
+        returned = get_or_compute(
+            "name", ["a", "c"], Mock(return_value="other value"))
+
+        self.assertEqual(returned, "other value")
+
+    def test_recomputes_value_once_dataset_version_bumped(self):
+        get_or_compute("name", ["a", "b"], Mock(return_value="value"))
+        bump_dataset_version()
+
+        returned = get_or_compute(
+            "name", ["a", "b"], Mock(return_value="new value"))
+
+        self.assertEqual(returned, "new value")
+
+
+class GetOrComputeConcurrencyTests(TestCase):
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        self.calls = []
+
+    def _compute_after(self, event, value):
+        def _compute():
+            self.calls.append(value)
+            event.wait(5)
+            return value
+        return _compute
+
+    def _start(self, compute, returned):
+        thread = Thread(
+            target=lambda: returned.append(
+                get_or_compute("name", ["a"], compute, version=1)))
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        return thread
+
+    def _wait_for(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            sleep(0.01)
+        self.fail("Timed out waiting.")
+
+    def test_computes_once_for_concurrent_misses_on_same_key(self):
+        release = Event()
+        returned = []
+        first = self._start(self._compute_after(release, "first"), returned)
+        self._wait_for(lambda: self.calls)
+        others = [
+            self._start(self._compute_after(release, "other"), returned)
+            for _ in range(3)]
+        self._wait_for(lambda: cache._key_locks["name:1:a"][1] == 4)
+
+        release.set()
+        for thread in [first] + others:
+            thread.join(5)
+
+        self.assertEqual(self.calls, ["first"])
+        self.assertEqual(returned, ["first"] * 4)
+        self.assertEqual(cache._key_locks, {})
+
+    def test_computes_again_if_computing_fails(self):
+        with self.assertRaises(ValueError):
+            get_or_compute("name", ["a"], Mock(side_effect=ValueError), version=1)
+
+        returned = get_or_compute("name", ["a"], Mock(return_value="value"), version=1)
+
+        self.assertEqual(returned, "value")
+        self.assertEqual(cache._key_locks, {})
+
+    @skipIf(cache.flock is None, "Lock files need fcntl.")
+    def test_waits_for_lock_file_held_by_another_process(self):
+        from fcntl import LOCK_EX, LOCK_UN, flock
+
+        lock_directory = TemporaryDirectory()
+        self.addCleanup(lock_directory.cleanup)
+        settings_override = self.settings(MET_DATA_CACHE_LOCK_DIR=lock_directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_or_compute("name", ["b"], Mock(return_value="value"), version=1)
+        (lock_name,) = listdir(lock_directory.name)
+        returned = []
+
+        # A lock taken through another open file conflicts as if it were
+        # held by another process.
+        with open(path.join(lock_directory.name, lock_name)) as lock_file:
+            flock(lock_file.fileno(), LOCK_EX)
+            thread = Thread(target=lambda: returned.append(
+                get_or_compute("name", ["b"], Mock(return_value="new"), version=2)))
+            thread.start()
+            sleep(0.1)
+            self.assertEqual(returned, [])
+            flock(lock_file.fileno(), LOCK_UN)
+        thread.join(5)
+
+        self.assertEqual(returned, ["new"])
+        self.assertEqual(listdir(lock_directory.name), [lock_name])
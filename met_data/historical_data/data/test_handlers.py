@@ -1,14 +1,40 @@
 from django.test import TestCase
+from base64 import b64decode
+from math import isnan
+from struct import unpack
+
+from django.core.exceptions import ValidationError
 from historical_data.data.handlers import (
+    bump_dataset_version,
     create_or_update_data_point,
-    get_time_series)
+    get_aggregate_series,
+    get_batch_time_series,
+    get_compact_time_series,
+    get_climatology,
+    get_dataset_version,
+    get_region_statistics,
+    get_rolling_means_and_anomalies,
+    get_time_series,
+    iter_data_points,
+    has_climatology,
+    merge_datasets,
+    refresh_climatology,
+    sync_aggregate_points)
 from historical_data.data.models import (
+    HistoricalAggregate,
+    HistoricalClimatology,
     HistoricalData,
     region_mapper,
     month_mapper,
     value_type_mapper)
 from historical_data.data.met_data_getter import  Month, Region, ValueType
-from historical_data.data.met_data_getter import  DataPoint
+from historical_data.data.met_data_getter import  AggregatePoint, DataPoint, Period
+from historical_data.data.data_types import Dataset
+
+
+def _store_data_points(data_points):
+    for data_point in data_points:
+        create_or_update_data_point(*data_point)
 
 
 class GetTimeSeriesTests(TestCase):
@@ -90,6 +116,165 @@ class GetTimeSeriesTests(TestCase):
 
         self.assertEqual(expected_value_series, returned_value_series)
 
+    def test_returns_empty_labels_and_series_data_if_no_data(self):
+        create_or_update_data_point(
+            Region.WALES, 1913, Month.MAY, ValueType.SUNSHINE, 45.5)
+
+        returned = get_time_series(ValueType.RAINFALL, [Region.WALES, Region.UK])
+
+        self.assertEqual(returned, {
+            "value_type": "Rainfall",
+            "labels": [],
+            "series": [
+                {"name": "Wales", "data": []},
+                {"name": "UK", "data": []}]})
+
+    def test_returns_series_in_order_of_regions(self):
+        create_or_update_data_point(
+            Region.WALES, 1913, Month.MAY, ValueType.RAINFALL, 45.5)
+        create_or_update_data_point(
+            Region.UK, 1913, Month.JUN, ValueType.RAINFALL, 12.5)
+
+        returned = get_time_series(ValueType.RAINFALL, [Region.UK, Region.WALES])
+
+        self.assertEqual(returned["series"], [
+            {"name": "UK", "data": [None, 12.5]},
+            {"name": "Wales", "data": [45.5, None]}])
+
+    def test_downsamples_every_region_to_same_months_if_max_points_given(self):
+        data_points = {
+            DataPoint(region, year, month, ValueType.RAINFALL, float(year))
+            for region in [Region.WALES, Region.UK]
+            for year in range(1910, 1920)
+            for month in Month}
+        _store_data_points(data_points)
+
+        returned = get_time_series(
+            ValueType.RAINFALL, [Region.WALES, Region.UK], max_points=16)
+
+        self.assertEqual(len(returned["labels"]), 16)
+        self.assertEqual(returned["labels"][0], "1910-JAN")
+        self.assertEqual(returned["labels"][-1], "1919-DEC")
+        for series in returned["series"]:
+            self.assertEqual(
+                series["data"],
+                [float(label[:4]) for label in returned["labels"]])
+
+    def test_returns_only_months_between_start_and_end(self):
+        data_points = {
+            DataPoint(Region.WALES, year, month, ValueType.RAINFALL, 1.0)
+            for year in range(1910, 1920)
+            for month in Month}
+        _store_data_points(data_points)
+
+        returned = get_time_series(
+            ValueType.RAINFALL,
+            [Region.WALES],
+            start=(1912, Month.NOV),
+            end=(1913, Month.FEB))
+
+        self.assertEqual(
+            returned["labels"], ["1912-NOV", "1912-DEC", "1913-JAN", "1913-FEB"])
+        self.assertEqual(returned["series"][0]["data"], [1.0] * 4)
+
+    def test_returns_months_from_start_to_latest_if_no_end(self):
+        data_points = {
+            DataPoint(Region.WALES, year, month, ValueType.RAINFALL, 1.0)
+            for year in range(1910, 1920)
+            for month in Month}
+        _store_data_points(data_points)
+
+        returned = get_time_series(
+            ValueType.RAINFALL, [Region.WALES], start=(1919, Month.OCT))
+
+        self.assertEqual(returned["labels"], ["1919-OCT", "1919-NOV", "1919-DEC"])
+
+class GetBatchTimeSeriesTests(TestCase):
+
+    def test_returns_value_types_on_shared_labels_with_one_query(self):
+        create_or_update_data_point(Region.UK, 1990, Month.JAN, ValueType.MAX_TEMP, 5.5)
+        create_or_update_data_point(Region.UK, 1990, Month.MAR, ValueType.MIN_TEMP, 1.5)
+        create_or_update_data_point(Region.WALES, 1990, Month.FEB, ValueType.MIN_TEMP, 0.5)
+        create_or_update_data_point(Region.UK, 1990, Month.APR, ValueType.RAINFALL, 80.0)
+
+        with self.assertNumQueries(1):
+            returned = get_batch_time_series(
+                [ValueType.MAX_TEMP, ValueType.MIN_TEMP],
+                [Region.UK, Region.WALES])
+
+        self.assertEqual(returned, {
+            "labels": ["1990-JAN", "1990-FEB", "1990-MAR"],
+            "time_series": [{
+                "value_type": "Maximum Temperature",
+                "series": [
+                    {"name": "UK", "data": [5.5, None, None]},
+                    {"name": "Wales", "data": [None, None, None]}]
+            }, {
+                "value_type": "Minimum Temperature",
+                "series": [
+                    {"name": "UK", "data": [None, None, 1.5]},
+                    {"name": "Wales", "data": [None, 0.5, None]}]}]})
+
+    def test_returns_empty_labels_and_series_data_if_no_data(self):
+        returned = get_batch_time_series(
+            [ValueType.MAX_TEMP, ValueType.SUNSHINE], [Region.UK], max_points=3)
+
+        self.assertEqual(returned["labels"], [])
+        self.assertEqual(
+            [time_series["series"] for time_series in returned["time_series"]],
+            [[{"name": "UK", "data": []}], [{"name": "UK", "data": []}]])
+
+
+class GetCompactTimeSeriesTests(TestCase):
+
+    def _decode(self, data):
+        raw = b64decode(data)
+        return unpack("<{}f".format(len(raw) // 4), raw)
+
+    def test_returns_start_count_and_float32_series(self):
+        data_points = {
+            DataPoint(Region.WALES, 1913, Month.NOV, ValueType.RAINFALL, 23.5),
+            DataPoint(Region.ENGLAND, 1914, Month.JAN, ValueType.RAINFALL, 22.25),
+            DataPoint(Region.ENGLAND, 1914, Month.FEB, ValueType.SUNSHINE, 45.5)}
+        _store_data_points(data_points)
+
+        returned = get_compact_time_series(
+            ValueType.RAINFALL, [Region.WALES, Region.ENGLAND])
+        wales, england = [self._decode(s["data"]) for s in returned["series"]]
+
+        self.assertEqual(returned["format"], 2)
+        self.assertEqual(returned["value_type"], "Rainfall")
+        self.assertEqual(returned["start"], {"year": 1913, "month": 11})
+        self.assertEqual(returned["count"], 3)
+        self.assertEqual(
+            [s["name"] for s in returned["series"]], ["Wales", "England"])
+        self.assertEqual(wales[0], 23.5)
+        self.assertTrue(isnan(wales[1]) and isnan(wales[2]))
+        self.assertTrue(isnan(england[0]) and isnan(england[1]))
+        self.assertEqual(england[2], 22.25)
+
+    def test_returns_offsets_if_downsampled(self):
+        data_points = {
+            DataPoint(Region.WALES, year, month, ValueType.RAINFALL, float(year))
+            for year in range(1910, 1920)
+            for month in Month}
+        _store_data_points(data_points)
+
+        returned = get_compact_time_series(
+            ValueType.RAINFALL, [Region.WALES], max_points=16)
+
+        self.assertEqual(returned["count"], 120)
+        self.assertEqual(len(returned["offsets"]), 16)
+        self.assertEqual(returned["offsets"][-1], 119)
+        self.assertEqual(len(self._decode(returned["series"][0]["data"])), 16)
+
+    def test_returns_no_start_if_no_data(self):
+        returned = get_compact_time_series(ValueType.RAINFALL, [Region.WALES])
+
+        self.assertIsNone(returned["start"])
+        self.assertEqual(returned["count"], 0)
+        self.assertEqual(returned["series"], [{"name": "Wales", "data": ""}])
+
 class CreateOrUpdateDataPointTests(TestCase):
 
     def test_creates_if_no_entry_for_time_region_and_data_type_exists(self):
@@ -260,3 +445,401 @@ class CreateOrUpdateDataPointTests(TestCase):
         self.assertEqual(entry.value, new_value)
 
 
+class MergeDatasetsTests(TestCase):
+
+    def setUp(self):
+        _store_data_points({
+            DataPoint(Region.UK, 1980, Month.MAY, ValueType.MAX_TEMP, 12.5),
+            DataPoint(Region.UK, 1980, Month.JUN, ValueType.MAX_TEMP, 15.5),
+            DataPoint(Region.UK, 1980, Month.JUL, ValueType.MAX_TEMP, 17.5),
+            DataPoint(Region.WALES, 1980, Month.JUL, ValueType.MAX_TEMP, 16.5)})
+        sync_aggregate_points(Region.UK, ValueType.MAX_TEMP, {
+            AggregatePoint(Region.UK, 1980, Period.SUM, ValueType.MAX_TEMP, 16.0)})
+
+    def test_inserts_updates_and_deletes_only_changed_entries_of_each_dataset(self):
+        unchanged = HistoricalData.objects.get(
+            region="uk", value_type="max_temp", month=5)
+        uk_max_temp = Dataset(
+            {
+                DataPoint(Region.UK, 1980, Month.MAY, ValueType.MAX_TEMP, 12.5),
+                DataPoint(Region.UK, 1980, Month.JUN, ValueType.MAX_TEMP, 15.7),
+                DataPoint(Region.UK, 1980, Month.AUG, ValueType.MAX_TEMP, 18.5)},
+            {AggregatePoint(Region.UK, 1980, Period.SUM, ValueType.MAX_TEMP, 16.5)})
+        uk_rainfall = Dataset(
+            {DataPoint(Region.UK, 1980, Month.JUL, ValueType.RAINFALL, 45.0)},
+            set())
+
+        returned = merge_datasets([
+            (Region.UK, ValueType.MAX_TEMP, uk_max_temp),
+            (Region.UK, ValueType.RAINFALL, uk_rainfall)])
+
+        self.assertEqual(returned, [
+            (Region.UK, ValueType.MAX_TEMP, (1, 1, 1), (0, 1, 0)),
+            (Region.UK, ValueType.RAINFALL, (1, 0, 0), (0, 0, 0))])
+        self.assertEqual(
+            set(HistoricalData.objects.values_list(
+                "region", "month", "value_type", "value")),
+            {
+                ("uk", 5, "max_temp", 12.5),
+                ("uk", 6, "max_temp", 15.7),
+                ("uk", 8, "max_temp", 18.5),
+                ("wales", 7, "max_temp", 16.5),
+                ("uk", 7, "rainfall", 45.0)})
+        self.assertEqual(
+            list(HistoricalAggregate.objects.values_list("value", flat=True)),
+            [16.5])
+        self.assertEqual(
+            HistoricalData.objects.get(
+                region="uk", value_type="max_temp", month=5).pk,
+            unchanged.pk)
+        self.assertEqual(get_dataset_version(), 1)
+
+    def test_does_not_bump_dataset_version_if_nothing_changed(self):
+        uk_max_temp = Dataset(
+            {
+                DataPoint(Region.UK, 1980, Month.MAY, ValueType.MAX_TEMP, 12.5),
+                DataPoint(Region.UK, 1980, Month.JUN, ValueType.MAX_TEMP, 15.5),
+                DataPoint(Region.UK, 1980, Month.JUL, ValueType.MAX_TEMP, 17.5)},
+            {AggregatePoint(Region.UK, 1980, Period.SUM, ValueType.MAX_TEMP, 16.0)})
+
+        returned = merge_datasets([(Region.UK, ValueType.MAX_TEMP, uk_max_temp)])
+
+        self.assertEqual(
+            returned, [(Region.UK, ValueType.MAX_TEMP, (0, 0, 0), (0, 0, 0))])
+        self.assertEqual(get_dataset_version(), 0)
+
+    def test_writes_nothing_if_any_point_is_for_another_dataset(self):
+        datasets = [
+            (Region.UK, ValueType.RAINFALL, Dataset(
+                {DataPoint(Region.UK, 1980, Month.JUL, ValueType.RAINFALL, 45.0)},
+                set())),
+            (Region.UK, ValueType.MAX_TEMP, Dataset(
+                {DataPoint(Region.WALES, 1980, Month.MAY, ValueType.MAX_TEMP, 1.0)},
+                set()))]
+
+        with self.assertRaises(ValueError):
+            merge_datasets(datasets)
+
+        self.assertEqual(HistoricalData.objects.count(), 4)
+
+    def test_writes_nothing_if_any_dataset_is_empty(self):
+        datasets = [
+            (Region.UK, ValueType.RAINFALL, Dataset(
+                {DataPoint(Region.UK, 1980, Month.JUL, ValueType.RAINFALL, 45.0)},
+                set())),
+            (Region.UK, ValueType.MAX_TEMP, Dataset(set(), set()))]
+
+        with self.assertRaisesRegex(ValueError, "UK MAX_TEMP"):
+            merge_datasets(datasets)
+
+        self.assertEqual(HistoricalData.objects.count(), 4)
+        self.assertEqual(HistoricalAggregate.objects.count(), 1)
+        self.assertEqual(get_dataset_version(), 0)
+
+    def test_writes_nothing_if_dataset_much_smaller_than_stored(self):
+        uk_max_temp = Dataset(
+            {DataPoint(Region.UK, 1980, Month.MAY, ValueType.MAX_TEMP, 12.5)},
+            {AggregatePoint(Region.UK, 1980, Period.SUM, ValueType.MAX_TEMP, 16.0)})
+
+        with self.assertRaises(ValueError):
+            merge_datasets([(Region.UK, ValueType.MAX_TEMP, uk_max_temp)])
+
+        self.assertEqual(
+            HistoricalData.objects.filter(region="uk", value_type="max_temp").count(),
+            3)
+
+    def test_writes_nothing_if_aggregates_missing(self):
+        uk_max_temp = Dataset(
+            {
+                DataPoint(Region.UK, 1980, Month.MAY, ValueType.MAX_TEMP, 12.5),
+                DataPoint(Region.UK, 1980, Month.JUN, ValueType.MAX_TEMP, 15.5),
+                DataPoint(Region.UK, 1980, Month.JUL, ValueType.MAX_TEMP, 17.5)},
+            set())
+
+        with self.assertRaises(ValueError):
+            merge_datasets([(Region.UK, ValueType.MAX_TEMP, uk_max_temp)])
+
+        self.assertEqual(HistoricalAggregate.objects.count(), 1)
+
+
+class IterDataPointsTests(TestCase):
+
+    def setUp(self):
+        _store_data_points({
+            DataPoint(Region.UK, 1980, Month.JUN, ValueType.MAX_TEMP, 15.5),
+            DataPoint(Region.UK, 1980, Month.MAY, ValueType.MAX_TEMP, 12.5),
+            DataPoint(Region.WALES, 1981, Month.JUL, ValueType.MAX_TEMP, 16.5),
+            DataPoint(Region.UK, 1980, Month.JUL, ValueType.RAINFALL, 45.0)})
+
+    def test_iterates_over_every_datapoint_in_order(self):
+        returned = iter_data_points(chunk_size=1)
+
+        self.assertEqual(list(returned), [
+            ("max_temp", "uk", 1980, 5, 12.5),
+            ("max_temp", "uk", 1980, 6, 15.5),
+            ("max_temp", "wales", 1981, 7, 16.5),
+            ("rainfall", "uk", 1980, 7, 45.0)])
+
+    def test_filters_by_value_type_region_and_date_range(self):
+        returned = iter_data_points(
+            value_types=[ValueType.MAX_TEMP],
+            regions=[Region.UK, Region.WALES],
+            start=(1980, Month.JUN),
+            end=(1981, Month.JUN))
+
+        self.assertEqual(list(returned), [("max_temp", "uk", 1980, 6, 15.5)])
+
+
+class DatasetVersionTests(TestCase):
+
+    def test_version_is_zero_if_never_bumped(self):
+        self.assertEqual(get_dataset_version(), 0)
+
+    def test_bump_increments_version(self):
+        bump_dataset_version()
+        returned = bump_dataset_version()
+
+        self.assertEqual(returned, 2)
+        self.assertEqual(get_dataset_version(), 2)
+
+
+class SyncAggregatePointsTests(TestCase):
+
+    def test_inserts_updates_and_deletes_only_changed_entries(self):
+        sync_aggregate_points(Region.UK, ValueType.RAINFALL, {
+            AggregatePoint(Region.UK, 1980, Period.WIN, ValueType.RAINFALL, 300.5),
+            AggregatePoint(Region.UK, 1980, Period.SPR, ValueType.RAINFALL, 200.5),
+            AggregatePoint(Region.UK, 1980, Period.ANN, ValueType.RAINFALL, 1000.5)})
+        aggregate_points = {
+            AggregatePoint(Region.UK, 1980, Period.WIN, ValueType.RAINFALL, 300.5),
+            AggregatePoint(Region.UK, 1980, Period.SPR, ValueType.RAINFALL, 210.5),
+            AggregatePoint(Region.UK, 1981, Period.ANN, ValueType.RAINFALL, 900.5)}
+        expected = {(1980, 1, 300.5), (1980, 2, 210.5), (1981, 5, 900.5)}
+
+        returned = sync_aggregate_points(
+            Region.UK, ValueType.RAINFALL, aggregate_points)
+
+        self.assertEqual(returned, (1, 1, 1))
+        self.assertEqual(
+            set(HistoricalAggregate.objects.values_list("year", "period", "value")),
+            expected)
+
+    def test_raises_value_error_if_aggregate_point_for_another_series(self):
+        aggregate_points = {
+            AggregatePoint(Region.UK, 1980, Period.WIN, ValueType.SUNSHINE, 300.5)}
+
+        with self.assertRaises(ValueError):
+            sync_aggregate_points(Region.UK, ValueType.RAINFALL, aggregate_points)
+
+
+class GetAggregateSeriesTests(TestCase):
+
+    def test_returns_yearly_series_for_period_filling_missing_years_with_none(self):
+        sync_aggregate_points(Region.UK, ValueType.MAX_TEMP, {
+            AggregatePoint(Region.UK, 1980, Period.ANN, ValueType.MAX_TEMP, 12.5),
+            AggregatePoint(Region.UK, 1982, Period.ANN, ValueType.MAX_TEMP, 13.5),
+            AggregatePoint(Region.UK, 1983, Period.WIN, ValueType.MAX_TEMP, 6.5)})
+        sync_aggregate_points(Region.WALES, ValueType.MAX_TEMP, {
+            AggregatePoint(Region.WALES, 1981, Period.ANN, ValueType.MAX_TEMP, 11.5)})
+
+        returned = get_aggregate_series(
+            ValueType.MAX_TEMP, Period.ANN, [Region.UK, Region.WALES])
+
+        self.assertEqual(returned, {
+            "value_type": "Maximum Temperature",
+            "period": "Annual",
+            "labels": [1980, 1981, 1982],
+            "series": [
+                {"name": "UK", "data": [12.5, None, 13.5]},
+                {"name": "Wales", "data": [None, 11.5, None]}]})
+
+    def test_returns_empty_labels_and_series_data_if_no_data(self):
+        returned = get_aggregate_series(ValueType.MAX_TEMP, Period.SUM, [Region.UK])
+
+        self.assertEqual(returned["labels"], [])
+        self.assertEqual(returned["series"], [{"name": "UK", "data": []}])
+
+
+class GetRollingMeansAndAnomaliesTests(TestCase):
+
+    def _create_year(self, region, year, values):
+        for month, value in zip(Month, values):
+            create_or_update_data_point(
+                region, year, month, ValueType.MEAN_TEMP, value)
+
+    def test_returns_rolling_means_and_anomalies_for_each_region(self):
+        self._create_year(Region.UK, 1961, [1.0] * 12)
+        self._create_year(Region.UK, 1962, [3.0] * 12)
+        self._create_year(Region.WALES, 1962, [2.0] * 12)
+
+        returned = get_rolling_means_and_anomalies(
+            ValueType.MEAN_TEMP,
+            [Region.UK, Region.WALES],
+            windows=[12, 2],
+            baseline=(1961, 1961))
+
+        self.assertEqual(returned["value_type"], "Mean Temperature")
+        self.assertEqual(returned["baseline"], {"start": 1961, "end": 1961})
+        self.assertEqual(returned["labels"][0], "1961-JAN")
+        self.assertEqual(returned["labels"][-1], "1962-DEC")
+        uk, wales = returned["series"]
+        self.assertEqual(uk["name"], "UK")
+        self.assertEqual(uk["data"], [1.0] * 12 + [3.0] * 12)
+        self.assertEqual(uk["anomalies"], [0.0] * 12 + [2.0] * 12)
+        self.assertEqual(list(uk["rolling_means"]), ["2", "12"])
+        self.assertEqual(
+            uk["rolling_means"]["12"],
+            [None] * 11 + [round(1.0 + 2.0 * n / 12, 3) for n in range(13)])
+        self.assertEqual(uk["rolling_means"]["2"][:2], [None, 1.0])
+        self.assertEqual(wales["anomalies"], [None] * 24)
+        self.assertEqual(wales["rolling_means"]["12"], [None] * 23 + [2.0])
+
+    def test_returns_empty_series_if_no_data(self):
+        returned = get_rolling_means_and_anomalies(
+            ValueType.MEAN_TEMP, [Region.UK], windows=[12])
+
+        self.assertEqual(returned["labels"], [])
+        self.assertEqual(returned["series"], [{
+            "name": "UK", "data": [], "anomalies": [], "rolling_means": {"12": []}}])
+
+
+class GetRegionStatisticsTests(TestCase):
+
+    def test_returns_trends_and_correlations_of_anomalies(self):
+        seasonal_cycle = [float(month) for month in range(12)]
+        for index in range(48):
+            year, month = 1961 + index // 12, Month(index % 12 + 1)
+            # After the baseline year, UK warms and Wales cools by 1.2 a decade.
+            change = 0.0 if year == 1961 else 0.01 * index
+            create_or_update_data_point(
+                Region.UK, year, month, ValueType.MEAN_TEMP,
+                seasonal_cycle[index % 12] + change)
+            create_or_update_data_point(
+                Region.WALES, year, month, ValueType.MEAN_TEMP,
+                seasonal_cycle[index % 12] - change)
+
+        returned = get_region_statistics(
+            ValueType.MEAN_TEMP,
+            [Region.UK, Region.WALES, Region.SCOTLAND],
+            start=(1962, Month.JAN),
+            baseline=(1961, 1961))
+
+        self.assertEqual(returned["value_type"], "Mean Temperature")
+        self.assertEqual(returned["baseline"], {"start": 1961, "end": 1961})
+        self.assertEqual(returned["regions"], ["UK", "Wales", "Scotland"])
+        self.assertEqual(returned["trends"], [
+            {"name": "UK", "per_decade": 1.2, "months": 36},
+            {"name": "Wales", "per_decade": -1.2, "months": 36},
+            {"name": "Scotland", "per_decade": None, "months": 0}])
+        self.assertEqual(returned["correlations"], [
+            [1.0, -1.0, None],
+            [-1.0, 1.0, None],
+            [None, None, None]])
+
+    def test_restricts_to_range(self):
+        for year, value in [(1961, 0.0), (1962, 1.0), (1963, 5.0)]:
+            for month in Month:
+                create_or_update_data_point(
+                    Region.UK, year, month, ValueType.MEAN_TEMP, value)
+
+        returned = get_region_statistics(
+            ValueType.MEAN_TEMP,
+            [Region.UK],
+            start=(1962, Month.JUL),
+            end=(1963, Month.JUN),
+            baseline=(1961, 1961))
+
+        # Six anomalies of 1.0 then six of 5.0: a slope of 4 * 18 / 143 a month.
+        self.assertEqual(returned["trends"], [
+            {"name": "UK", "per_decade": 60.42, "months": 12}])
+
+    def test_returns_no_statistics_if_no_data(self):
+        returned = get_region_statistics(ValueType.MEAN_TEMP, [Region.UK])
+
+        self.assertEqual(returned["trends"], [
+            {"name": "UK", "per_decade": None, "months": 0}])
+        self.assertEqual(returned["correlations"], [[None]])
+
+
+class ClimatologyTests(TestCase):
+
+    def setUp(self):
+        for year, value in [(1990, 14.0), (1991, 18.0), (1992, 16.0), (1993, 18.0)]:
+            create_or_update_data_point(
+                Region.UK, year, Month.JUL, ValueType.MAX_TEMP, value)
+        create_or_update_data_point(Region.UK, 1991, Month.JAN, ValueType.MAX_TEMP, 3.0)
+        create_or_update_data_point(Region.WALES, 1990, Month.JUL, ValueType.MAX_TEMP, 15.0)
+        create_or_update_data_point(Region.UK, 1990, Month.JUL, ValueType.RAINFALL, 60.0)
+
+    def test_refreshes_every_series_by_default(self):
+        written = refresh_climatology()
+
+        self.assertEqual(written, 4)
+        self.assertTrue(has_climatology())
+        july = HistoricalClimatology.objects.get(
+            region="uk", value_type="max_temp", month=7)
+        self.assertEqual(july.count, 4)
+        self.assertEqual(july.mean, 16.5)
+        self.assertEqual((july.minimum, july.minimum_year), (14.0, 1990))
+        self.assertEqual((july.maximum, july.maximum_year), (18.0, 1991))
+        self.assertEqual(july.median, 17.0)
+
+    def test_refreshes_only_given_series(self):
+        refresh_climatology()
+        create_or_update_data_point(Region.UK, 1994, Month.JUL, ValueType.MAX_TEMP, 20.0)
+        create_or_update_data_point(Region.WALES, 1991, Month.JUL, ValueType.MAX_TEMP, 25.0)
+
+        written = refresh_climatology([(Region.UK, ValueType.MAX_TEMP)])
+
+        self.assertEqual(written, 2)
+        self.assertEqual(HistoricalClimatology.objects.count(), 4)
+        self.assertEqual(
+            HistoricalClimatology.objects.get(
+                region="uk", value_type="max_temp", month=7).maximum,
+            20.0)
+        self.assertEqual(
+            HistoricalClimatology.objects.get(
+                region="wales", value_type="max_temp", month=7).maximum,
+            15.0)
+
+    def test_removes_rows_of_series_without_data(self):
+        refresh_climatology()
+        HistoricalData.objects.filter(region="wales").delete()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(refresh_climatology([]), 0)
+        refresh_climatology([(Region.WALES, ValueType.MAX_TEMP)])
+
+        self.assertFalse(
+            HistoricalClimatology.objects.filter(region="wales").exists())
+
+    def test_gets_climatology_of_each_region(self):
+        refresh_climatology()
+
+        with self.assertNumQueries(1):
+            returned = get_climatology(
+                ValueType.MAX_TEMP, [Region.UK, Region.WALES, Region.SCOTLAND])
+
+        self.assertEqual(returned["value_type"], "Maximum Temperature")
+        uk, wales, scotland = returned["series"]
+        self.assertEqual([month["month"] for month in uk["months"]], ["JAN", "JUL"])
+        self.assertEqual(uk["months"][1], {
+            "month": "JUL",
+            "count": 4,
+            "mean": 16.5,
+            "std": 1.658,
+            "minimum": {"value": 14.0, "year": 1990},
+            "maximum": {"value": 18.0, "year": 1991},
+            "percentiles": {
+                "10": 14.6, "25": 15.5, "50": 17.0, "75": 18.0, "90": 18.0}})
+        self.assertEqual(wales["name"], "Wales")
+        self.assertEqual(len(wales["months"]), 1)
+        self.assertEqual(scotland["months"], [])
+
+    def test_gets_climatology_of_one_month(self):
+        refresh_climatology()
+
+        returned = get_climatology(ValueType.MAX_TEMP, [Region.UK], Month.JAN)
+
+        self.assertEqual(
+            [month["month"] for month in returned["series"][0]["months"]], ["JAN"])
@@ -81,3 +81,22 @@ class HistoricalDataTests(TestCase):
             pass
         else:
             self.fail("Should not be able to create without region.")
+
+    def test_cannot_create_two_data_points_for_same_value_type_region_and_time(self):
+        HistoricalData(
+            year=2001,
+            month=4,
+            region="wales",
+            value_type="mean_temp",
+            value=4.2).save()
+        try:
+            HistoricalData(
+                year=2001,
+                month=4,
+                region="wales",
+                value_type="mean_temp",
+                value=5.3).save()
+        except (IntegrityError, ValidationError):
+            pass
+        else:
+            self.fail("Should not be able to create duplicate data point.")
@@ -0,0 +1,233 @@
+from os import listdir, path
+from tempfile import TemporaryDirectory
+from unittest.mock import Mock, patch
+
+from django.test import TestCase, override_settings
+
+from historical_data.data import series_store
+from historical_data.data.handlers import (
+    bump_dataset_version,
+    create_or_update_data_point,
+    get_batch_time_series,
+    get_dataset_version,
+    get_time_series)
+from historical_data.data.met_data_getter import Month, Region, ValueType
+from historical_data.data.series_store import (
+    SnapshotStore,
+    get_series_store,
+    write_snapshot)
+
+
+@override_settings(MET_DATA_SERIES_STORE="memory")
+class SeriesStoreTests(TestCase):
+
+    def setUp(self):
+        for patcher in [
+                patch.object(series_store, "_store", None),
+                patch.object(series_store, "_failed_load", None),
+                patch.object(series_store.logger, "disabled", True)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        create_or_update_data_point(Region.UK, 1990, Month.NOV, ValueType.MAX_TEMP, 5.5)
+        create_or_update_data_point(Region.UK, 1991, Month.FEB, ValueType.MAX_TEMP, 6.5)
+        create_or_update_data_point(Region.WALES, 1990, Month.DEC, ValueType.MAX_TEMP, 4.5)
+        create_or_update_data_point(Region.UK, 1990, Month.DEC, ValueType.MIN_TEMP, 0.5)
+
+    def _get_from_database(self, get_data, *args, **kwargs):
+        with override_settings(MET_DATA_SERIES_STORE=None):
+            return get_data(*args, **kwargs)
+
+    def test_serves_same_time_series_as_database(self):
+        for kwargs in [
+                {},
+                {"start": (1990, Month.DEC)},
+                {"end": (1990, Month.DEC)},
+                {"start": (1991, Month.JAN), "end": (1991, Month.JAN)},
+                {"max_points": 3}]:
+            for regions in [[Region.UK], [Region.UK, Region.WALES], [Region.SCOTLAND]]:
+                self.assertEqual(
+                    get_time_series(ValueType.MAX_TEMP, regions, **kwargs),
+                    self._get_from_database(
+                        get_time_series, ValueType.MAX_TEMP, regions, **kwargs))
+
+    def test_serves_same_batch_time_series_as_database(self):
+        value_types = [ValueType.MAX_TEMP, ValueType.MIN_TEMP]
+        regions = [Region.UK, Region.WALES]
+
+        self.assertEqual(
+            get_batch_time_series(value_types, regions),
+            self._get_from_database(get_batch_time_series, value_types, regions))
+
+    def test_does_not_query_series_once_loaded(self):
+        get_time_series(ValueType.MAX_TEMP, [Region.UK])
+
+        with self.assertNumQueries(1):
+            get_time_series(ValueType.MAX_TEMP, [Region.UK])
+
+    def test_reloads_when_dataset_version_changes(self):
+        get_time_series(ValueType.MAX_TEMP, [Region.UK])
+        create_or_update_data_point(Region.UK, 1991, Month.MAR, ValueType.MAX_TEMP, 9.5)
+        bump_dataset_version()
+
+        returned = get_time_series(ValueType.MAX_TEMP, [Region.UK])
+
+        self.assertEqual(returned["series"][0]["data"][-1], 9.5)
+
+    @patch.object(series_store.logger, "disabled", False)
+    def test_reports_load_time_and_size(self):
+        with self.assertLogs("historical_data.data.series_store", "INFO") as logs:
+            store = get_series_store(get_dataset_version)
+
+        self.assertEqual(store.nbytes, (4 + 1 + 1) * 8)
+        self.assertGreaterEqual(store.load_seconds, 0.0)
+        self.assertIn("{} bytes of series".format(store.nbytes), logs.output[0])
+
+    @override_settings(MET_DATA_SERIES_STORE=None)
+    def test_returns_none_without_getting_version_if_not_enabled(self):
+        version_getter = Mock()
+
+        self.assertIsNone(get_series_store(version_getter))
+        version_getter.assert_not_called()
+
+
+@override_settings(MET_DATA_SERIES_STORE="snapshot")
+class SnapshotStoreTests(TestCase):
+
+    def setUp(self):
+        for patcher in [
+                patch.object(series_store, "_store", None),
+                patch.object(series_store, "_failed_load", None),
+                patch.object(series_store.logger, "disabled", True)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.snapshot_path = path.join(directory.name, "series.snapshot")
+        settings_override = self.settings(MET_DATA_SNAPSHOT_PATH=self.snapshot_path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        create_or_update_data_point(Region.UK, 1990, Month.NOV, ValueType.MAX_TEMP, 5.3)
+        create_or_update_data_point(Region.UK, 1991, Month.FEB, ValueType.MAX_TEMP, 126.7)
+        create_or_update_data_point(Region.WALES, 1990, Month.DEC, ValueType.MAX_TEMP, 4.5)
+        create_or_update_data_point(Region.UK, 1990, Month.DEC, ValueType.MIN_TEMP, 0.1)
+
+    def _get_from_database(self, get_data, *args, **kwargs):
+        with override_settings(MET_DATA_SERIES_STORE=None):
+            return get_data(*args, **kwargs)
+
+    def test_serves_same_time_series_as_database(self):
+        write_snapshot(self.snapshot_path, get_dataset_version())
+
+        for kwargs in [
+                {},
+                {"start": (1990, Month.DEC)},
+                {"end": (1990, Month.DEC)},
+                {"start": (1991, Month.JAN), "end": (1991, Month.JAN)},
+                {"start": (2000, Month.JAN)},
+                {"max_points": 3}]:
+            for regions in [[Region.UK], [Region.UK, Region.WALES], [Region.SCOTLAND]]:
+                self.assertEqual(
+                    get_time_series(ValueType.MAX_TEMP, regions, **kwargs),
+                    self._get_from_database(
+                        get_time_series, ValueType.MAX_TEMP, regions, **kwargs))
+
+    def test_does_not_query_series(self):
+        write_snapshot(self.snapshot_path, get_dataset_version())
+
+        with self.assertNumQueries(1):
+            get_batch_time_series(
+                [ValueType.MAX_TEMP, ValueType.MIN_TEMP], [Region.UK, Region.WALES])
+
+    def test_reads_from_database_if_snapshot_missing_or_out_of_date(self):
+        expected = self._get_from_database(
+            get_time_series, ValueType.MAX_TEMP, [Region.UK])
+
+        self.assertEqual(get_time_series(ValueType.MAX_TEMP, [Region.UK]), expected)
+        write_snapshot(self.snapshot_path, get_dataset_version() + 1)
+        with patch.object(series_store, "RETRY_SECONDS", 0.0):
+            self.assertEqual(
+                get_time_series(ValueType.MAX_TEMP, [Region.UK]), expected)
+            self.assertIsNone(get_series_store(get_dataset_version))
+
+    @patch.object(series_store, "SnapshotStore", wraps=SnapshotStore)
+    def test_does_not_reopen_out_of_date_snapshot_until_version_changes(
+            self,
+            mock_snapshot_store):
+        write_snapshot(self.snapshot_path, get_dataset_version() + 1)
+
+        self.assertIsNone(get_series_store(get_dataset_version))
+        self.assertIsNone(get_series_store(get_dataset_version))
+        self.assertEqual(mock_snapshot_store.call_count, 1)
+        bump_dataset_version()
+
+        self.assertIsNotNone(get_series_store(get_dataset_version))
+        self.assertEqual(mock_snapshot_store.call_count, 2)
+
+    @patch.object(series_store, "monotonic")
+    @patch.object(series_store, "SnapshotStore", wraps=SnapshotStore)
+    def test_retries_missing_snapshot_after_backoff(
+            self,
+            mock_snapshot_store,
+            mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        self.assertIsNone(get_series_store(get_dataset_version))
+        write_snapshot(self.snapshot_path, get_dataset_version())
+
+        mock_monotonic.return_value = 100.0 + series_store.RETRY_SECONDS / 2
+        self.assertIsNone(get_series_store(get_dataset_version))
+        mock_monotonic.return_value = 100.0 + series_store.RETRY_SECONDS
+        store = get_series_store(get_dataset_version)
+
+        self.assertEqual(store.version, get_dataset_version())
+        self.assertEqual(mock_snapshot_store.call_count, 2)
+
+    @patch.object(series_store, "monotonic")
+    @patch.object(series_store, "SnapshotStore", wraps=SnapshotStore)
+    def test_reads_from_database_if_snapshot_corrupt(
+            self,
+            mock_snapshot_store,
+            mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        expected = self._get_from_database(
+            get_time_series, ValueType.MAX_TEMP, [Region.UK])
+        write_snapshot(self.snapshot_path, get_dataset_version())
+        with open(self.snapshot_path, "rb") as snapshot_file:
+            content = snapshot_file.read()
+
+        for corrupt in [b"", b"\0" * 4, b"\0" * 64, content[:len(content) // 2]]:
+            with open(self.snapshot_path, "wb") as snapshot_file:
+                snapshot_file.write(corrupt)
+            mock_monotonic.return_value += series_store.RETRY_SECONDS
+            calls = mock_snapshot_store.call_count
+
+            self.assertEqual(get_time_series(ValueType.MAX_TEMP, [Region.UK]), expected)
+            self.assertEqual(get_time_series(ValueType.MAX_TEMP, [Region.UK]), expected)
+            self.assertEqual(mock_snapshot_store.call_count, calls + 1)
+
+    def test_opens_new_snapshot_when_dataset_version_changes(self):
+        write_snapshot(self.snapshot_path, get_dataset_version())
+        get_time_series(ValueType.MAX_TEMP, [Region.UK])
+        create_or_update_data_point(Region.UK, 1991, Month.MAR, ValueType.MAX_TEMP, 9.5)
+        write_snapshot(self.snapshot_path, bump_dataset_version())
+
+        returned = get_time_series(ValueType.MAX_TEMP, [Region.UK])
+
+        self.assertEqual(returned["series"][0]["data"][-1], 9.5)
+
+    def test_writes_float32_columns_without_leaving_temporary_files(self):
+        write_snapshot(self.snapshot_path, 7)
+
+        store = SnapshotStore(self.snapshot_path)
+
+        self.assertEqual(store.version, 7)
+        self.assertEqual(listdir(self.directory), ["series.snapshot"])
+        self.assertEqual(store._values.shape, (3, 4))
+        self.assertEqual(store._values.dtype.itemsize, 4)
+
+    def test_raises_value_error_if_not_a_snapshot(self):
+        with open(self.snapshot_path, "wb") as snapshot_file:
+            snapshot_file.write(b"\0" * 64)
+
+        with self.assertRaises(ValueError):
+            SnapshotStore(self.snapshot_path)
@@ -1,11 +1,30 @@
-from os import path
+import gzip
+from hashlib import sha256
+from os import listdir, path
+from tempfile import TemporaryDirectory
 from unittest import TestCase, main
 from unittest import skip
+from unittest.mock import patch
 
 import responses
+from requests import HTTPError
 
-from historical_data.data.met_data_getter import get_met_data
-from historical_data.data.met_data_getter import DataPoint, Month, Region, ValueType
+from historical_data.data.met_data_getter import (
+    DownloadArchive,
+    FetchCache,
+    _StreamedDownload,
+    _parse_dataset,
+    get_archived_met_dataset,
+    get_met_data,
+    get_met_dataset,
+    get_all_met_data)
+from historical_data.data.met_data_getter import (
+    AggregatePoint,
+    DataPoint,
+    Month,
+    Period,
+    Region,
+    ValueType)
 
 FIXTURES_DIR = path.join(path.dirname(__file__), "test_fixtures")
 
@@ -51,3 +70,364 @@ class GetMetDataTests(TestCase):
 
         self.assertEqual(len(returned), expected_number)
         self.assertTrue(expected_sample.issubset(returned))
+
+
+class GetMetDatasetTests(TestCase):
+
+    @responses.activate
+    def test_gets_seasonal_and_annual_aggregates_for_uk_max_temp(self):
+        with open(path.join(FIXTURES_DIR, "uk_max_temp.txt")) as data:
+            responses.add(
+                responses.GET,
+                "https://www.metoffice.gov.uk/pub/data/weather/uk/climate/datasets/Tmax/date/UK.txt",
+                body=data.read(),
+                status=200)
+        expected_number = 108*5-3 # Number of years times number of periods minus periods not recorded.
+        expected_sample = {
+            AggregatePoint(Region.UK, 1910, Period.SPR, ValueType.MAX_TEMP, 11.08),
+            AggregatePoint(Region.UK, 1910, Period.ANN, ValueType.MAX_TEMP, 11.68),
+            AggregatePoint(Region.UK, 1911, Period.WIN, ValueType.MAX_TEMP, 6.79),
+            AggregatePoint(Region.UK, 2017, Period.SUM, ValueType.MAX_TEMP, 18.75)}
+
+        returned = get_met_dataset(Region.UK, ValueType.MAX_TEMP)
+
+        self.assertEqual(len(returned.data_points), 108*12-2)
+        self.assertEqual(len(returned.aggregate_points), expected_number)
+        self.assertTrue(expected_sample.issubset(returned.aggregate_points))
+
+
+class GetAllMetDataTests(TestCase):
+
+    UK_MAX_TEMP_URL = "https://www.metoffice.gov.uk/pub/data/weather/uk/climate/datasets/Tmax/date/UK.txt"
+    SCOTLAND_SUNSHINE_URL = "https://www.metoffice.gov.uk/pub/data/weather/uk/climate/datasets/Sunshine/date/Scotland.txt"
+
+    def setUp(self):
+        with open(path.join(FIXTURES_DIR, "uk_max_temp.txt")) as data:
+            self.uk_max_temp = data.read()
+        with open(path.join(FIXTURES_DIR, "scotland_sunshine.txt")) as data:
+            self.scotland_sunshine = data.read()
+
+    @responses.activate
+    def test_gets_every_dataset(self):
+        responses.add(responses.GET, self.UK_MAX_TEMP_URL, body=self.uk_max_temp)
+        responses.add(
+            responses.GET, self.SCOTLAND_SUNSHINE_URL, body=self.scotland_sunshine)
+        datasets = [
+            (Region.UK, ValueType.MAX_TEMP),
+            (Region.SCOTLAND, ValueType.SUNSHINE)]
+
+        returned = {
+            (region, value_type): data_points
+            for region, value_type, data_points
+            in get_all_met_data(datasets, max_workers=2)}
+
+        self.assertEqual(set(returned), set(datasets))
+        self.assertEqual(
+            returned[(Region.UK, ValueType.MAX_TEMP)].data_points,
+            get_met_data(Region.UK, ValueType.MAX_TEMP))
+
+    @responses.activate
+    @patch("historical_data.data.met_data_getter.sleep")
+    def test_retries_server_errors_with_backoff(self, mock_sleep):
+        responses.add(responses.GET, self.UK_MAX_TEMP_URL, status=503)
+        responses.add(responses.GET, self.UK_MAX_TEMP_URL, status=503)
+        responses.add(responses.GET, self.UK_MAX_TEMP_URL, body=self.uk_max_temp)
+
+        returned = list(get_all_met_data(
+            [(Region.UK, ValueType.MAX_TEMP)], retries=2, backoff=0.5))
+
+        self.assertEqual(len(returned[0][2].data_points), 108*12-2)
+        self.assertEqual(
+            [c[0][0] for c in mock_sleep.call_args_list], [0.5, 1.0])
+
+    @responses.activate
+    @patch("historical_data.data.met_data_getter.sleep")
+    def test_does_not_retry_client_errors(self, mock_sleep):
+        responses.add(responses.GET, self.UK_MAX_TEMP_URL, status=404)
+
+        with self.assertRaises(HTTPError):
+            list(get_all_met_data([(Region.UK, ValueType.MAX_TEMP)]))
+
+        self.assertEqual(len(responses.calls), 1)
+        mock_sleep.assert_not_called()
+
+    @responses.activate
+    @patch("historical_data.data.met_data_getter.sleep")
+    def test_raises_once_retries_exhausted(self, mock_sleep):
+        responses.add(responses.GET, self.UK_MAX_TEMP_URL, status=500)
+
+        with self.assertRaises(HTTPError):
+            list(get_all_met_data(
+                [(Region.UK, ValueType.MAX_TEMP)], retries=2))
+
+        self.assertEqual(len(responses.calls), 3)
+
+
+class ParseDatasetTests(TestCase):
+
+    LINES = [
+        "UK Maximum Temperature",
+        "Blurb mentioning the Year and JAN.",
+        "",
+        "Year    JAN    FEB    MAR     WIN    ANN",
+        "1910    5.4    6.1   10.0     ---  11.68",
+        "1911    6.2    7.0           6.79",
+        ""]
+
+    def test_reads_values_by_header_column_positions_from_any_iterable(self):
+        returned = _parse_dataset(
+            (line for line in self.LINES), Region.UK, ValueType.MAX_TEMP)
+
+        self.assertEqual(returned.data_points, {
+            DataPoint(Region.UK, 1910, Month.JAN, ValueType.MAX_TEMP, 5.4),
+            DataPoint(Region.UK, 1910, Month.FEB, ValueType.MAX_TEMP, 6.1),
+            DataPoint(Region.UK, 1910, Month.MAR, ValueType.MAX_TEMP, 10.0),
+            DataPoint(Region.UK, 1911, Month.JAN, ValueType.MAX_TEMP, 6.2),
+            DataPoint(Region.UK, 1911, Month.FEB, ValueType.MAX_TEMP, 7.0)})
+        self.assertEqual(returned.aggregate_points, {
+            AggregatePoint(Region.UK, 1910, Period.ANN, ValueType.MAX_TEMP, 11.68),
+            AggregatePoint(Region.UK, 1911, Period.WIN, ValueType.MAX_TEMP, 6.79)})
+
+    def test_raises_value_error_if_no_header(self):
+        lines = ["<html><body>Down for maintenance.</body></html>"]
+
+        with self.assertRaisesRegex(ValueError, "UK MAX_TEMP"):
+            _parse_dataset(lines, Region.UK, ValueType.MAX_TEMP)
+
+    def test_raises_value_error_if_no_month_columns(self):
+        lines = ["Year    WIN    ANN", "1910    ---  11.68"]
+
+        with self.assertRaises(ValueError):
+            _parse_dataset(lines, Region.UK, ValueType.MAX_TEMP)
+
+    def test_raises_value_error_if_no_rows_after_header(self):
+        with self.assertRaises(ValueError):
+            _parse_dataset(self.LINES[:4], Region.UK, ValueType.MAX_TEMP)
+
+
+class StreamedDownloadTests(TestCase):
+
+    CONTENT = "Year    JAN\r\n1910    1.0\r\nR\u00e9gion    2.0".encode("utf-8")
+
+    def setUp(self):
+        archive_dir = TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        self.archive = DownloadArchive(archive_dir.name)
+        self.archive_dir = archive_dir.name
+
+    def _get_archived_files(self):
+        return [
+            path.join(date, file_name)
+            for date in listdir(self.archive_dir)
+            for file_name in listdir(path.join(self.archive_dir, date))]
+
+    @responses.activate
+    def test_requests_content_as_a_stream(self):
+        responses.add(
+            responses.GET,
+            "https://www.metoffice.gov.uk/pub/data/weather/uk/climate/datasets/Tmax/date/UK.txt",
+            body=self.CONTENT)
+
+        get_met_data(Region.UK, ValueType.MAX_TEMP)
+
+        self.assertTrue(responses.calls[0].request.req_kwargs["stream"])
+
+    def test_reads_lines_one_chunk_at_a_time(self):
+        read = []
+
+        def _chunks():
+            # Split within a line ending and within a two byte character.
+            for start in range(0, len(self.CONTENT), 5):
+                read.append(start)
+                yield self.CONTENT[start:start + 5]
+
+        with _StreamedDownload(_chunks(), "utf-8", {}) as download:
+            first_line = next(iter(download))
+            self.assertEqual(first_line, "Year    JAN")
+            self.assertEqual(read, [0, 5, 10])
+            self.assertEqual(
+                list(download), ["1910    1.0", "R\u00e9gion    2.0"])
+            self.assertEqual(download.finish(), sha256(self.CONTENT).hexdigest())
+
+    def test_archives_content_once_finished(self):
+        chunks = [self.CONTENT[:7], self.CONTENT[7:]]
+
+        with _StreamedDownload(
+                chunks,
+                "utf-8",
+                {},
+                self.archive.create_file(Region.UK, ValueType.MAX_TEMP)) as download:
+            content_hash = download.finish()
+
+        (archived,) = self._get_archived_files()
+        self.assertTrue(archived.endswith("UK-MAX_TEMP-{}.txt.gz".format(content_hash)))
+        with gzip.open(path.join(self.archive_dir, archived)) as archived_file:
+            self.assertEqual(archived_file.read(), self.CONTENT)
+
+    def test_discards_archive_file_if_download_fails(self):
+        def _chunks():
+            yield self.CONTENT[:7]
+            raise ConnectionError()
+
+        with self.assertRaises(ConnectionError):
+            with _StreamedDownload(
+                    _chunks(),
+                    "utf-8",
+                    {},
+                    self.archive.create_file(Region.UK, ValueType.MAX_TEMP)) as download:
+                download.finish()
+
+        self.assertEqual(self._get_archived_files(), [])
+
+
+class FetchCacheTests(TestCase):
+
+    URL = "https://www.metoffice.gov.uk/pub/data/weather/uk/climate/datasets/Tmax/date/UK.txt"
+    HEADERS = {
+        "ETag": "\"abc\"",
+        "Last-Modified": "Wed, 01 Nov 2017 10:00:00 GMT"}
+
+    def setUp(self):
+        self.cache_dir = TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        with open(path.join(FIXTURES_DIR, "uk_max_temp.txt")) as data:
+            self.uk_max_temp = data.read()
+
+    def _get_with_committed_cache(self):
+        cache = FetchCache(self.cache_dir.name)
+        get_met_data(Region.UK, ValueType.MAX_TEMP, cache=cache)
+        cache.commit()
+        return FetchCache(self.cache_dir.name)
+
+    @responses.activate
+    def test_sends_conditional_headers_once_committed(self):
+        responses.add(
+            responses.GET, self.URL, body=self.uk_max_temp, headers=self.HEADERS)
+        cache = self._get_with_committed_cache()
+
+        get_met_data(Region.UK, ValueType.MAX_TEMP, cache=cache)
+
+        request_headers = responses.calls[-1].request.headers
+        self.assertEqual(request_headers["If-None-Match"], "\"abc\"")
+        self.assertEqual(
+            request_headers["If-Modified-Since"],
+            "Wed, 01 Nov 2017 10:00:00 GMT")
+
+    @responses.activate
+    def test_returns_none_if_not_modified(self):
+        responses.add(
+            responses.GET, self.URL, body=self.uk_max_temp, headers=self.HEADERS)
+        cache = self._get_with_committed_cache()
+        responses.replace(responses.GET, self.URL, status=304)
+
+        returned = get_met_data(Region.UK, ValueType.MAX_TEMP, cache=cache)
+
+        self.assertIsNone(returned)
+
+    @responses.activate
+    def test_returns_none_if_content_unchanged(self):
+        responses.add(responses.GET, self.URL, body=self.uk_max_temp)
+        cache = self._get_with_committed_cache()
+
+        returned = get_met_data(Region.UK, ValueType.MAX_TEMP, cache=cache)
+
+        self.assertIsNone(returned)
+
+    @responses.activate
+    def test_returns_data_if_content_changed(self):
+        responses.add(responses.GET, self.URL, body=self.uk_max_temp)
+        cache = self._get_with_committed_cache()
+        responses.replace(
+            responses.GET, self.URL, body=self.uk_max_temp.replace("5.4", "5.5"))
+
+        returned = get_met_data(Region.UK, ValueType.MAX_TEMP, cache=cache)
+
+        self.assertIn(
+            DataPoint(Region.UK, 1910, Month.JAN, ValueType.MAX_TEMP, 5.5),
+            returned)
+
+    @responses.activate
+    def test_returns_data_if_metadata_not_committed(self):
+        responses.add(responses.GET, self.URL, body=self.uk_max_temp)
+        get_met_data(
+            Region.UK, ValueType.MAX_TEMP, cache=FetchCache(self.cache_dir.name))
+
+        returned = get_met_data(
+            Region.UK, ValueType.MAX_TEMP, cache=FetchCache(self.cache_dir.name))
+
+        self.assertEqual(len(returned), 108*12-2)
+
+    @responses.activate
+    def test_returns_data_unconditionally_if_forced(self):
+        responses.add(
+            responses.GET, self.URL, body=self.uk_max_temp, headers=self.HEADERS)
+        self._get_with_committed_cache()
+        cache = FetchCache(self.cache_dir.name, force=True)
+
+        returned = get_met_data(Region.UK, ValueType.MAX_TEMP, cache=cache)
+
+        self.assertNotIn("If-None-Match", responses.calls[-1].request.headers)
+        self.assertEqual(len(returned), 108*12-2)
+
+
+class DownloadArchiveTests(TestCase):
+
+    URL = "https://www.metoffice.gov.uk/pub/data/weather/uk/climate/datasets/Tmax/date/UK.txt"
+
+    def setUp(self):
+        archive_dir = TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        self.archive_dir = archive_dir.name
+        self.archive = DownloadArchive(archive_dir.name)
+        with open(path.join(FIXTURES_DIR, "uk_max_temp.txt"), "rb") as data:
+            self.uk_max_temp = data.read()
+
+    @responses.activate
+    def test_archives_compressed_download_by_date_and_content(self):
+        responses.add(responses.GET, self.URL, body=self.uk_max_temp)
+
+        get_met_data(Region.UK, ValueType.MAX_TEMP, archive=self.archive)
+        get_met_data(Region.UK, ValueType.MAX_TEMP, archive=self.archive)
+
+        (date,) = listdir(self.archive_dir)
+        (file_name,) = listdir(path.join(self.archive_dir, date))
+        self.assertTrue(file_name.startswith("UK-MAX_TEMP-"))
+        with gzip.open(path.join(self.archive_dir, date, file_name)) as archived:
+            self.assertEqual(archived.read(), self.uk_max_temp)
+
+    @responses.activate
+    def test_replays_archived_download_without_network(self):
+        responses.add(responses.GET, self.URL, body=self.uk_max_temp)
+        downloaded = get_met_dataset(
+            Region.UK, ValueType.MAX_TEMP, archive=self.archive)
+        responses.reset()
+
+        returned = get_archived_met_dataset(
+            Region.UK, ValueType.MAX_TEMP, self.archive)
+
+        self.assertEqual(returned, downloaded)
+        self.assertEqual(len(returned.data_points), 108*12-2)
+
+    def _archive(self, content):
+        archive_file = self.archive.create_file(Region.UK, ValueType.MAX_TEMP)
+        archive_file.write(content)
+        archive_file.commit(sha256(content).hexdigest())
+
+    def test_replays_most_recent_date(self):
+        with patch("historical_data.data.met_data_getter.datetime") as mock_datetime:
+            mock_datetime.now.return_value.date.return_value.isoformat.return_value = \
+                "2017-10-31"
+            self._archive(b"Year    JAN\n1910    1.0\n")
+            mock_datetime.now.return_value.date.return_value.isoformat.return_value = \
+                "2017-11-01"
+            self._archive(b"Year    JAN\n1910    2.0\n")
+
+        returned = get_archived_met_dataset(
+            Region.UK, ValueType.MAX_TEMP, self.archive)
+
+        self.assertEqual(returned.data_points, {
+            DataPoint(Region.UK, 1910, Month.JAN, ValueType.MAX_TEMP, 2.0)})
+
+    def test_returns_none_if_not_archived(self):
+        self.assertIsNone(get_archived_met_dataset(
+            Region.WALES, ValueType.SUNSHINE, self.archive))
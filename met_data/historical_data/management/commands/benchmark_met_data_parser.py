@@ -0,0 +1,85 @@
+from functools import partial
+from os import path
+from tempfile import TemporaryDirectory
+from timeit import repeat
+from tracemalloc import get_traced_memory, start, stop
+
+from django.core.management.base import BaseCommand
+
+from historical_data.data import Region, ValueType
+from historical_data.data.met_data_getter import (
+    DownloadArchive,
+    _CHUNK_SIZE,
+    _StreamedDownload,
+    _parse_dataset,
+    _parse_values)
+
+FIXTURES_DIR = path.join(
+    path.dirname(path.dirname(path.dirname(__file__))), "data", "test_fixtures")
+FIXTURES = [
+    ("uk_max_temp.txt", Region.UK, ValueType.MAX_TEMP),
+    ("scotland_sunshine.txt", Region.SCOTLAND, ValueType.SUNSHINE)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Times parsing of the test fixtures into datapoints, and reports the '
+        'peak memory used while streaming each file through the download '
+        'path, which hashes, archives and parses it a chunk at a time')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--number",
+            type=int,
+            default=20,
+            help="Number of parses per timing.")
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Number of timings, of which the fastest is reported.")
+
+    def handle(self, *args, **options):
+        for file_name, region, value_type in FIXTURES:
+            file_path = path.join(FIXTURES_DIR, file_name)
+            parse = _time(
+                lambda: _parse_file(file_path, region, value_type), options)
+            self.stdout.write(
+                "{:<24} parse: {:7.2f} ms  streaming peak memory: {:6.1f} KiB".format(
+                    file_name,
+                    parse * 1000,
+                    _get_streaming_peak_memory(file_path) / 1024))
+
+
+def _time(function, options):
+    timings = repeat(
+        function,
+        number=options["number"],
+        repeat=options["repeat"])
+    return min(timings) / options["number"]
+
+
+def _parse_file(file_path, region, value_type):
+    with open(file_path) as lines:
+        return _parse_dataset(lines, region, value_type)
+
+
+def _get_streaming_peak_memory(file_path):
+    """The peak memory allocated while downloading values without keeping them.
+
+    The file is read in chunks, as a streamed response is, and each chunk is
+    hashed, archived and parsed.
+    """
+    with TemporaryDirectory() as archive_dir, open(file_path, "rb") as raw_file:
+        archive_file = DownloadArchive(archive_dir).create_file(
+            Region.UK, ValueType.MAX_TEMP)
+        chunks = iter(partial(raw_file.read, _CHUNK_SIZE), b"")
+        start()
+        try:
+            with _StreamedDownload(chunks, "utf-8", {}, archive_file) as download:
+                for _ in _parse_values(download):
+                    pass
+                download.finish()
+            return get_traced_memory()[1]
+        finally:
+            stop()
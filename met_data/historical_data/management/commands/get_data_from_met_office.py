@@ -1,19 +1,166 @@
+from os import path
+
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
 from historical_data.data import (
     Region,
     ValueType,
-    get_met_data,
-    create_or_update_data_point)
+    bump_dataset_version,
+    create_or_update_data_point,
+    get_dataset_version,
+    has_climatology,
+    merge_datasets,
+    refresh_climatology,
+    sync_aggregate_points,
+    write_snapshot)
+from historical_data.data.met_data_getter import (
+    DownloadArchive,
+    FetchCache,
+    get_all_met_data,
+    get_archived_met_dataset)
 
 class Command(BaseCommand):
     help = 'Gets historical meteorological data from the Met Office'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--no-bulk",
+            action="store_true",
+            dest="no_bulk",
+            help=(
+                "Store datapoints one at a time rather than merging them in "
+                "bulk through staging tables."))
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Maximum number of datasets downloaded at once.")
+        parser.add_argument(
+            "--cache-dir",
+            default=settings.MET_DATA_FETCH_CACHE_DIR,
+            help="Directory holding the metadata of previous downloads.")
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Download and store every dataset, even if unchanged.")
+        parser.add_argument(
+            "--archive-dir",
+            default=settings.MET_DATA_ARCHIVE_DIR,
+            help="Directory in which every downloaded file is archived.")
+        parser.add_argument(
+            "--from-archive",
+            action="store_true",
+            dest="from_archive",
+            help=(
+                "Store the most recently archived download of each dataset "
+                "rather than downloading anything."))
+
     def handle(self, *args, **options):
-        for region in Region:
-            for value_type in ValueType:
-                data_points = get_met_data(region, value_type)
-                for data_point in data_points:
-                    create_or_update_data_point(*data_point)
-    
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1.")
+
+        datasets = [
+            (region, value_type)
+            for region in Region
+            for value_type in ValueType]
+        archive = DownloadArchive(options["archive_dir"])
+        if options["from_archive"]:
+            cache = None
+            results = self._get_archived_data(datasets, archive)
+        else:
+            cache = FetchCache(options["cache_dir"], force=options["force"])
+            results = get_all_met_data(
+                datasets,
+                max_workers=options["concurrency"],
+                cache=cache,
+                archive=archive)
+        skipped = 0
+        downloaded = []
+        # Every dataset is parsed before anything is stored, so one that
+        # cannot be parsed, such as an error page, stops the whole run.
+        try:
+            for region, value_type, dataset in results:
+                if dataset is None:
+                    skipped += 1
+                else:
+                    downloaded.append((region, value_type, dataset))
+        except ValueError as error:
+            raise CommandError("Nothing was stored. {}".format(error))
+        version = get_dataset_version()
+        # The climatology is refreshed in the same transaction as the data,
+        # so that it is never cached against a dataset version it is not
+        # derived from. If it is filled without the data changing, such as
+        # on the first run after it was added, the version is bumped so that
+        # responses cached while it was empty are not served.
+        with transaction.atomic():
+            if downloaded and options["no_bulk"]:
+                changed_series = self._store_one_at_a_time(downloaded)
+            elif downloaded:
+                try:
+                    changed_series = self._merge(downloaded, options)
+                except ValueError as error:
+                    raise CommandError("Nothing was stored. {}".format(error))
+            else:
+                changed_series = []
+            if not has_climatology():
+                changed_series = None
+            written = refresh_climatology(changed_series)
+            if written and get_dataset_version() == version:
+                bump_dataset_version()
+        changed = get_dataset_version() != version
+        if changed or not path.exists(settings.MET_DATA_SNAPSHOT_PATH):
+            write_snapshot(settings.MET_DATA_SNAPSHOT_PATH, get_dataset_version())
+        if cache is not None:
+            cache.commit()
+
+        self.stdout.write(
+            "Skipped {} unchanged datasets.".format(skipped))
         self.stdout.write(self.style.SUCCESS('Successfully got Met Office data.'))
+
+    def _get_archived_data(self, datasets, archive):
+        missing = [
+            "{} {}".format(region.name, value_type.name)
+            for region, value_type in datasets
+            if archive.get_latest_path(region, value_type) is None]
+        if missing:
+            raise CommandError(
+                "No archived download of: {}.".format(", ".join(missing)))
+        for region, value_type in datasets:
+            yield region, value_type, get_archived_met_dataset(
+                region, value_type, archive)
+
+    def _merge(self, downloaded, options):
+        """Stores the datasets in a single transaction through staging tables.
+
+        With --verbosity 2 or more, reports the number of datapoints inserted,
+        updated and deleted for each dataset.
+
+        Returns:
+          A list of the (region, value_type) tuples of the series changed.
+        """
+        changed_series = []
+        for region, value_type, data_point_counts, _ in merge_datasets(downloaded):
+            if options["verbosity"] >= 2:
+                self.stdout.write(
+                    "{} {}: {} inserted, {} updated, {} deleted.".format(
+                        region.name, value_type.name, *data_point_counts))
+            if any(data_point_counts):
+                changed_series.append((region, value_type))
+        return changed_series
+
+    def _store_one_at_a_time(self, downloaded):
+        """Stores the datasets one datapoint at a time, in a single transaction.
+
+        Returns:
+          A list of the (region, value_type) tuples of the series stored,
+          all of which are treated as changed.
+        """
+        with transaction.atomic():
+            for region, value_type, dataset in downloaded:
+                for data_point in dataset.data_points:
+                    create_or_update_data_point(*data_point)
+                sync_aggregate_points(region, value_type, dataset.aggregate_points)
+            bump_dataset_version()
+        return [(region, value_type) for region, value_type, _ in downloaded]
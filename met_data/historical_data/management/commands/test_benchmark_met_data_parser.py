@@ -0,0 +1,18 @@
+from django.test import SimpleTestCase
+from django.core.management import call_command
+from django.utils.six import StringIO
+
+
+class BenchmarkMetDataParserTests(SimpleTestCase):
+
+    def test_reports_timings_for_each_fixture(self):
+        out = StringIO()
+
+        call_command(
+            "benchmark_met_data_parser",
+            "--number=1",
+            "--repeat=1",
+            stdout=out)
+
+        self.assertIn("uk_max_temp.txt", out.getvalue())
+        self.assertIn("scotland_sunshine.txt", out.getvalue())
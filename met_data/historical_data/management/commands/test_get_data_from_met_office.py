@@ -1,31 +1,100 @@
+import re
 from unittest.mock import patch, call
 from functools import reduce
+from os import path
+from tempfile import TemporaryDirectory
 
 from django.test import TestCase
-from django.core.management import call_command
+from django.core.management import call_command, CommandError
 from django.utils.six import StringIO
+import responses
 
-from historical_data.data import Month, DataPoint, Region, ValueType
+from historical_data.data import (
+    AggregatePoint,
+    Dataset,
+    Month,
+    Period,
+    DataPoint,
+    Region,
+    ValueType,
+    create_or_update_data_point,
+    get_dataset_version)
+from historical_data.data.models import (
+    HistoricalAggregate,
+    HistoricalClimatology,
+    HistoricalData,
+    month_mapper,
+    region_mapper,
+    value_type_mapper)
 
 
 COMMAND_LOCATION = "historical_data.management.commands.get_data_from_met_office"
 
 
+def _mock_get_met_data(region, value_type):
+    return frozenset({
+        DataPoint(region, 1984, Month.MAY, value_type, 123),
+        DataPoint(region, 1985, Month.JUN, value_type, 456)})
+
+
+def _mock_get_aggregate_data(region, value_type):
+    return frozenset({
+        AggregatePoint(region, 1984, Period.ANN, value_type, 789)})
+
+
+def _mock_get_all_met_data(datasets, **kwargs):
+    for region, value_type in datasets:
+        yield region, value_type, Dataset(
+            _mock_get_met_data(region, value_type),
+            _mock_get_aggregate_data(region, value_type))
+
+
 class GetDataFromMetOfficeTests(TestCase):
 
-    @patch(COMMAND_LOCATION+".create_or_update_data_point")
-    @patch(COMMAND_LOCATION+".get_met_data")
+    def setUp(self):
+        cache_dir = TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+        self.snapshot_path = path.join(cache_dir.name, "series.snapshot")
+        self.archive_dir = path.join(cache_dir.name, "archive")
+        settings_override = self.settings(
+            MET_DATA_FETCH_CACHE_DIR=cache_dir.name,
+            MET_DATA_ARCHIVE_DIR=self.archive_dir,
+            MET_DATA_SNAPSHOT_PATH=self.snapshot_path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    @patch(COMMAND_LOCATION+".get_all_met_data")
     def test_gets_and_persists_all_datapoints(
             self,
-            mock_get_met_data,
-            mock_create_or_update_data_point):
+            mock_get_all_met_data):
+        mock_get_all_met_data.side_effect = _mock_get_all_met_data
+
+        expected = reduce(
+            lambda x, y: x.union(y),
+            {_mock_get_met_data(r, vt) for r in Region for vt in ValueType},
+            set())
 
-        def _mock_get_met_data(region, value_type):
-            return frozenset({
-                DataPoint(region, 1984, Month.MAY, value_type, 123),
-                DataPoint(region, 1985, Month.JUN, value_type, 456)})
+        call_command("get_data_from_met_office", stdout=StringIO())
+
+        persisted = set(HistoricalData.objects.values_list(
+            "region", "year", "month", "value_type", "value"))
+        self.assertEqual(persisted, {
+            (
+                region_mapper[data_point.region],
+                data_point.year,
+                month_mapper[data_point.month],
+                value_type_mapper[data_point.value_type],
+                data_point.value)
+            for data_point in expected})
 
-        mock_get_met_data.side_effect = _mock_get_met_data
+    @patch(COMMAND_LOCATION+".create_or_update_data_point")
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_gets_and_persists_all_datapoints_one_at_a_time_if_no_bulk(
+            self,
+            mock_get_all_met_data,
+            mock_create_or_update_data_point):
+        mock_get_all_met_data.side_effect = _mock_get_all_met_data
 
         expected_calls = map(
             lambda x: call(*x),
@@ -34,23 +103,301 @@ class GetDataFromMetOfficeTests(TestCase):
                 {_mock_get_met_data(r, vt) for r in Region for vt in ValueType},
                 set()))
 
-        call_command("get_data_from_met_office", stdout=StringIO())
+        call_command("get_data_from_met_office", "--no-bulk", stdout=StringIO())
 
         mock_create_or_update_data_point.assert_has_calls(
             expected_calls,
             any_order=True)
 
-    @patch(COMMAND_LOCATION+".create_or_update_data_point")
-    @patch(COMMAND_LOCATION+".get_met_data")
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_passes_concurrency_to_fetcher(
+            self,
+            mock_get_all_met_data):
+        mock_get_all_met_data.side_effect = _mock_get_all_met_data
+
+        call_command(
+            "get_data_from_met_office", "--concurrency=7", stdout=StringIO())
+
+        self.assertEqual(mock_get_all_met_data.call_args[1]["max_workers"], 7)
+
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_archives_downloads(self, mock_get_all_met_data):
+        mock_get_all_met_data.return_value = []
+
+        call_command("get_data_from_met_office", stdout=StringIO())
+
+        archive = mock_get_all_met_data.call_args[1]["archive"]
+        self.assertEqual(archive._directory, self.archive_dir)
+
+    @patch(COMMAND_LOCATION+".get_archived_met_dataset")
+    @patch(COMMAND_LOCATION+".DownloadArchive.get_latest_path")
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_stores_archived_datasets_without_downloading_if_from_archive(
+            self,
+            mock_get_all_met_data,
+            mock_get_latest_path,
+            mock_get_archived_met_dataset):
+        mock_get_latest_path.return_value = "archived.txt.gz"
+        mock_get_archived_met_dataset.side_effect = \
+            lambda region, value_type, archive: Dataset(
+                _mock_get_met_data(region, value_type),
+                _mock_get_aggregate_data(region, value_type))
+
+        call_command("get_data_from_met_office", "--from-archive", stdout=StringIO())
+
+        mock_get_all_met_data.assert_not_called()
+        self.assertEqual(
+            mock_get_archived_met_dataset.call_count, len(Region) * len(ValueType))
+        self.assertEqual(
+            HistoricalData.objects.count(), 2 * len(Region) * len(ValueType))
+        self.assertEqual(get_dataset_version(), 1)
+
+    def test_raises_command_error_if_from_archive_and_dataset_not_archived(self):
+        with self.assertRaises(CommandError):
+            call_command(
+                "get_data_from_met_office", "--from-archive", stdout=StringIO())
+
+        self.assertEqual(get_dataset_version(), 0)
+
+    def test_raises_command_error_if_concurrency_less_than_one(self):
+        with self.assertRaises(CommandError):
+            call_command(
+                "get_data_from_met_office", "--concurrency=0", stdout=StringIO())
+
+    @patch(COMMAND_LOCATION+".get_all_met_data")
     def test_prints_success_message(
             self,
-            mock_get_met_data,
-            mock_create_or_update_data_point):
+            mock_get_all_met_data):
         out = StringIO()
-        mock_get_met_data.return_value = \
-                {DataPoint(Region.UK, 1984, Month.MAY, ValueType.MAX_TEMP, 123)}
+        mock_get_all_met_data.side_effect = _mock_get_all_met_data
 
         call_command("get_data_from_met_office", stdout=out)
 
         self.assertIn("Successfully got Met Office data.", out.getvalue())
 
+    @patch(COMMAND_LOCATION+".merge_datasets")
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_skips_and_reports_unchanged_datasets(
+            self,
+            mock_get_all_met_data,
+            mock_merge_datasets):
+        out = StringIO()
+        mock_get_all_met_data.return_value = [
+            (Region.UK, ValueType.MAX_TEMP, None),
+            (Region.UK, ValueType.MIN_TEMP, None),
+            (Region.UK, ValueType.RAINFALL, Dataset(
+                _mock_get_met_data(Region.UK, ValueType.RAINFALL),
+                _mock_get_aggregate_data(Region.UK, ValueType.RAINFALL)))]
+
+        call_command("get_data_from_met_office", stdout=out)
+
+        (merged,), _ = mock_merge_datasets.call_args
+        self.assertEqual(
+            [(region, value_type) for region, value_type, _ in merged],
+            [(Region.UK, ValueType.RAINFALL)])
+        self.assertIn("Skipped 2 unchanged datasets.", out.getvalue())
+
+    @patch(COMMAND_LOCATION+".merge_datasets")
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_merges_and_reports_counts_for_each_dataset_if_verbose(
+            self,
+            mock_get_all_met_data,
+            mock_merge_datasets):
+        out = StringIO()
+        dataset = Dataset(
+            _mock_get_met_data(Region.WALES, ValueType.SUNSHINE), set())
+        mock_get_all_met_data.return_value = [
+            (Region.WALES, ValueType.SUNSHINE, dataset)]
+        mock_merge_datasets.return_value = [
+            (Region.WALES, ValueType.SUNSHINE, (1, 2, 3), (0, 0, 0))]
+
+        call_command("get_data_from_met_office", verbosity=2, stdout=out)
+
+        mock_merge_datasets.assert_called_once_with(
+            [(Region.WALES, ValueType.SUNSHINE, dataset)])
+        self.assertIn(
+            "WALES SUNSHINE: 1 inserted, 2 updated, 3 deleted.", out.getvalue())
+
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_bumps_dataset_version_if_data_stored(
+            self,
+            mock_get_all_met_data):
+        mock_get_all_met_data.side_effect = _mock_get_all_met_data
+
+        call_command("get_data_from_met_office", stdout=StringIO())
+
+        self.assertEqual(get_dataset_version(), 1)
+
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_does_not_bump_dataset_version_if_all_datasets_unchanged(
+            self,
+            mock_get_all_met_data):
+        mock_get_all_met_data.return_value = [
+            (Region.UK, ValueType.MAX_TEMP, None)]
+
+        call_command("get_data_from_met_office", stdout=StringIO())
+
+        self.assertEqual(get_dataset_version(), 0)
+
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_does_not_bump_dataset_version_if_stored_data_unchanged(
+            self,
+            mock_get_all_met_data):
+        out = StringIO()
+        mock_get_all_met_data.side_effect = _mock_get_all_met_data
+
+        call_command("get_data_from_met_office", stdout=StringIO())
+        call_command("get_data_from_met_office", verbosity=2, stdout=out)
+
+        self.assertEqual(get_dataset_version(), 1)
+        self.assertIn("UK MAX_TEMP: 0 inserted, 0 updated, 0 deleted.", out.getvalue())
+
+    @patch(COMMAND_LOCATION+".write_snapshot")
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_writes_snapshot_for_new_dataset_version_if_data_stored(
+            self,
+            mock_get_all_met_data,
+            mock_write_snapshot):
+        mock_get_all_met_data.side_effect = _mock_get_all_met_data
+
+        call_command("get_data_from_met_office", stdout=StringIO())
+
+        mock_write_snapshot.assert_called_once_with(self.snapshot_path, 1)
+
+    @patch(COMMAND_LOCATION+".write_snapshot")
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_writes_snapshot_only_if_missing_when_all_datasets_unchanged(
+            self,
+            mock_get_all_met_data,
+            mock_write_snapshot):
+        mock_get_all_met_data.return_value = [
+            (Region.UK, ValueType.MAX_TEMP, None)]
+
+        call_command("get_data_from_met_office", stdout=StringIO())
+        open(self.snapshot_path, "wb").close()
+        call_command("get_data_from_met_office", stdout=StringIO())
+
+        mock_write_snapshot.assert_called_once_with(self.snapshot_path, 0)
+
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_fills_climatology_for_every_series(self, mock_get_all_met_data):
+        mock_get_all_met_data.side_effect = _mock_get_all_met_data
+
+        call_command("get_data_from_met_office", stdout=StringIO())
+
+        self.assertEqual(
+            set(HistoricalClimatology.objects.values_list(
+                "region", "value_type", "month", "maximum", "maximum_year")),
+            {
+                (region_mapper[r], value_type_mapper[vt], month, value, year)
+                for r in Region
+                for vt in ValueType
+                for month, value, year in [(5, 123, 1984), (6, 456, 1985)]})
+
+    @patch(COMMAND_LOCATION+".refresh_climatology")
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_refreshes_climatology_only_for_changed_series(
+            self,
+            mock_get_all_met_data,
+            mock_refresh_climatology):
+        mock_get_all_met_data.side_effect = _mock_get_all_met_data
+        call_command("get_data_from_met_office", stdout=StringIO())
+        HistoricalClimatology.objects.create(
+            region="uk", value_type="max_temp", month=5, count=1, mean=123,
+            std=0, minimum=123, minimum_year=1984, maximum=123,
+            maximum_year=1984, percentile_10=123, percentile_25=123,
+            median=123, percentile_75=123, percentile_90=123)
+        changed = Dataset(
+            _mock_get_met_data(Region.UK, ValueType.RAINFALL)
+            | {DataPoint(Region.UK, 1986, Month.JUL, ValueType.RAINFALL, 1)},
+            _mock_get_aggregate_data(Region.UK, ValueType.RAINFALL))
+        mock_get_all_met_data.side_effect = None
+        mock_get_all_met_data.return_value = [
+            (Region.UK, ValueType.RAINFALL, changed),
+            (Region.UK, ValueType.SUNSHINE, Dataset(
+                _mock_get_met_data(Region.UK, ValueType.SUNSHINE),
+                _mock_get_aggregate_data(Region.UK, ValueType.SUNSHINE))),
+            (Region.UK, ValueType.MAX_TEMP, None)]
+
+        call_command("get_data_from_met_office", stdout=StringIO())
+
+        self.assertEqual(mock_refresh_climatology.call_args_list, [
+            call(None), call([(Region.UK, ValueType.RAINFALL)])])
+
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_fills_empty_climatology_and_bumps_version_if_nothing_downloaded(
+            self,
+            mock_get_all_met_data):
+        create_or_update_data_point(Region.UK, 1990, Month.JUL, ValueType.MAX_TEMP, 20.0)
+        mock_get_all_met_data.return_value = [(Region.UK, ValueType.MAX_TEMP, None)]
+
+        call_command("get_data_from_met_office", stdout=StringIO())
+        call_command("get_data_from_met_office", stdout=StringIO())
+
+        self.assertEqual(
+            list(HistoricalClimatology.objects.values_list("region", "month", "mean")),
+            [("uk", 7, 20.0)])
+        self.assertEqual(get_dataset_version(), 1)
+
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_does_not_bump_version_if_nothing_stored_or_downloaded(
+            self,
+            mock_get_all_met_data):
+        mock_get_all_met_data.return_value = [(Region.UK, ValueType.MAX_TEMP, None)]
+
+        call_command("get_data_from_met_office", stdout=StringIO())
+
+        self.assertFalse(HistoricalClimatology.objects.exists())
+        self.assertEqual(get_dataset_version(), 0)
+
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_stores_nothing_if_a_dataset_would_lose_most_datapoints(
+            self,
+            mock_get_all_met_data):
+        mock_get_all_met_data.side_effect = _mock_get_all_met_data
+        call_command("get_data_from_met_office", stdout=StringIO())
+        mock_get_all_met_data.side_effect = None
+        mock_get_all_met_data.return_value = [
+            (Region.UK, ValueType.MAX_TEMP, Dataset(
+                {DataPoint(Region.UK, 1984, Month.MAY, ValueType.MAX_TEMP, 123)},
+                _mock_get_aggregate_data(Region.UK, ValueType.MAX_TEMP)))]
+
+        with self.assertRaisesRegex(CommandError, "Nothing was stored"):
+            call_command("get_data_from_met_office", stdout=StringIO())
+
+        self.assertEqual(
+            HistoricalData.objects.filter(region="uk", value_type="max_temp").count(),
+            2)
+        self.assertEqual(get_dataset_version(), 1)
+
+    @responses.activate
+    @patch(COMMAND_LOCATION+".write_snapshot")
+    def test_stores_nothing_if_a_dataset_cannot_be_parsed(self, mock_write_snapshot):
+        create_or_update_data_point(Region.UK, 1990, Month.JUL, ValueType.MAX_TEMP, 20.0)
+        responses.add(
+            responses.GET,
+            re.compile(r"https://www\.metoffice\.gov\.uk/.*"),
+            body="<html><body>Down for maintenance.</body></html>")
+
+        with self.assertRaisesRegex(CommandError, "Nothing was stored"):
+            call_command("get_data_from_met_office", stdout=StringIO())
+
+        self.assertEqual(HistoricalData.objects.count(), 1)
+        self.assertEqual(get_dataset_version(), 0)
+        self.assertFalse(path.exists(path.join(self.cache_dir, "metadata.json")))
+        mock_write_snapshot.assert_not_called()
+
+    @patch(COMMAND_LOCATION+".get_all_met_data")
+    def test_persists_aggregates(
+            self,
+            mock_get_all_met_data):
+        mock_get_all_met_data.side_effect = _mock_get_all_met_data
+
+        call_command("get_data_from_met_office", stdout=StringIO())
+
+        self.assertEqual(
+            set(HistoricalAggregate.objects.values_list(
+                "region", "value_type", "year", "period", "value")),
+            {
+                (region_mapper[r], value_type_mapper[vt], 1984, 5, 789)
+                for r in Region for vt in ValueType})
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:18
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoricalData',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('region', models.CharField(max_length=20, validators=[django.core.validators.MinLengthValidator(1)])),
+                ('value_type', models.CharField(max_length=20, validators=[django.core.validators.MinLengthValidator(1)])),
+                ('value', models.FloatField()),
+            ],
+        ),
+    ]
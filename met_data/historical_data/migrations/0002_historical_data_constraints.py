@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('historical_data', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historicaldata',
+            index=models.Index(fields=['value_type', 'region', 'year', 'month', 'value'], name='historical_time_series_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='historicaldata',
+            constraint=models.UniqueConstraint(fields=('value_type', 'region', 'year', 'month'), name='unique_historical_data_point'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:28
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('historical_data', '0003_dataset_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoricalAggregate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('period', models.PositiveSmallIntegerField()),
+                ('region', models.CharField(max_length=20, validators=[django.core.validators.MinLengthValidator(1)])),
+                ('value_type', models.CharField(max_length=20, validators=[django.core.validators.MinLengthValidator(1)])),
+                ('value', models.FloatField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='historicalaggregate',
+            index=models.Index(fields=['value_type', 'period', 'region', 'year', 'value'], name='historical_aggregate_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='historicalaggregate',
+            constraint=models.UniqueConstraint(fields=('value_type', 'period', 'region', 'year'), name='unique_historical_aggregate'),
+        ),
+    ]
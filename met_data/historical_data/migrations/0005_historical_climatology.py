@@ -0,0 +1,39 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:46
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('historical_data', '0004_historical_aggregate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoricalClimatology',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(max_length=20, validators=[django.core.validators.MinLengthValidator(1)])),
+                ('value_type', models.CharField(max_length=20, validators=[django.core.validators.MinLengthValidator(1)])),
+                ('month', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveSmallIntegerField()),
+                ('mean', models.FloatField()),
+                ('std', models.FloatField()),
+                ('minimum', models.FloatField()),
+                ('minimum_year', models.PositiveSmallIntegerField()),
+                ('maximum', models.FloatField()),
+                ('maximum_year', models.PositiveSmallIntegerField()),
+                ('percentile_10', models.FloatField()),
+                ('percentile_25', models.FloatField()),
+                ('median', models.FloatField()),
+                ('percentile_75', models.FloatField()),
+                ('percentile_90', models.FloatField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='historicalclimatology',
+            constraint=models.UniqueConstraint(fields=('value_type', 'region', 'month'), name='unique_historical_climatology'),
+        ),
+    ]
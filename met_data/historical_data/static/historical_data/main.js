@@ -29,11 +29,51 @@
 	function getDataFromServer(value_type, regions){
 	    $.ajax({
 		url: "http://localhost:8000/time-series/"+value_type+"/"+regions,
-		success: plotData,
+		data: {format: "v2", max_points: maxPoints},
+		success: (data) => plotData(decodeCompactData(data)),
 		dataType: "json"
 	    });
 	}
 
+	// Longer series are downsampled on the server to keep plotting fast.
+	var maxPoints = 512;
+
+	var monthLabels = [
+	    "JAN", "FEB", "MAR", "APR", "MAY", "JUN",
+	    "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"];
+
+	/**Converts the compact (v2) time series format in to labels and arrays of values.*/
+	function decodeCompactData(data){
+	    var offsets = data.offsets || [...Array(data.count).keys()];
+	    var labels = offsets.map((i) => {
+		var offset = data.start.year * 12 + data.start.month - 1 + i;
+		return Math.floor(offset / 12) + "-" + monthLabels[offset % 12];
+	    });
+	    return {
+		value_type: data.value_type,
+		labels: labels,
+		series: data.series.map((s) => {
+		    return {name: s.name, data: decodeFloat32(s.data, offsets.length)};
+		})
+	    };
+	}
+
+	function decodeFloat32(base64, count){
+	    var binary = atob(base64);
+	    var bytes = new Uint8Array(binary.length);
+	    for (var i = 0; i < binary.length; i++) {
+		bytes[i] = binary.charCodeAt(i);
+	    }
+	    var view = new DataView(bytes.buffer);
+	    var values = [];
+	    for (var j = 0; j < count; j++) {
+		var value = view.getFloat32(j * 4, true);
+		// Trim float32 noise, e.g. 5.400000095 back to 5.4.
+		values.push(isNaN(value) ? null : parseFloat(value.toPrecision(7)));
+	    }
+	    return values;
+	}
+
 	function createDisplayData(data){
 	    return data.series.map((s) => {
 		return {
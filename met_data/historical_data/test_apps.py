@@ -0,0 +1,31 @@
+from os import path
+from sqlite3 import connect
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, Mock
+
+from django.test import SimpleTestCase
+
+from historical_data.apps import configure_sqlite_connection
+
+
+class ConfigureSqliteConnectionTest(SimpleTestCase):
+
+    def test_puts_sqlite_database_into_wal_mode(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        database = connect(path.join(directory.name, "test.sqlite3"))
+        self.addCleanup(database.close)
+        wrapper = MagicMock(vendor="sqlite")
+        wrapper.cursor.return_value.__enter__.return_value = database.cursor()
+
+        configure_sqlite_connection(None, wrapper)
+
+        self.assertEqual(
+            database.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_ignores_other_databases(self):
+        wrapper = Mock(vendor="postgresql")
+
+        configure_sqlite_connection(None, wrapper)
+
+        wrapper.cursor.assert_not_called()
@@ -0,0 +1,46 @@
+import json
+import subprocess
+import sys
+from os import path
+
+from django.test import SimpleTestCase
+
+PROJECT_DIRECTORY = path.dirname(path.dirname(path.abspath(__file__)))
+
+# Starts the web application as gunicorn does, then reports how long that took
+# and which modules were imported.
+WEB_STARTUP_SCRIPT = """
+import json
+import os
+import sys
+import time
+
+started = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "met_data.settings")
+from met_data.wsgi import application
+from django.urls import get_resolver
+get_resolver().url_patterns
+json.dump(
+    {"seconds": time.perf_counter() - started, "modules": sorted(sys.modules)},
+    sys.stdout)
+"""
+
+
+class WebImportsTest(SimpleTestCase):
+
+    def _start_web_application(self):
+        output = subprocess.check_output(
+            [sys.executable, "-c", WEB_STARTUP_SCRIPT],
+            cwd=PROJECT_DIRECTORY)
+        return json.loads(output.decode())
+
+    def test_web_application_does_not_import_fetching_or_parsing_libraries(self):
+        startup = self._start_web_application()
+
+        for library in ["pandas", "requests"]:
+            self.assertNotIn(
+                library,
+                startup["modules"],
+                "{} imported during web startup, which took {:.2f} s and "
+                "imported {} modules.".format(
+                    library, startup["seconds"], len(startup["modules"])))
@@ -1,11 +1,21 @@
+import json
+from gzip import decompress
 from unittest.mock import patch
+from django.core.cache import caches
 from django.test import TestCase, Client
-from historical_data.data import ValueType, Region
+from historical_data.data import (
+    create_or_update_data_point,
+    ValueType,
+    Region,
+    Month,
+    Period,
+    bump_dataset_version)
 
 class TimeSeriesViewTest(TestCase):
 
     def setUp(self):
         self.client = Client()
+        caches["time_series"].clear()
 
     @patch("historical_data.views.get_time_series")
     def test_success(self, mock_get_time_series):
@@ -19,7 +29,9 @@ class TimeSeriesViewTest(TestCase):
         mock_get_time_series.return_value = {"key": 123}
         response = self.client.get("/time-series/maxtemp/scotland-england")
 
-        mock_get_time_series.assert_called_with(ValueType.MAX_TEMP, {Region.SCOTLAND, Region.ENGLAND})
+        mock_get_time_series.assert_called_with(
+            ValueType.MAX_TEMP, [Region.ENGLAND, Region.SCOTLAND],
+            max_points=None, start=None, end=None)
 
     @patch("historical_data.views.get_time_series")
     def test_returns_json_response(self, mock_get_time_series):
@@ -41,3 +53,427 @@ class TimeSeriesViewTest(TestCase):
         response = self.client.get("/time-series/tempmax/scotnd-england")
 
         self.assertEqual(response.status_code, 404)
+
+    @patch("historical_data.views.get_time_series")
+    def test_caches_response(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        self.client.get("/time-series/maxtemp/scotland-england")
+        response = self.client.get("/time-series/maxtemp/scotland-england")
+
+        self.assertEqual(mock_get_time_series.call_count, 1)
+        self.assertEqual(response.content, b"{\"key\": 123}")
+
+    @patch("historical_data.views.get_time_series")
+    def test_shares_cached_response_between_orders_of_regions(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        self.client.get("/time-series/maxtemp/scotland-england")
+        self.client.get("/time-series/maxtemp/england-scotland")
+
+        self.assertEqual(mock_get_time_series.call_count, 1)
+
+    @patch("historical_data.views.get_time_series")
+    def test_does_not_share_cached_response_between_value_types(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        self.client.get("/time-series/maxtemp/scotland-england")
+        self.client.get("/time-series/mintemp/scotland-england")
+
+        self.assertEqual(mock_get_time_series.call_count, 2)
+
+    @patch("historical_data.views.get_time_series")
+    def test_recomputes_response_once_dataset_version_changes(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        self.client.get("/time-series/maxtemp/scotland-england")
+        bump_dataset_version()
+        mock_get_time_series.return_value = {"key": 456}
+        response = self.client.get("/time-series/maxtemp/scotland-england")
+
+        self.assertEqual(mock_get_time_series.call_count, 2)
+        self.assertEqual(response.content, b"{\"key\": 456}")
+
+    @patch("historical_data.views.get_time_series")
+    def test_returns_etag(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        response = self.client.get("/time-series/maxtemp/scotland-england")
+
+        self.assertTrue(response["ETag"].startswith("\""))
+
+    @patch("historical_data.views.get_time_series")
+    def test_returns_304_if_etag_matches(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        etag = self.client.get("/time-series/maxtemp/scotland-england")["ETag"]
+
+        response = self.client.get(
+            "/time-series/maxtemp/england-scotland", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+    @patch("historical_data.views.get_time_series")
+    def test_returns_200_if_etag_matches_old_dataset_version(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        etag = self.client.get("/time-series/maxtemp/scotland-england")["ETag"]
+        bump_dataset_version()
+
+        response = self.client.get(
+            "/time-series/maxtemp/scotland-england", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    @patch("historical_data.views.get_time_series")
+    def test_returns_gzipped_response_if_accepted(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        plain = self.client.get("/time-series/maxtemp/scotland-england")
+        response = self.client.get(
+            "/time-series/maxtemp/scotland-england",
+            HTTP_ACCEPT_ENCODING="gzip, deflate")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertNotEqual(response["ETag"], plain["ETag"])
+        self.assertEqual(decompress(response.content), b"{\"key\": 123}")
+        self.assertEqual(mock_get_time_series.call_count, 1)
+
+    @patch("historical_data.views.get_compact_time_series")
+    @patch("historical_data.views.get_time_series")
+    def test_returns_compact_format_if_requested_by_query_parameter(
+            self,
+            mock_get_time_series,
+            mock_get_compact_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        mock_get_compact_time_series.return_value = {"format": 2}
+        response = self.client.get("/time-series/maxtemp/scotland-england?format=v2")
+
+        mock_get_compact_time_series.assert_called_with(
+            ValueType.MAX_TEMP, [Region.ENGLAND, Region.SCOTLAND],
+            max_points=None, start=None, end=None)
+        self.assertEqual(response.content, b"{\"format\": 2}")
+
+    @patch("historical_data.views.get_compact_time_series")
+    @patch("historical_data.views.get_time_series")
+    def test_returns_compact_format_if_requested_by_accept_header(
+            self,
+            mock_get_time_series,
+            mock_get_compact_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        mock_get_compact_time_series.return_value = {"format": 2}
+        self.client.get("/time-series/maxtemp/scotland-england")
+        response = self.client.get(
+            "/time-series/maxtemp/scotland-england",
+            HTTP_ACCEPT="application/vnd.met-data.v2+json")
+
+        self.assertEqual(response.content, b"{\"format\": 2}")
+        self.assertIn("Accept", response["Vary"])
+
+    @patch("historical_data.views.get_time_series")
+    def test_passes_max_points_rounded_down_to_power_of_two(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        self.client.get("/time-series/maxtemp/scotland-england?max_points=600")
+
+        mock_get_time_series.assert_called_with(
+            ValueType.MAX_TEMP, [Region.ENGLAND, Region.SCOTLAND],
+            max_points=512, start=None, end=None)
+
+    @patch("historical_data.views.get_time_series")
+    def test_caches_downsampled_response_per_max_points_bucket(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        self.client.get("/time-series/maxtemp/scotland-england?max_points=600")
+        self.client.get("/time-series/maxtemp/scotland-england?max_points=700")
+        self.client.get("/time-series/maxtemp/scotland-england?max_points=1100")
+        self.client.get("/time-series/maxtemp/scotland-england")
+
+        self.assertEqual(mock_get_time_series.call_count, 3)
+
+    @patch("historical_data.views.get_time_series")
+    def test_returns_400_if_max_points_invalid(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        for max_points in ["abc", "2", "-5"]:
+            response = self.client.get(
+                "/time-series/maxtemp/scotland-england?max_points=" + max_points)
+
+            self.assertEqual(response.status_code, 400)
+
+    @patch("historical_data.views.get_time_series")
+    def test_passes_start_and_end(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        self.client.get(
+            "/time-series/maxtemp/scotland-england?start=1990-01&end=2000-12")
+
+        mock_get_time_series.assert_called_with(
+            ValueType.MAX_TEMP, [Region.ENGLAND, Region.SCOTLAND],
+            max_points=None, start=(1990, Month.JAN), end=(2000, Month.DEC))
+
+    @patch("historical_data.views.get_time_series")
+    def test_caches_response_per_date_range(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        self.client.get("/time-series/maxtemp/scotland-england?start=1990-01")
+        self.client.get("/time-series/maxtemp/scotland-england?start=1990-02")
+        self.client.get("/time-series/maxtemp/scotland-england?end=1990-02")
+        self.client.get("/time-series/maxtemp/scotland-england?start=1990-01")
+
+        self.assertEqual(mock_get_time_series.call_count, 3)
+
+    @patch("historical_data.views.get_time_series")
+    def test_returns_400_if_start_or_end_invalid(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        for query in ["start=1990", "end=1990-13", "start=abc", "start=2000-01&end=1999-12"]:
+            response = self.client.get(
+                "/time-series/maxtemp/scotland-england?" + query)
+
+            self.assertEqual(response.status_code, 400)
+
+
+class BatchTimeSeriesViewTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        caches["time_series"].clear()
+
+    @patch("historical_data.views.get_batch_time_series")
+    def test_calls_get_batch_time_series_with_sorted_value_types(
+            self, mock_get_batch_time_series):
+        mock_get_batch_time_series.return_value = {"key": 123}
+        response = self.client.get(
+            "/time-series/meantemp,maxtemp,mintemp/uk-england?start=1990-01")
+
+        mock_get_batch_time_series.assert_called_with(
+            [ValueType.MAX_TEMP, ValueType.MIN_TEMP, ValueType.MEAN_TEMP],
+            [Region.UK, Region.ENGLAND],
+            max_points=None, start=(1990, Month.JAN), end=None)
+        self.assertEqual(response.content, b"{\"key\": 123}")
+
+    @patch("historical_data.views.get_batch_time_series")
+    def test_shares_cached_response_between_orders_of_value_types(
+            self, mock_get_batch_time_series):
+        mock_get_batch_time_series.return_value = {"key": 123}
+        self.client.get("/time-series/maxtemp,mintemp/uk")
+        self.client.get("/time-series/mintemp,maxtemp/uk")
+
+        self.assertEqual(mock_get_batch_time_series.call_count, 1)
+
+    @patch("historical_data.views.get_time_series")
+    def test_uses_single_time_series_for_repeated_value_type(self, mock_get_time_series):
+        mock_get_time_series.return_value = {"key": 123}
+        self.client.get("/time-series/maxtemp,maxtemp/uk")
+
+        mock_get_time_series.assert_called_with(
+            ValueType.MAX_TEMP, [Region.UK],
+            max_points=None, start=None, end=None)
+
+    @patch("historical_data.views.get_batch_time_series")
+    def test_returns_404_if_any_value_type_misformed(self, mock_get_batch_time_series):
+        response = self.client.get("/time-series/maxtemp,hottemp/uk")
+
+        self.assertEqual(response.status_code, 404)
+
+    @patch("historical_data.views.get_batch_time_series")
+    def test_returns_400_if_compact_format_requested(self, mock_get_batch_time_series):
+        response = self.client.get("/time-series/maxtemp,mintemp/uk?format=v2")
+
+        self.assertEqual(response.status_code, 400)
+
+
+class AggregatesViewTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        caches["time_series"].clear()
+
+    @patch("historical_data.views.get_aggregate_series")
+    def test_calls_get_aggregate_series_with_correct_arguments(self, mock_get_aggregate_series):
+        mock_get_aggregate_series.return_value = {"key": 123}
+        response = self.client.get("/aggregates/ann/maxtemp/wales-uk")
+
+        mock_get_aggregate_series.assert_called_with(
+            ValueType.MAX_TEMP, Period.ANN, [Region.UK, Region.WALES])
+        self.assertEqual(response.content, b"{\"key\": 123}")
+
+    @patch("historical_data.views.get_aggregate_series")
+    def test_caches_response(self, mock_get_aggregate_series):
+        mock_get_aggregate_series.return_value = {"key": 123}
+        self.client.get("/aggregates/win/rainfall/wales-uk")
+        self.client.get("/aggregates/win/rainfall/uk-wales")
+        self.client.get("/aggregates/spr/rainfall/uk-wales")
+
+        self.assertEqual(mock_get_aggregate_series.call_count, 2)
+
+    @patch("historical_data.views.get_aggregate_series")
+    def test_returns_404_if_period_misformed(self, mock_get_aggregate_series):
+        mock_get_aggregate_series.return_value = {"key": 123}
+        response = self.client.get("/aggregates/year/maxtemp/wales-uk")
+
+        self.assertEqual(response.status_code, 404)
+
+
+class AnalyticsViewTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        caches["time_series"].clear()
+
+    @patch("historical_data.views.get_rolling_means_and_anomalies")
+    def test_calls_with_default_windows(self, mock_get_rolling_means_and_anomalies):
+        mock_get_rolling_means_and_anomalies.return_value = {"key": 123}
+        response = self.client.get("/analytics/meantemp/wales-uk")
+
+        mock_get_rolling_means_and_anomalies.assert_called_with(
+            ValueType.MEAN_TEMP, [Region.UK, Region.WALES], (12, 60, 360))
+        self.assertEqual(response.content, b"{\"key\": 123}")
+
+    @patch("historical_data.views.get_rolling_means_and_anomalies")
+    def test_passes_windows_and_caches_per_windows(self, mock_get_rolling_means_and_anomalies):
+        mock_get_rolling_means_and_anomalies.return_value = {"key": 123}
+        self.client.get("/analytics/meantemp/uk?windows=24,12,24")
+        self.client.get("/analytics/meantemp/uk?windows=12,24")
+        self.client.get("/analytics/meantemp/uk?windows=12")
+
+        mock_get_rolling_means_and_anomalies.assert_any_call(
+            ValueType.MEAN_TEMP, [Region.UK], (12, 24))
+        self.assertEqual(mock_get_rolling_means_and_anomalies.call_count, 2)
+
+    @patch("historical_data.views.get_rolling_means_and_anomalies")
+    def test_returns_400_if_windows_invalid(self, mock_get_rolling_means_and_anomalies):
+        for query in [
+                "windows=",
+                "windows=twelve",
+                "windows=0",
+                "windows=12,5000",
+                "windows=1,2,3,4,5",
+                "windows=" + ",".join(str(window) for window in range(1, 1201))]:
+            response = self.client.get("/analytics/meantemp/uk?" + query)
+
+            self.assertEqual(response.status_code, 400)
+        mock_get_rolling_means_and_anomalies.assert_not_called()
+
+    @patch("historical_data.views.get_rolling_means_and_anomalies")
+    def test_accepts_repeated_windows_up_to_limit(self, mock_get_rolling_means_and_anomalies):
+        mock_get_rolling_means_and_anomalies.return_value = {"key": 123}
+        response = self.client.get("/analytics/meantemp/uk?windows=1,2,3,4,4,1")
+
+        self.assertEqual(response.status_code, 200)
+        mock_get_rolling_means_and_anomalies.assert_called_with(
+            ValueType.MEAN_TEMP, [Region.UK], (1, 2, 3, 4))
+
+
+class StatsViewTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        caches["time_series"].clear()
+
+    @patch("historical_data.views.get_region_statistics")
+    def test_calls_get_region_statistics_and_caches_result(self, mock_get_region_statistics):
+        mock_get_region_statistics.return_value = {"key": 123}
+        response = self.client.get("/stats/meantemp/wales-uk?start=1990-01")
+        self.client.get("/stats/meantemp/wales-uk?start=1990-01")
+
+        mock_get_region_statistics.assert_called_once_with(
+            ValueType.MEAN_TEMP,
+            [Region.UK, Region.WALES],
+            start=(1990, Month.JAN),
+            end=None)
+        self.assertEqual(response.content, b"{\"key\": 123}")
+        self.assertIn("ETag", response)
+
+    @patch("historical_data.views.get_region_statistics")
+    def test_returns_400_if_range_invalid(self, mock_get_region_statistics):
+        for query in ["start=1990", "start=1991-01&end=1990-12"]:
+            response = self.client.get("/stats/meantemp/uk?" + query)
+
+            self.assertEqual(response.status_code, 400)
+        mock_get_region_statistics.assert_not_called()
+
+    def test_returns_404_if_value_type_unknown(self):
+        response = self.client.get("/stats/humidity/uk")
+
+        self.assertEqual(response.status_code, 404)
+
+
+class ClimatologyViewTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        caches["time_series"].clear()
+
+    @patch("historical_data.views.get_climatology")
+    def test_calls_get_climatology(self, mock_get_climatology):
+        mock_get_climatology.return_value = {"key": 123}
+        response = self.client.get("/climatology/maxtemp/wales-uk")
+
+        mock_get_climatology.assert_called_with(
+            ValueType.MAX_TEMP, [Region.UK, Region.WALES], None)
+        self.assertEqual(response.content, b"{\"key\": 123}")
+
+    @patch("historical_data.views.get_climatology")
+    def test_passes_month_and_caches_per_month(self, mock_get_climatology):
+        mock_get_climatology.return_value = {"key": 123}
+        self.client.get("/climatology/maxtemp/uk?month=jul")
+        self.client.get("/climatology/maxtemp/uk?month=jul")
+        self.client.get("/climatology/maxtemp/uk")
+
+        mock_get_climatology.assert_any_call(ValueType.MAX_TEMP, [Region.UK], Month.JUL)
+        self.assertEqual(mock_get_climatology.call_count, 2)
+
+    def test_returns_400_if_month_invalid(self):
+        response = self.client.get("/climatology/maxtemp/uk?month=july")
+
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportViewTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        create_or_update_data_point(Region.WALES, 1990, Month.JAN, ValueType.RAINFALL, 120.5)
+        create_or_update_data_point(Region.UK, 1990, Month.FEB, ValueType.MAX_TEMP, 7.5)
+        create_or_update_data_point(Region.UK, 1990, Month.JAN, ValueType.MAX_TEMP, 6.5)
+
+    def _get_content(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_streams_every_datapoint_as_csv(self):
+        response = self.client.get("/export/")
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(self._get_content(response).decode().splitlines(), [
+            "value_type,region,year,month,value",
+            "max_temp,uk,1990,1,6.5",
+            "max_temp,uk,1990,2,7.5",
+            "rainfall,wales,1990,1,120.5"])
+
+    def test_streams_filtered_datapoints_as_ndjson(self):
+        response = self.client.get(
+            "/export/?format=ndjson&value_types=maxtemp,rainfall&regions=uk&start=1990-02")
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line) for line in self._get_content(response).splitlines()],
+            [{
+                "value_type": "max_temp",
+                "region": "uk",
+                "year": 1990,
+                "month": 2,
+                "value": 7.5}])
+
+    def test_streams_gzipped_content_if_accepted(self):
+        response = self.client.get("/export/", HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(
+            decompress(self._get_content(response)).decode().splitlines()[1],
+            "max_temp,uk,1990,1,6.5")
+
+    def test_returns_304_if_etag_matches(self):
+        etag = self.client.get("/export/")["ETag"]
+
+        response = self.client.get("/export/", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_returns_400_if_query_invalid(self):
+        for query in ["format=xml", "value_types=hottemp", "regions=france", "end=1990"]:
+            response = self.client.get("/export/?" + query)
+
+            self.assertEqual(response.status_code, 400)
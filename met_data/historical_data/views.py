@@ -1,13 +1,52 @@
-from django.http import HttpResponse, JsonResponse, HttpResponseNotFound
+import csv
+import json
+import re
+from hashlib import sha1
+
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotFound,
+    JsonResponse,
+    StreamingHttpResponse)
 from django.shortcuts import render
 from django.template import loader
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers)
+from django.utils.text import compress_sequence, compress_string
 
 from historical_data.data import (
     get_time_series,
+    get_compact_time_series,
+    get_batch_time_series,
+    get_aggregate_series,
+    get_rolling_means_and_anomalies,
+    get_region_statistics,
+    get_climatology,
+    get_dataset_version,
+    get_or_compute,
+    iter_data_points,
+    create_etag,
     DataPoint,
     Month,
+    Period,
     Region,
-    ValueType)
+    ValueType,
+    ROLLING_MEAN_WINDOWS)
+
+MAX_WINDOW = 1200
+
+MAX_WINDOWS = 4
+
+EXPORT_FIELDS = ("value_type", "region", "year", "month", "value")
+
+EXPORT_CONTENT_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson"}
+
+EXPORT_ROWS_PER_CHUNK = 500
 
 def index(request):
     template = loader.get_template("historical_data/index.html")
@@ -15,12 +54,346 @@ def index(request):
 
 def time_series(request, value_type_string, regions_string):
     try:
+        value_types = _get_value_types(value_type_string)
+        regions = _get_regions(regions_string)
+    except KeyError:
+        return HttpResponseNotFound()
+    try:
+        max_points = _get_max_points(request)
+        start = _get_year_month(request, "start")
+        end = _get_year_month(request, "end")
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    start_string = _format_year_month(start)
+    end_string = _format_year_month(end)
+    if start and end and start_string > end_string:
+        return HttpResponseBadRequest("start must not be after end.")
+    key_parts = [value_type.name for value_type in value_types]
+    key_parts += [region.name for region in regions]
+    key_parts.append("max-points={}".format(max_points))
+    key_parts.append("start={}".format(start_string))
+    key_parts.append("end={}".format(end_string))
+    compact = _wants_compact_format(request)
+    if len(value_types) > 1:
+        if compact:
+            return HttpResponseBadRequest(
+                "The compact format is only available for one value type.")
+        get_data = get_batch_time_series
+        name = "batch-time-series"
+        value_type_argument = value_types
+    elif compact:
+        get_data = get_compact_time_series
+        name = "time-series-v2"
+        value_type_argument = value_types[0]
+    else:
+        get_data = get_time_series
+        name = "time-series"
+        value_type_argument = value_types[0]
+    response = _cached_json_response(
+        request,
+        name,
+        key_parts,
+        lambda: get_data(
+            value_type_argument,
+            regions,
+            max_points=max_points,
+            start=start,
+            end=end))
+    patch_vary_headers(response, ("Accept",))
+    return response
+
+def aggregates(request, period_string, value_type_string, regions_string):
+    try:
+        period = _get_period(period_string)
         value_type = _get_value_type(value_type_string)
         regions = _get_regions(regions_string)
     except KeyError:
         return HttpResponseNotFound()
-    time_series = get_time_series(value_type, regions)
-    return JsonResponse(time_series)
+    return _cached_json_response(
+        request,
+        "aggregates",
+        [period.name, value_type.name] + [region.name for region in regions],
+        lambda: get_aggregate_series(value_type, period, regions))
+
+def analytics(request, value_type_string, regions_string):
+    try:
+        value_type = _get_value_type(value_type_string)
+        regions = _get_regions(regions_string)
+    except KeyError:
+        return HttpResponseNotFound()
+    try:
+        windows = _get_windows(request)
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    key_parts = [value_type.name] + [region.name for region in regions]
+    key_parts.append("windows={}".format(sha1(
+        ",".join(str(window) for window in windows).encode()).hexdigest()))
+    return _cached_json_response(
+        request,
+        "analytics",
+        key_parts,
+        lambda: get_rolling_means_and_anomalies(value_type, regions, windows))
+
+def stats(request, value_type_string, regions_string):
+    try:
+        value_type = _get_value_type(value_type_string)
+        regions = _get_regions(regions_string)
+    except KeyError:
+        return HttpResponseNotFound()
+    try:
+        start = _get_year_month(request, "start")
+        end = _get_year_month(request, "end")
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    start_string = _format_year_month(start)
+    end_string = _format_year_month(end)
+    if start and end and start_string > end_string:
+        return HttpResponseBadRequest("start must not be after end.")
+    key_parts = [value_type.name] + [region.name for region in regions]
+    key_parts.append("start={}".format(start_string))
+    key_parts.append("end={}".format(end_string))
+    return _cached_json_response(
+        request,
+        "stats",
+        key_parts,
+        lambda: get_region_statistics(value_type, regions, start=start, end=end))
+
+def climatology(request, value_type_string, regions_string):
+    """Responds with the statistics of each calendar month over every year.
+
+    The month query parameter (such as jul) restricts them to one month.
+    """
+    try:
+        value_type = _get_value_type(value_type_string)
+        regions = _get_regions(regions_string)
+    except KeyError:
+        return HttpResponseNotFound()
+    try:
+        month = _get_optional(request, "month", _get_month)
+    except KeyError:
+        return HttpResponseBadRequest("month must be a month, such as jul.")
+    key_parts = [value_type.name] + [region.name for region in regions]
+    key_parts.append("month={}".format(month and month.name))
+    return _cached_json_response(
+        request,
+        "climatology",
+        key_parts,
+        lambda: get_climatology(value_type, regions, month))
+
+def export(request):
+    """Streams every stored datapoint, or those matching the query, as a file.
+
+    The format query parameter chooses "csv" (the default) or "ndjson". The
+    value_types (such as maxtemp,rainfall), regions (such as uk-wales),
+    start and end query parameters filter the datapoints.
+    """
+    export_format = request.GET.get("format", "csv")
+    if export_format not in EXPORT_CONTENT_TYPES:
+        return HttpResponseBadRequest("format must be csv or ndjson.")
+    try:
+        value_types = _get_optional(request, "value_types", _get_value_types)
+        regions = _get_optional(request, "regions", _get_regions)
+    except KeyError:
+        return HttpResponseBadRequest("Unknown value type or region.")
+    try:
+        start = _get_year_month(request, "start")
+        end = _get_year_month(request, "end")
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+
+    key_parts = [
+        export_format,
+        value_types and ",".join(value_type.name for value_type in value_types),
+        regions and ",".join(region.name for region in regions),
+        _format_year_month(start),
+        _format_year_month(end)]
+    gzipped = _accepts_gzip(request)
+    etag = create_etag("export-gzip" if gzipped else "export", key_parts)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        rows = iter_data_points(value_types, regions, start, end)
+        if export_format == "csv":
+            content = _stream_csv(rows)
+        else:
+            content = _stream_ndjson(rows)
+        if gzipped:
+            content = compress_sequence(chunk.encode() for chunk in content)
+        response = StreamingHttpResponse(
+            content, content_type=EXPORT_CONTENT_TYPES[export_format])
+        response["Content-Disposition"] = \
+            "attachment; filename=\"met_data.{}\"".format(export_format)
+        if gzipped:
+            response["Content-Encoding"] = "gzip"
+    response["ETag"] = etag
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+def _stream_csv(rows):
+    """Yields a header line, then the rows as CSV, several rows at a time."""
+    buffer = _LineBuffer()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.flush()
+    for row in rows:
+        writer.writerow(row)
+        if len(buffer.lines) >= EXPORT_ROWS_PER_CHUNK:
+            yield buffer.flush()
+    yield buffer.flush()
+
+def _stream_ndjson(rows):
+    """Yields the rows as JSON objects, one per line, several rows at a time."""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(EXPORT_FIELDS, row))) + "\n")
+        if len(lines) >= EXPORT_ROWS_PER_CHUNK:
+            yield "".join(lines)
+            lines = []
+    yield "".join(lines)
+
+class _LineBuffer:
+    """A file-like object that keeps what csv.writer writes until flushed."""
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+
+    def flush(self):
+        content = "".join(self.lines)
+        self.lines = []
+        return content
+
+def _get_optional(request, parameter, parse):
+    value = request.GET.get(parameter)
+    return None if value is None else parse(value)
+
+def _cached_json_response(request, name, key_parts, compute_data):
+    """Creates a JSON response whose body is cached per dataset version.
+
+    The response has a strong ETag, so that a request whose If-None-Match
+    matches is answered with 304, and its body is gzipped if the client
+    accepts it. Both the JSON and the gzipped body are cached.
+    """
+    version = get_dataset_version()
+    gzipped = _accepts_gzip(request)
+    encoded_name = name + "-gzip" if gzipped else name
+
+    def _get_json():
+        return get_or_compute(
+            name,
+            key_parts,
+            lambda: JsonResponse(compute_data()).content,
+            version)
+
+    etag = create_etag(encoded_name, key_parts, version)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if gzipped:
+            content = get_or_compute(
+                encoded_name,
+                key_parts,
+                lambda: compress_string(_get_json()),
+                version)
+        else:
+            content = _get_json()
+        response = HttpResponse(content, content_type="application/json")
+        if gzipped:
+            response["Content-Encoding"] = "gzip"
+    response["ETag"] = etag
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+def _get_max_points(request):
+    """Gets the max_points query parameter, rounded down to a cache bucket.
+
+    So that a handful of downsampled versions of each series are cached,
+    rather than one for every requested size, max_points is rounded down to
+    a power of two (but not below 3, the smallest useful size).
+
+    Returns:
+      An int, or None if max_points was not given.
+
+    Raises:
+      ValueError if max_points is not an integer of at least 3.
+    """
+    max_points_string = request.GET.get("max_points")
+    if max_points_string is None:
+        return None
+    try:
+        max_points = int(max_points_string)
+    except ValueError:
+        max_points = 0
+    if max_points < 3:
+        raise ValueError("max_points must be an integer of at least 3.")
+    return max(2 ** (max_points.bit_length() - 1), 3)
+
+def _get_windows(request):
+    """Gets the windows query parameter, a comma separated list of months.
+
+    Returns:
+      A sorted tuple of the distinct windows, or the default windows if the
+      parameter was not given.
+
+    Raises:
+      ValueError if any window is not an integer from 1 to MAX_WINDOW, or
+        there are more than MAX_WINDOWS distinct windows.
+    """
+    windows_string = request.GET.get("windows")
+    if windows_string is None:
+        return ROLLING_MEAN_WINDOWS
+    try:
+        windows = {int(window) for window in windows_string.split(",")}
+    except ValueError:
+        windows = {0}
+    if not all(1 <= window <= MAX_WINDOW for window in windows):
+        raise ValueError(
+            "windows must be integers from 1 to {}.".format(MAX_WINDOW))
+    if len(windows) > MAX_WINDOWS:
+        raise ValueError(
+            "At most {} distinct windows may be given.".format(MAX_WINDOWS))
+    return tuple(sorted(windows))
+
+def _get_year_month(request, parameter):
+    """Gets a year-month query parameter, given in the form YYYY-MM.
+
+    Returns:
+      A (year, Month enum) tuple, or None if the parameter was not given.
+
+    Raises:
+      ValueError if the parameter is malformed.
+    """
+    year_month_string = request.GET.get(parameter)
+    if year_month_string is None:
+        return None
+    match = re.fullmatch(r"(\d{4})-(\d{2})", year_month_string)
+    try:
+        return int(match.group(1)), Month(int(match.group(2)))
+    except (AttributeError, ValueError):
+        raise ValueError("{} must be a year and month, such as 1990-01.".format(
+            parameter))
+
+def _format_year_month(year_month):
+    if year_month is None:
+        return None
+    year, month = year_month
+    return "{:04d}-{:02d}".format(year, month.value)
+
+def _wants_compact_format(request):
+    """Whether the request asks for the compact (v2) time series format.
+
+    It can be asked for with a format=v2 query parameter or by accepting the
+    application/vnd.met-data.v2+json media type.
+    """
+    return (
+        request.GET.get("format") == "v2"
+        or "application/vnd.met-data.v2+json" in request.META.get("HTTP_ACCEPT", ""))
+
+def _accepts_gzip(request):
+    return bool(re.search(
+        r"\bgzip\b", request.META.get("HTTP_ACCEPT_ENCODING", "")))
 
 def _get_value_type(value_type_string):
     string_value_mapper = {
@@ -31,10 +404,46 @@ def _get_value_type(value_type_string):
         "rainfall": ValueType.RAINFALL}
     return string_value_mapper[value_type_string]
 
+def _get_value_types(value_types_string):
+    """Gets the distinct value types from a comma separated string.
+
+    Returns:
+      A list of ValueType enums, sorted by value.
+    """
+    value_types = {
+        _get_value_type(s) for s in value_types_string.split(",")}
+    return sorted(value_types, key=lambda value_type: value_type.value)
+
+def _get_period(period_string):
+    string_period_mapper = {
+        "win": Period.WIN,
+        "spr": Period.SPR,
+        "sum": Period.SUM,
+        "aut": Period.AUT,
+        "ann": Period.ANN}
+    return string_period_mapper[period_string]
+
+def _get_month(month_string):
+    string_month_mapper = {
+        "jan": Month.JAN,
+        "feb": Month.FEB,
+        "mar": Month.MAR,
+        "apr": Month.APR,
+        "may": Month.MAY,
+        "jun": Month.JUN,
+        "jul": Month.JUL,
+        "aug": Month.AUG,
+        "sep": Month.SEP,
+        "oct": Month.OCT,
+        "nov": Month.NOV,
+        "dec": Month.DEC}
+    return string_month_mapper[month_string]
+
 def _get_regions(regions_string):
     string_region_mapper = {
         "uk": Region.UK,
         "england": Region.ENGLAND,
         "scotland": Region.SCOTLAND,
         "wales": Region.WALES}
-    return { string_region_mapper[s] for s in regions_string.split("-") }
+    regions = { string_region_mapper[s] for s in regions_string.split("-") }
+    return sorted(regions, key=lambda region: region.value)
@@ -75,14 +75,51 @@ WSGI_APPLICATION = 'met_data.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
 
+# Connections are kept open between requests, and the database is put into
+# write-ahead logging mode when connected (see historical_data.apps), so that
+# requests neither reconnect nor wait for an ingest to finish writing.
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 20,
+        },
     }
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+#
+# Time-series responses are cached in each process's memory by default. Set
+# MET_DATA_CACHE_DIR to share them between processes through the file system.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'time_series': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'time-series',
+    },
+}
+
+if os.environ.get('MET_DATA_CACHE_DIR'):
+    CACHES['time_series'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['MET_DATA_CACHE_DIR'],
+    }
+
+# Only one thread in a process computes a missing cached value at a time. Set
+# MET_DATA_CACHE_LOCK_DIR, along with MET_DATA_CACHE_DIR, to have only one
+# process compute it too, using lock files in that directory.
+
+MET_DATA_CACHE_LOCK_DIR = os.environ.get('MET_DATA_CACHE_LOCK_DIR')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 
@@ -121,3 +158,44 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = '/var/www/met_data/static/'
+
+
+# Met Office data
+# Metadata of previously downloaded Met Office files, used to skip unchanged
+# files when refreshing the data.
+
+MET_DATA_FETCH_CACHE_DIR = os.path.join(BASE_DIR, 'fetch_cache')
+
+# Every file downloaded from the Met Office is kept here, so that the database
+# can be rebuilt offline with get_data_from_met_office --from-archive.
+
+MET_DATA_ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive')
+
+# Set to "memory" to serve the time series from arrays loaded when the app
+# starts, rather than querying the database for each request. Run gunicorn
+# with preload_app so that the workers share the loaded arrays. Set to
+# "snapshot" to serve them from the memory-mapped snapshot file written by
+# get_data_from_met_office instead.
+
+MET_DATA_SERIES_STORE = os.environ.get('MET_DATA_SERIES_STORE')
+
+MET_DATA_SNAPSHOT_PATH = os.path.join(BASE_DIR, 'snapshot', 'series.snapshot')
+
+
+# Logging
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'historical_data': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
@@ -20,5 +20,10 @@ from historical_data import views
 urlpatterns = [
     url(r'^$', views.index),
     url(r'^time-series/(?P<value_type_string>[^/]+)/(?P<regions_string>[^/]+)', views.time_series),
+    url(r'^aggregates/(?P<period_string>[^/]+)/(?P<value_type_string>[^/]+)/(?P<regions_string>[^/]+)', views.aggregates),
+    url(r'^analytics/(?P<value_type_string>[^/]+)/(?P<regions_string>[^/]+)', views.analytics),
+    url(r'^stats/(?P<value_type_string>[^/]+)/(?P<regions_string>[^/]+)', views.stats),
+    url(r'^climatology/(?P<value_type_string>[^/]+)/(?P<regions_string>[^/]+)', views.climatology),
+    url(r'^export/$', views.export),
     url(r'^admin/', admin.site.urls),
 ]